@@ -0,0 +1,57 @@
+"""
+Compare the scalar and batch CardCipher functions
+
+    python benchmarks/card_cipher.py [count ...]
+
+Needs the server's dependencies installed (`pip install -e .`)
+"""
+
+import random
+import sys
+from time import perf_counter
+
+import environment  # noqa: F401
+
+from v8_server.common.card import CardCipher
+
+
+# The scalar functions are only timed on this many cards and scaled up, running them
+# over a million cards takes minutes
+SCALAR_SAMPLE = 10_000
+
+
+def timed(func, values):
+    start = perf_counter()
+    result = func(values)
+    return result, perf_counter() - start
+
+
+def bench(count: int) -> None:
+    cardids = [
+        random.choice(["E004", "0120"]) + f"{random.getrandbits(48):012X}"
+        for _ in range(count)
+    ]
+    sample = cardids[:SCALAR_SAMPLE]
+
+    encoded, encode_many = timed(CardCipher.encode_many, cardids)
+    decoded, decode_many = timed(CardCipher.decode_many, encoded)
+    scalar, encode = timed(lambda v: [CardCipher.encode(c) for c in v], sample)
+    _, decode = timed(lambda v: [CardCipher.decode(c) for c in v], scalar)
+
+    assert decoded == cardids
+    assert scalar == encoded[:SCALAR_SAMPLE]
+
+    scale = count / len(sample)
+    for name, many, one in (
+        ("encode", encode_many, encode),
+        ("decode", decode_many, decode),
+    ):
+        print(
+            f"{count:>9} {name}: batch {many:8.3f}s  scalar {one * scale:8.3f}s  "
+            f"({one * scale / many:5.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    for count in [int(c) for c in sys.argv[1:]] or [10_000, 100_000, 1_000_000]:
+        bench(count)
@@ -0,0 +1,273 @@
+"""
+Micro-benchmarks for every codec stage a request and response go through: template
+rendering, kbin encoding and decoding, Lz77, ARC4 and card ID conversion. Each stage
+runs on the response templates and on the requests of a full credit.
+
+    python benchmarks/codecs.py [--min-time SECONDS] [--filter TEXT] [--output PATH]
+                                [--compare PATH]
+
+Results are written as JSON to benchmarks/results/ (or `--output`). Pass an earlier
+result file to `--compare` to print the change in ops/s for every benchmark, results
+are only comparable between runs on the same machine.
+
+Needs the server's dependencies installed (`pip install -e .`)
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import environment  # noqa: F401
+from kbinxml import KBinXML
+from lxml import etree
+from payloads import gameend_request, session_requests
+
+from v8_server.common.card import CardCipher
+from v8_server.eamuse.utils.arc4 import EAmuseARC4
+from v8_server.eamuse.utils.keypool import ResponseKey
+from v8_server.eamuse.utils.lz77 import Lz77
+from v8_server.eamuse.utils.lz77_fuzz import TEMPLATE_PATH, template_args
+from v8_server.eamuse.xml.utils import load_xml_template
+
+
+RESULTS_PATH = Path(__file__).parent / "results"
+
+KEY = bytes.fromhex("5f8c2b1a1234")
+RESPONSE_INFO = "1-5f8c2b1a-1234"
+# Same as the server's default RESPONSE_KEY_PREFIX
+RESPONSE_KEY_PREFIX = 4096
+
+CARD_BATCH = 1000
+
+
+class Payload(NamedTuple):
+    value: Any
+    # Bytes processed by one operation on this payload
+    size: int
+
+
+class Bench(NamedTuple):
+    name: str
+    func: Callable[[Any], Any]
+    payloads: Sequence[Payload]
+
+
+def measure(bench: Bench, min_time: float) -> Dict[str, Any]:
+    """
+    Run the benchmark over all of its payloads until `min_time` seconds have passed,
+    then run it once more per payload under tracemalloc for the allocation figures
+    """
+    func = bench.func
+    values = [payload.value for payload in bench.payloads]
+    round_bytes = sum(payload.size for payload in bench.payloads)
+
+    rounds = 0
+    start = perf_counter()
+    while True:
+        for value in values:
+            func(value)
+        rounds += 1
+        seconds = perf_counter() - start
+        if seconds >= min_time:
+            break
+
+    peaks = []
+    for value in values:
+        tracemalloc.start()
+        func(value)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peaks.append(peak)
+
+    ops = rounds * len(values)
+    return {
+        "ops": ops,
+        "seconds": seconds,
+        "ops_per_sec": ops / seconds,
+        "mb_per_sec": rounds * round_bytes / seconds / 1e6,
+        "alloc_peak_mean": sum(peaks) / len(peaks),
+        "alloc_peak_max": max(peaks),
+        "payloads": len(values),
+        "payload_bytes": round_bytes,
+    }
+
+
+def payload_sets() -> Dict[str, List[bytes]]:
+    """
+    The kbin encoded response templates, and the requests of a full credit including
+    one for a six song credit
+    """
+    templates = []
+    for path in sorted(TEMPLATE_PATH.glob("*/*.xml")):
+        xml = load_xml_template(path.parent.name, path.stem, template_args(path))
+        templates.append(KBinXML(xml).to_binary())
+
+    calls = [call for _, call in session_requests()]
+    calls.append(gameend_request(musicids=range(1849, 1855)))
+    requests = [KBinXML(etree.tostring(call)).to_binary() for call in calls]
+
+    return {"templates": templates, "requests": requests}
+
+
+def benchmarks() -> List[Bench]:
+    benches = []
+
+    templates = [
+        Payload((path.parent.name, path.stem, template_args(path)), path.stat().st_size)
+        for path in sorted(TEMPLATE_PATH.glob("*/*.xml"))
+    ]
+    benches.append(Bench("template.render", lambda t: load_xml_template(*t), templates))
+
+    response_key = ResponseKey(RESPONSE_INFO, RESPONSE_KEY_PREFIX)
+    lz = Lz77()
+    lz_high = Lz77(high_ratio=True)
+    for set_name, binaries in payload_sets().items():
+        texts = [KBinXML(binary).to_text().encode("UTF-8") for binary in binaries]
+        compressed = [lz.compress(binary) for binary in binaries]
+        raw = [Payload(binary, len(binary)) for binary in binaries]
+
+        benches += [
+            Bench(
+                f"kbin.encode[{set_name}]",
+                lambda text: KBinXML(text).to_binary(),
+                [Payload(text, len(text)) for text in texts],
+            ),
+            Bench(f"kbin.decode[{set_name}]", lambda b: KBinXML(b).to_text(), raw),
+            Bench(f"lz77.compress[{set_name}]", lz.compress, raw),
+            Bench(f"lz77.compress_high[{set_name}]", lz_high.compress, raw),
+            Bench(
+                f"lz77.decompress[{set_name}]",
+                lz.decompress_buffer,
+                [
+                    Payload(data, len(binary))
+                    for data, binary in zip(compressed, binaries)
+                ],
+            ),
+            Bench(
+                f"arc4.encrypt[{set_name}]",
+                lambda b: EAmuseARC4(KEY).encrypt(b),
+                raw,
+            ),
+            Bench(
+                f"arc4.decrypt_into[{set_name}]",
+                lambda b: EAmuseARC4(KEY).decrypt_into(b),
+                [Payload(bytearray(binary), len(binary)) for binary in binaries],
+            ),
+            Bench(
+                f"response_key.encrypt[{set_name}]",
+                # The key schedule and keystream prefix are paid for by the key pool
+                # ahead of time, so one key is reused to leave them out
+                response_key.encrypt,
+                raw,
+            ),
+        ]
+
+    rng = random.Random(573)
+    cardids = [
+        rng.choice(["E004", "0120"]) + f"{rng.getrandbits(48):012X}"
+        for _ in range(CARD_BATCH)
+    ]
+    display_ids = CardCipher.encode_many(cardids)
+    benches += [
+        Bench(
+            "card.encode", CardCipher.encode, [Payload(c, 16) for c in cardids[:100]]
+        ),
+        Bench(
+            "card.decode",
+            CardCipher.decode,
+            [Payload(d, 16) for d in display_ids[:100]],
+        ),
+        Bench(
+            f"card.encode_many[{CARD_BATCH}]",
+            CardCipher.encode_many,
+            [Payload(cardids, 16 * CARD_BATCH)],
+        ),
+        Bench(
+            f"card.decode_many[{CARD_BATCH}]",
+            CardCipher.decode_many,
+            [Payload(display_ids, 16 * CARD_BATCH)],
+        ),
+    ]
+
+    return benches
+
+
+def compare(results: Dict[str, Any], previous_path: Path) -> None:
+    previous = json.loads(previous_path.read_text())
+    if previous["machine"] != results["machine"]:
+        print(
+            f"Warning: {previous_path} was run on a different machine "
+            f"({previous['machine']['platform']}), the numbers aren't comparable"
+        )
+
+    print()
+    print(f"{'benchmark':<36} {'before':>12} {'after':>12} {'change':>8}")
+    for name, result in results["results"].items():
+        before = previous["results"].get(name)
+        if before is None:
+            continue
+        after = result["ops_per_sec"]
+        change = after / before["ops_per_sec"] - 1
+        print(
+            f"{name:<36} {before['ops_per_sec']:>12.1f} {after:>12.1f} "
+            f"{change:>+8.1%}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the codec stages")
+    parser.add_argument("--min-time", type=float, default=0.5)
+    parser.add_argument("--filter", help="Only run benchmarks containing this text")
+    parser.add_argument("--output", type=Path, help="Result file to write")
+    parser.add_argument("--compare", type=Path, help="Earlier result file")
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Any] = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+        },
+        "min_time": args.min_time,
+        "results": {},
+    }
+
+    print(
+        f"{'benchmark':<36} {'ops/s':>12} {'MB/s':>8} {'peak alloc':>12} "
+        f"{'max alloc':>12}"
+    )
+    for bench in benchmarks():
+        if args.filter and args.filter not in bench.name:
+            continue
+
+        result = measure(bench, args.min_time)
+        results["results"][bench.name] = result
+        print(
+            f"{bench.name:<36} {result['ops_per_sec']:>12.1f} "
+            f"{result['mb_per_sec']:>8.2f} {result['alloc_peak_mean']:>12.0f} "
+            f"{result['alloc_peak_max']:>12}"
+        )
+
+    output = args.output
+    if output is None:
+        RESULTS_PATH.mkdir(exist_ok=True)
+        output = RESULTS_PATH / f"codecs-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {output}")
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
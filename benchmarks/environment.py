@@ -0,0 +1,27 @@
+"""
+Set up the environment the benchmarks import the server in. Every benchmark imports
+this before anything from `v8_server`, since the app picks its config, creates its
+tables and opens its log files when it is first imported.
+
+- The repository root is put on `sys.path`, so the benchmarks also run from a checkout
+  that hasn't been installed with `pip install -e .`
+- The app is imported with the test config (an in-memory database), the benchmarks
+  point it at their own database afterwards
+- Logs and request captures go to a temporary directory instead of the repo's `logs/`
+
+Setting `ENV` or `V8_LOG_PATH` yourself overrides the last two.
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("ENV", "test")
+os.environ.setdefault("V8_LOG_PATH", tempfile.mkdtemp(prefix="v8_server_logs_"))
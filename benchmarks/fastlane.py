@@ -0,0 +1,131 @@
+"""
+Measure the per-request overhead the WSGI fast lane (`v8_server.wsgi`) saves over the
+Flask app, by calling both WSGI apps directly with the same cabinet requests.
+
+    python benchmarks/fastlane.py [--min-time SECONDS] [--plain] [--output PATH]
+
+Each request is timed from calling the WSGI app to having the response body, with a
+fresh environ built beforehand. Both apps run the same handlers on the same fresh
+SQLite database, so the difference is the routing, request context, request proxy and
+response object that the fast lane skips. `services.get` and `pcbtracker.alive` don't
+touch the database, `cardmng.inquire` does.
+
+Results are written as JSON to benchmarks/results/ (or `--output`).
+
+Needs the server's dependencies installed (`pip install -e .`)
+"""
+
+import argparse
+import json
+import random
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional
+
+import environment  # noqa: F401
+from loadgen import encode_request, percentile, service_path, setup_database
+from lxml import etree
+from payloads import cabinet_request, services_request
+from werkzeug.test import EnvironBuilder
+
+from v8_server import app
+from v8_server.eamuse.services import ServiceRequest
+from v8_server.wsgi import ServiceFastLane
+
+
+RESULTS_PATH = Path(__file__).parent / "results"
+
+CALLS: Dict[str, Callable[[], etree._Element]] = {
+    "services.get": services_request,
+    "pcbtracker.alive": lambda: cabinet_request("pcbtracker.alive"),
+    "cardmng.inquire": lambda: cabinet_request("cardmng.inquire"),
+}
+
+
+def measure(
+    wsgi_app: Callable, call: etree._Element, plain: bool, min_time: float
+) -> Dict[str, Any]:
+    compression = "none" if plain else "lz77"
+    path = service_path(call[0].tag)
+    rng = random.Random(573)
+
+    def start_response(status: str, headers: List, exc_info=None) -> None:
+        if not status.startswith("200"):
+            raise Exception(f"{path} returned {status}")
+
+    timings = []
+    start = perf_counter()
+    while perf_counter() - start < min_time:
+        body, headers = encode_request(call, compression, not plain, rng)
+        environ = EnvironBuilder(
+            path=path, method="POST", data=body, headers=headers
+        ).get_environ()
+
+        call_start = perf_counter()
+        b"".join(wsgi_app(environ, start_response))
+        timings.append(perf_counter() - call_start)
+
+    timings.sort()
+    return {
+        "requests": len(timings),
+        "mean_us": sum(timings) / len(timings) * 1e6,
+        "p50_us": percentile(timings, 50) * 1e6,
+        "p99_us": percentile(timings, 99) * 1e6,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Compare the fast lane with Flask")
+    parser.add_argument("--min-time", type=float, default=2.0)
+    parser.add_argument("--plain", action="store_true", help="No encryption/lz77")
+    parser.add_argument("--output", type=Path, help="Result file to write")
+    args = parser.parse_args(argv)
+
+    setup_database(Path(tempfile.mkdtemp()) / "fastlane.db")
+    ServiceRequest.LOG_DIR = Path(tempfile.mkdtemp())
+    apps = {"flask": app.wsgi_app, "fastlane": ServiceFastLane(app, app.wsgi_app)}
+
+    print(
+        f"{'call':<18} {'flask us':>9} {'lane us':>9} {'saved us':>9} {'saved':>7} "
+        f"{'flask p99':>10} {'lane p99':>9}"
+    )
+    results: Dict[str, Any] = {}
+    for name, make_call in CALLS.items():
+        call = make_call()
+        # Warm up both apps, the first inquire also creates the card's user
+        for wsgi_app in apps.values():
+            measure(wsgi_app, call, args.plain, 0.1)
+
+        flask = measure(apps["flask"], call, args.plain, args.min_time)
+        lane = measure(apps["fastlane"], call, args.plain, args.min_time)
+        results[name] = {"flask": flask, "fastlane": lane}
+
+        saved = flask["mean_us"] - lane["mean_us"]
+        print(
+            f"{name:<18} {flask['mean_us']:>9.0f} {lane['mean_us']:>9.0f} "
+            f"{saved:>9.0f} {saved / flask['mean_us']:>7.1%} "
+            f"{flask['p99_us']:>10.0f} {lane['p99_us']:>9.0f}"
+        )
+
+    output = args.output
+    if output is None:
+        RESULTS_PATH.mkdir(exist_ok=True)
+        output = RESULTS_PATH / f"fastlane-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.write_text(
+        json.dumps(
+            {
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "plain": args.plain,
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
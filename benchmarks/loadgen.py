@@ -0,0 +1,467 @@
+"""
+Load generator that plays full GFDM sessions against the server, the way a cabinet
+does: the services request and boot calls, then for every credit a card login
+(cardmng, cardutil), gametop, gameend and customize. Requests are ARC4 encrypted and
+Lz77 compressed like on a real cabinet.
+
+    python benchmarks/loadgen.py [--cabinets N] [--credits N] [--cards N]
+                                 [--url URL] [--asgi] [--database PATH] [--plain]
+                                 [--seed N] [--output PATH]
+
+Without `--url` the server runs in this process behind the Flask test client (or the
+ASGI app with `--asgi`), on a fresh SQLite database (`--database`, a temporary file by
+default), so the generator and the server share the CPU. Point `--url` at a running
+server (`http://127.0.0.1:8000`) for numbers that only include the server. Every
+virtual cabinet has its own set of cards, about half of the credits are played by
+returning cards with the default `--cards`.
+
+Needs the server's dependencies installed (`pip install -e .`)
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import random
+import sys
+import tempfile
+import threading
+from binascii import unhexlify
+from collections import defaultdict
+from functools import partial
+from pathlib import Path
+from time import perf_counter, time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+from urllib.parse import urlsplit
+
+import environment  # noqa: F401
+from kbinxml import KBinXML
+from lxml import etree
+from payloads import cabinet_request, gameend_request, services_request
+
+from v8_server.eamuse.services import Services, ServiceType
+from v8_server.eamuse.utils.arc4 import EAmuseARC4
+from v8_server.eamuse.utils.lz77 import Lz77
+from v8_server.model import song
+
+
+# Route each module is posted to, anything else goes to the local service
+SERVICE_ROUTES = {
+    "pcbtracker": ServiceType.PCBTRACKER,
+    "cardmng": ServiceType.CARDMNG,
+}
+
+# Cabinets compress requests, the high ratio mode is used because it is the fastest
+LZ77 = Lz77(high_ratio=True)
+
+PIN = "1234"
+
+# Songs played per credit
+STAGES = 3
+
+Response = Tuple[int, bytes, Dict[str, str]]
+
+
+class LoadException(Exception):
+    pass
+
+
+class TestClientTransport(object):
+    """
+    Posts to the app in this process through a Flask test client
+    """
+
+    def __init__(self) -> None:
+        from v8_server import app
+
+        self.client = app.test_client()
+
+    def post(self, path: str, body: bytes, headers: Dict[str, str]) -> Response:
+        resp = self.client.post(path, data=body, headers=headers)
+        return resp.status_code, resp.data, {k.lower(): v for k, v in resp.headers}
+
+
+class HttpTransport(object):
+    """
+    Posts to a running server over a keep-alive HTTP connection
+    """
+
+    def __init__(self, url: str) -> None:
+        parts = urlsplit(url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self.connection: Optional[http.client.HTTPConnection] = None
+
+    def post(self, path: str, body: bytes, headers: Dict[str, str]) -> Response:
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port)
+        try:
+            self.connection.request("POST", self.prefix + path, body, headers)
+            resp = self.connection.getresponse()
+            return (
+                resp.status,
+                resp.read(),
+                {k.lower(): v for k, v in resp.getheaders()},
+            )
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            raise
+
+
+class AsgiTransport(object):
+    """
+    Posts to the ASGI app (`v8_server.asgi`) in this process. The app runs on an event
+    loop in a background thread, one transport can be shared by every cabinet.
+    """
+
+    def __init__(self) -> None:
+        from v8_server.asgi import application
+
+        self.application = application
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    def post(self, path: str, body: bytes, headers: Dict[str, str]) -> Response:
+        future = asyncio.run_coroutine_threadsafe(
+            self._post(path, body, headers), self.loop
+        )
+        return future.result()
+
+    async def _post(self, path: str, body: bytes, headers: Dict[str, str]) -> Response:
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": path,
+            "query_string": b"",
+            "headers": [
+                (k.lower().encode("latin-1"), v.encode("latin-1"))
+                for k, v in headers.items()
+            ],
+        }
+        sent: List[Dict[str, Any]] = []
+
+        async def receive() -> Dict[str, Any]:
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message: Dict[str, Any]) -> None:
+            sent.append(message)
+
+        await self.application(scope, receive, send)
+        start, response = sent
+        return (
+            start["status"],
+            response["body"],
+            {k.decode("latin-1"): v.decode("latin-1") for k, v in start["headers"]},
+        )
+
+    def close(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.application.shutdown()
+
+
+def service_path(module: str) -> str:
+    """
+    The route a cabinet posts calls to `module` to
+    """
+    if module == "services":
+        return Services.SERVICES_ROUTE
+    return f"{Services.SERVICE_ROUTE}/{SERVICE_ROUTES.get(module, ServiceType.LOCAL)}/"
+
+
+def encode_request(
+    call: etree._Element, compression: str, encrypted: bool, rng: random.Random
+) -> Tuple[bytes, Dict[str, str]]:
+    """
+    Encode a call the way a cabinet sends it, returning the body and the headers
+    """
+    body = KBinXML(etree.tostring(call)).to_binary()
+    headers = {"Content-Type": "application/octet-stream", "x-compress": compression}
+    if compression == "lz77":
+        body = LZ77.compress(body)
+    if encrypted:
+        info = f"1-{int(time()):08x}-{rng.getrandbits(16):04x}"
+        body = EAmuseARC4(unhexlify(info[2:].replace("-", ""))).encrypt(body)
+        headers["x-eamuse-info"] = info
+    return body, headers
+
+
+def decode_response(data: bytes, headers: Dict[str, str]) -> etree._Element:
+    if "x-eamuse-info" in headers:
+        info = headers["x-eamuse-info"]
+        data = EAmuseARC4(unhexlify(info[2:].replace("-", ""))).decrypt(data)
+    if headers.get("x-compress") == "lz77":
+        data = LZ77.decompress(data)
+    return etree.fromstring(KBinXML(data).to_text().encode("UTF-8"))
+
+
+class Cabinet(object):
+    """
+    One virtual cabinet. Latencies are only the round trip to the server, encoding
+    the request and decoding the response are left out.
+    """
+
+    def __init__(
+        self,
+        transport: Any,
+        cards: Sequence[str],
+        musicids: Sequence[int],
+        plain: bool,
+        rng: random.Random,
+    ) -> None:
+        self.transport = transport
+        self.cards = cards
+        self.musicids = musicids
+        self.plain = plain
+        self.rng = rng
+
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.credits = 0
+
+    def call(self, name: str, call: etree._Element) -> etree._Element:
+        compression = "none" if self.plain else "lz77"
+        body, headers = encode_request(call, compression, not self.plain, self.rng)
+        path = service_path(name.split(".")[0])
+
+        start = perf_counter()
+        try:
+            status, data, resp_headers = self.transport.post(path, body, headers)
+        except Exception:
+            self.errors[name] += 1
+            raise
+        self.latencies[name].append(perf_counter() - start)
+
+        if status != 200:
+            self.errors[name] += 1
+            raise LoadException(f"{name} returned {status}")
+
+        return decode_response(data, resp_headers)
+
+    def boot(self) -> None:
+        self.call("services.get", services_request())
+        for name in ("pcbtracker.alive", "shopinfo.regist", "gameinfo.get"):
+            self.call(name, cabinet_request(name))
+
+    def credit(self, cardid: str) -> None:
+        inquire = self.call(
+            "cardmng.inquire", cabinet_request("cardmng.inquire", cardid=cardid)
+        )[0]
+
+        if inquire.get("newflag") == "1":
+            request = cabinet_request("cardmng.getrefid", cardid=cardid)
+            request[0].set("passwd", PIN)
+            refid = self.call("cardmng.getrefid", request)[0].get("refid")
+        else:
+            refid = inquire.get("refid")
+            request = cabinet_request("cardmng.authpass", refid, cardid)
+            request[0].set("pass", PIN)
+            self.call("cardmng.authpass", request)
+
+        check = self.call(
+            "cardutil.check", cabinet_request("cardutil.check", refid, cardid)
+        )
+        if check.find("cardutil/card/name") is None:
+            self.call(
+                "cardutil.regist", cabinet_request("cardutil.regist", refid, cardid)
+            )
+
+        self.call("gametop.get", cabinet_request("gametop.get", refid, cardid))
+
+        musicids = self.rng.sample(self.musicids, STAGES)
+        scores = [self.rng.randrange(1_000_000) for _ in musicids]
+        self.call("gameend.regist", gameend_request(refid, musicids, scores))
+
+        self.call(
+            "customize.regist", cabinet_request("customize.regist", refid, cardid)
+        )
+        self.credits += 1
+
+    def run(self, credits: int) -> None:
+        try:
+            self.boot()
+        except Exception as e:
+            print(f"Cabinet failed to boot: {e!r}", file=sys.stderr)
+            return
+
+        for _ in range(credits):
+            try:
+                self.credit(self.rng.choice(self.cards))
+            except Exception as e:
+                print(f"Credit failed: {e!r}", file=sys.stderr)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Nearest rank percentile of sorted values
+    """
+    index = max(0, min(len(values) - 1, round(pct / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def call_stats(
+    latencies: Dict[str, List[float]], errors: Dict[str, int], seconds: float
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Count, rate and latency percentiles of every call
+    """
+    calls = {}
+    for name in sorted(set(latencies) | set(errors)):
+        values = sorted(latencies.get(name, []))
+        calls[name] = {
+            "count": len(values),
+            "errors": errors.get(name, 0),
+            "per_sec": len(values) / seconds,
+            **{
+                f"p{pct}_ms": percentile(values, pct) * 1000 if values else None
+                for pct in (50, 90, 99)
+            },
+            "max_ms": values[-1] * 1000 if values else None,
+        }
+    return calls
+
+
+def print_calls(calls: Dict[str, Dict[str, Any]]) -> None:
+    print(
+        f"{'call':<20} {'count':>6} {'errors':>6} {'req/s':>8} {'p50 ms':>8} "
+        f"{'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    )
+    for name, call in calls.items():
+        timings = " ".join(
+            f"{call[key]:>8.1f}" if call[key] is not None else f"{'-':>8}"
+            for key in ("p50_ms", "p90_ms", "p99_ms", "max_ms")
+        )
+        print(
+            f"{name:<20} {call['count']:>6} {call['errors']:>6} "
+            f"{call['per_sec']:>8.1f} {timings}"
+        )
+
+
+def summarize(cabinets: List[Cabinet], seconds: float) -> Dict[str, Any]:
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    for cabinet in cabinets:
+        for name, values in cabinet.latencies.items():
+            latencies[name] += values
+        for name, count in cabinet.errors.items():
+            errors[name] += count
+
+    calls = call_stats(latencies, errors, seconds)
+    credits = sum(cabinet.credits for cabinet in cabinets)
+    return {
+        "cabinets": len(cabinets),
+        "seconds": seconds,
+        "credits": credits,
+        "credits_per_sec": credits / seconds,
+        "requests_per_sec": sum(call["count"] for call in calls.values()) / seconds,
+        "errors": sum(errors.values()),
+        "calls": calls,
+    }
+
+
+def make_cabinets(
+    count: int,
+    cards_per_cabinet: int,
+    transport: Callable[[], Any],
+    plain: bool,
+    rng: random.Random,
+) -> List[Cabinet]:
+    """
+    Create `count` cabinets with their own cards, getting each one's transport from
+    `transport`
+    """
+    catalog = song.read_mdb() if song.MDB_PATH.exists() else {}
+    musicids = sorted(catalog) or list(range(1849, 1849 + 100))
+
+    cabinets = []
+    for _ in range(count):
+        cards = [f"E004{rng.getrandbits(48):012X}" for _ in range(cards_per_cabinet)]
+        cabinet_rng = random.Random(rng.getrandbits(64))
+        cabinets.append(Cabinet(transport(), cards, musicids, plain, cabinet_rng))
+    return cabinets
+
+
+def play(cabinets: List[Cabinet], credits: int) -> Dict[str, Any]:
+    """
+    Let every cabinet play `credits` credits on its own thread, and summarize
+    """
+    threads = [
+        threading.Thread(target=cabinet.run, args=(credits,)) for cabinet in cabinets
+    ]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(cabinets, perf_counter() - start)
+
+
+def setup_database(path: Union[Path, str]) -> None:
+    """
+    Point the in-process server at a SQLite file (or any SQLAlchemy URI), creating
+    the tables if needed
+    """
+    from v8_server import app, db
+
+    uri = str(path)
+    if "://" not in uri:
+        uri = f"sqlite+pysqlite:///{uri}"
+    app.config["SQLALCHEMY_DATABASE_URI"] = uri
+    with app.app_context():
+        db.create_all()
+        song.reload_catalog()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Simulate cabinets playing credits")
+    parser.add_argument("--cabinets", type=int, default=4)
+    parser.add_argument("--credits", type=int, default=5, help="Credits per cabinet")
+    parser.add_argument("--cards", type=int, help="Cards per cabinet")
+    parser.add_argument("--url", help="Server to test instead of the in-process app")
+    parser.add_argument("--database", type=Path, help="SQLite file for the app")
+    parser.add_argument("--asgi", action="store_true", help="Use the ASGI app")
+    parser.add_argument("--plain", action="store_true", help="No encryption/lz77")
+    parser.add_argument("--seed", type=int, default=573)
+    parser.add_argument("--output", type=Path, help="Write the results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.url is None:
+        database = args.database
+        if database is None:
+            database = Path(tempfile.mkdtemp()) / "loadgen.db"
+        setup_database(database)
+        print(f"Using database {database}")
+
+    transport: Callable[[], Any] = TestClientTransport
+    if args.url is not None:
+        transport = partial(HttpTransport, args.url)
+    elif args.asgi:
+        shared = AsgiTransport()
+        transport = lambda: shared  # noqa: E731
+
+    rng = random.Random(args.seed)
+    cards_per_cabinet = args.cards or max(1, (args.credits + 1) // 2)
+    cabinets = make_cabinets(
+        args.cabinets, cards_per_cabinet, transport, args.plain, rng
+    )
+    result = play(cabinets, args.credits)
+
+    print_calls(result["calls"])
+    print(
+        f"\n{result['cabinets']} cabinets, {result['credits']} credits in "
+        f"{result['seconds']:.1f}s: {result['credits_per_sec']:.2f} credits/s, "
+        f"{result['requests_per_sec']:.1f} requests/s, {result['errors']} errors"
+    )
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(result, indent=2))
+
+    if result["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
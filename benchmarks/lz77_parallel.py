@@ -0,0 +1,52 @@
+"""
+Compare `Lz77.compress` with `Lz77.compress_parallel` for increasing worker counts
+
+    python benchmarks/lz77_parallel.py [size in KiB]
+
+Needs the server's dependencies installed (`pip install -e .`)
+"""
+
+import os
+import random
+import sys
+from time import perf_counter
+
+import environment  # noqa: F401
+
+from v8_server.eamuse.utils.lz77 import Lz77
+
+
+def sample_data(size: int) -> bytes:
+    # Something that compresses about as well as kbin responses do
+    words = [os.urandom(random.randint(3, 12)) for _ in range(500)]
+    data = b""
+    while len(data) < size:
+        data += b"".join(random.choices(words, k=1000))
+    return data[:size]
+
+
+def bench(size: int) -> None:
+    data = sample_data(size)
+    lz = Lz77()
+
+    start = perf_counter()
+    serial = lz.compress(data)
+    baseline = perf_counter() - start
+    print(f"{size // 1024} KiB serial: {baseline:.2f}s, {len(serial)} bytes")
+
+    workers = 2
+    while workers <= max(os.cpu_count() or 1, 2):
+        start = perf_counter()
+        compressed = lz.compress_parallel(data, workers=workers)
+        elapsed = perf_counter() - start
+
+        assert lz.decompress(compressed) == data
+        print(
+            f"{size // 1024} KiB {workers} workers: {elapsed:.2f}s "
+            f"({baseline / elapsed:.1f}x), {len(compressed)} bytes"
+        )
+        workers *= 2
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 1024 * 1024)
@@ -0,0 +1,45 @@
+"""
+Compare compression ratio and speed of the default and high ratio Lz77 modes on the
+kbin encoded response templates
+
+    python benchmarks/lz77_ratio.py
+
+Needs the server's dependencies installed (`pip install -e .`)
+"""
+
+from time import perf_counter
+
+import environment  # noqa: F401
+
+from v8_server.eamuse.utils.lz77 import Lz77
+from v8_server.eamuse.utils.lz77_fuzz import template_payloads
+
+
+def main() -> None:
+    corpus = template_payloads()
+    modes = {"default": Lz77(), "high": Lz77(high_ratio=True)}
+    totals = {name: [0, 0.0] for name in modes}
+    raw = sum(len(data) for _, data in corpus)
+
+    print(f"{'template':<40} {'size':>6} {'default':>8} {'high':>8}")
+    for name, data in corpus:
+        sizes = []
+        for mode, lz in modes.items():
+            start = perf_counter()
+            compressed = lz.compress(data)
+            totals[mode][1] += perf_counter() - start
+            totals[mode][0] += len(compressed)
+            sizes.append(len(compressed))
+            assert lz.decompress(compressed) == data
+        print(f"{name:<40} {len(data):>6} {sizes[0]:>8} {sizes[1]:>8}")
+
+    print()
+    for mode, (size, seconds) in totals.items():
+        print(
+            f"{mode:>8}: {size} bytes, ratio {size / raw:.3f}, {seconds * 1000:.1f}ms, "
+            f"{raw / seconds / 1024:.0f} KiB/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Representative payloads for the benchmarks.
+
+Requests are built from the example requests documented on the service handlers, so
+they have the same shape and size as what a cabinet sends.
+"""
+
+import re
+from copy import deepcopy
+from typing import Dict, List, Sequence, Tuple, Type
+
+import environment  # noqa: F401
+from lxml import etree
+
+from v8_server.eamuse.services import (
+    cardmng,
+    cardutil,
+    customize,
+    gameend,
+    gameinfo,
+    gametop,
+    pcbtracker,
+    shopinfo,
+)
+from v8_server.eamuse.utils.lz77_fuzz import template_payloads
+
+
+__all__ = [
+    "cabinet_request",
+    "example_request",
+    "gameend_request",
+    "services_request",
+    "session_requests",
+    "template_payloads",
+]
+
+CALL_RE = re.compile(r"<call .*</call>", re.S)
+
+# Handlers of every call a cabinet makes for a credit, in order
+SESSION_HANDLERS: Dict[str, Type] = {
+    "pcbtracker.alive": pcbtracker.Alive,
+    "shopinfo.regist": shopinfo.Regist,
+    "gameinfo.get": gameinfo.Get,
+    "cardmng.inquire": cardmng.Inquire,
+    "cardmng.getrefid": cardmng.Getrefid,
+    "cardmng.authpass": cardmng.Authpass,
+    "cardutil.check": cardutil.Check,
+    "cardutil.regist": cardutil.Regist,
+    "gametop.get": gametop.Get,
+    "gameend.regist": gameend.Regist,
+    "customize.regist": customize.Regist,
+}
+
+# Identifiers used in the example requests
+REFID = "E9D2DD02072F05C5"
+CARDID = "E00401007F7AD7A4"
+
+
+def example_request(handler: Type) -> etree._Element:
+    """
+    Parse the example request in the docstring of a service handler
+    """
+    match = CALL_RE.search(handler.__doc__ or "")
+    if match is None:
+        raise ValueError(f"{handler.__qualname__} has no example request")
+
+    parser = etree.XMLParser(remove_blank_text=True)
+    call = etree.fromstring(match.group(0).encode("UTF-8"), parser)
+    # Long arrays are wrapped over several lines in the docstrings
+    for element in call.iter():
+        if element.text is not None:
+            element.text = " ".join(element.text.split())
+    return call
+
+
+def gameend_request(
+    refid: str = REFID,
+    musicids: Sequence[int] = (1849, 1850, 1851),
+    scores: Sequence[int] = (),
+) -> etree._Element:
+    """
+    A gameend.regist request for a credit with one stage (and one play data entry) per
+    music ID, which is what a cabinet sends at the end of a normal credit
+    """
+    call = example_request(gameend.Regist)
+    module = call[0]
+    module.find("player/playerinfo/refid").text = refid
+
+    hitchart = module.find("hitchart")
+    modedata = module.find("modedata")
+    player = module.find("player")
+    stage = modedata.find("stage")
+    playdata = player.find("playdata")
+    for element in (*hitchart.findall("musicid"), stage, playdata):
+        element.getparent().remove(element)
+
+    session = modedata.find("session")
+    for no, musicid in enumerate(musicids, start=1):
+        entry = etree.SubElement(hitchart, "musicid", __type="s32")
+        entry.text = str(musicid)
+
+        new_stage = deepcopy(stage)
+        new_stage.find("no").text = str(no)
+        new_stage.find("musicid").text = str(musicid)
+        session.addprevious(new_stage)
+
+        new_playdata = deepcopy(playdata)
+        new_playdata.find("no").text = str(no)
+        if no <= len(scores):
+            new_playdata.find("score").text = str(scores[no - 1])
+        player.append(new_playdata)
+
+    return call
+
+
+def services_request() -> etree._Element:
+    """
+    The request a cabinet posts to the services route when it boots
+    """
+    call = example_request(pcbtracker.Alive)
+    call.replace(call[0], etree.Element("services", method="get"))
+    return call
+
+
+def cabinet_request(
+    name: str, refid: str = REFID, cardid: str = CARDID
+) -> etree._Element:
+    """
+    The request for `module.method` `name`, for the given card
+    """
+    if name == "gameend.regist":
+        return gameend_request(refid)
+
+    call = example_request(SESSION_HANDLERS[name])
+    module = call[0]
+    if module.get("cardid") is not None:
+        module.set("cardid", cardid)
+    if module.get("refid") is not None:
+        module.set("refid", refid)
+    for element in module.iter("refid"):
+        element.text = refid
+    for element in module.iter("uid"):
+        element.text = cardid
+    return call
+
+
+def session_requests(
+    refid: str = REFID, cardid: str = CARDID
+) -> List[Tuple[str, etree._Element]]:
+    """
+    Every request a cabinet sends for a single credit, in order, named `module.method`
+    """
+    return [(name, cabinet_request(name, refid, cardid)) for name in SESSION_HANDLERS]
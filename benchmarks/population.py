@@ -0,0 +1,451 @@
+"""
+Fill a database with a synthetic player population, to see how the server behaves with
+far more data than a single arcade produces.
+
+    python benchmarks/population.py DATABASE [--users N] [--plays-per-user N]
+                                    [--songs N] [--days N] [--seed N]
+
+DATABASE is a SQLite file or an SQLAlchemy URI. Users are added after the ones already
+in the database, so running it again grows the population. For example
+`--users 1000000 --plays-per-user 100` gives about 100 million play data and hitchart
+rows.
+
+Every user gets a card, RefID, ExtID, account and user data, and plays whole credits:
+- Credits per user are lognormal, most cards are used a few times and a few regulars
+  play hundreds of credits.
+- Songs are picked with a Zipf distribution over the catalog, so the hitchart has a
+  long tail. If the songs table is empty, `--songs` synthetic songs are added first.
+- Every user has a skill level, which their scores, clears and full combos follow.
+- Credits are spread between the day the user started playing and now, over the last
+  `--days` days.
+
+Rows are generated with numpy and written with one executemany per batch.
+
+Needs the server's dependencies installed (`pip install -e .`)
+"""
+
+import argparse
+import string
+import sys
+from datetime import datetime
+from time import perf_counter
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import environment  # noqa: F401
+import numpy as np
+from loadgen import STAGES, setup_database
+from sqlalchemy import Table, func, select
+from sqlalchemy.engine import Connection
+
+from v8_server import db
+from v8_server.common.card import CardCipher
+from v8_server.model import song
+from v8_server.model.song import HitChart, Song
+from v8_server.model.user import (
+    DEFAULT_GAME,
+    DEFAULT_VERSION,
+    Card,
+    ExtID,
+    PlayData,
+    RefID,
+    User,
+    UserAccount,
+    UserData,
+)
+
+
+# Users are generated this many at a time, each in its own transaction
+CHUNK_USERS = 10_000
+
+# Rows per executemany
+BATCH_SIZE = 5_000
+
+# Spread of the lognormal credits per user
+CREDITS_SIGMA = 1.2
+
+# A credit takes at least this long, so nobody plays more often than that on average
+CREDIT_MINUTES = 5
+
+# Exponent of the Zipf song popularity
+SONG_ZIPF = 1.1
+
+# The printed IDs are bijections of the userid (multiplying by a number coprime with
+# the modulus), so they look random but never collide
+CARD_MULTIPLIER = 0x5DEECE66D
+REFID_MULTIPLIER = 0x9E3779B97F4A7C15
+EXTID_MULTIPLIER = 7_777_777
+EXTID_RANGE = 90_000_000
+
+# Hitchart rows are keyed by (musicid, playdate). A user always plays at the same
+# microsecond within the minute, so rows of different users can never collide and only
+# a user's own plays have to be checked.
+MINUTE_US = 60_000_000
+SLOT_MULTIPLIER = 48_271
+
+MAX_USERS = min(EXTID_RANGE, MINUTE_US)
+# Play minutes have to fit in 24 bits, see `unique_hitchart_minutes`
+MAX_DAYS = 20 * 365
+
+NAME_CHARS = np.array(list(string.ascii_uppercase + string.digits))
+
+
+class PopulationException(Exception):
+    pass
+
+
+class Population(NamedTuple):
+    users: int
+    plays_per_user: float
+    days: int
+
+
+def cardid_for(userid: int) -> str:
+    # About one in five cards is a FeliCa card (mobile phones, e-money cards)
+    prefix = "0120" if userid % 5 == 0 else "E004"
+    return f"{prefix}{userid * CARD_MULTIPLIER % 2 ** 48:012X}"
+
+
+def refid_for(userid: int) -> str:
+    return f"{userid * REFID_MULTIPLIER % 2 ** 64:016X}"
+
+
+def extid_for(userid: int) -> int:
+    return 10_000_000 + userid * EXTID_MULTIPLIER % EXTID_RANGE
+
+
+def user_count(connection: Connection) -> int:
+    return connection.execute(
+        select([func.count()]).select_from(User.__table__)
+    ).scalar()
+
+
+def ensure_songs(connection: Connection, count: int) -> List[int]:
+    """
+    Return the musicids of the catalog, adding `count` synthetic songs if it is empty
+    """
+    musicids = [row[0] for row in connection.execute(select([Song.musicid]))]
+    if musicids:
+        return sorted(musicids)
+
+    songs = {
+        musicid: song.CatalogSong(musicid, 120 + musicid % 100, f"SONG {musicid}")
+        for musicid in range(1849, 1849 + count)
+    }
+    song.import_songs(connection, songs)
+    return sorted(songs)
+
+
+def insert_rows(
+    connection: Connection, table: Table, columns: Dict[str, Sequence[Any]]
+) -> int:
+    """
+    Insert rows given as one sequence of values per column, BATCH_SIZE rows at a time.
+
+    The statement is compiled once and run straight on the DBAPI cursor, with the bind
+    processor of every column applied to the whole column. For millions of rows this is
+    several times faster than `Connection.execute`, which processes every parameter of
+    every row on its own.
+    """
+    dialect = connection.dialect
+    compiled = table.insert().compile(dialect=dialect, column_keys=list(columns))
+    names = list(compiled.positiontup if compiled.positional else columns)
+    processors = [
+        table.c[name].type.dialect_impl(dialect).bind_processor(dialect)
+        for name in names
+    ]
+    cursor = connection.connection.cursor()
+
+    count = len(columns[names[0]])
+    for start in range(0, count, BATCH_SIZE):
+        end = min(start + BATCH_SIZE, count)
+        values = []
+        for name, processor in zip(names, processors):
+            column = columns[name][start:end]
+            if isinstance(column, np.ndarray):
+                column = column.tolist()
+            if processor is not None:
+                column = [processor(value) for value in column]
+            values.append(column)
+
+        if compiled.positional:
+            cursor.executemany(str(compiled), list(zip(*values)))
+        else:
+            cursor.executemany(
+                str(compiled), [dict(zip(names, row)) for row in zip(*values)]
+            )
+    return count
+
+
+def unique_hitchart_minutes(
+    users: np.ndarray, musicids: np.ndarray, minutes: np.ndarray
+) -> np.ndarray:
+    """
+    Move a user's repeated plays of a song in the same minute to earlier minutes until
+    every (user, song, minute) is unique
+    """
+    minutes = minutes.copy()
+    # One int64 per row sorts much faster than the rows of a 2D array
+    pairs = (users * (int(musicids.max()) + 1) + musicids) << 24
+    while True:
+        _, first = np.unique(pairs + minutes, return_index=True)
+        repeated = np.ones(len(minutes), dtype=bool)
+        repeated[first] = False
+        if not repeated.any():
+            return minutes
+        minutes[repeated] += 1
+
+
+def generate_chunk(
+    connection: Connection,
+    userids: np.ndarray,
+    population: Population,
+    musicids: np.ndarray,
+    popularity: np.ndarray,
+    now: np.datetime64,
+    rng: np.random.Generator,
+) -> int:
+    """
+    Insert a chunk of users and all of their play data, returning the play rows added
+    """
+    count = len(userids)
+    ids = userids.tolist()
+
+    insert_rows(
+        connection,
+        User.__table__,
+        {
+            "userid": userids,
+            "pin": [f"{pin:04d}" for pin in rng.integers(0, 10000, count).tolist()],
+        },
+    )
+    cardids = [cardid_for(userid) for userid in ids]
+    insert_rows(
+        connection,
+        Card.__table__,
+        {
+            "cardid": cardids,
+            "display_id": CardCipher.encode_many(cardids),
+            "userid": userids,
+        },
+    )
+    insert_rows(
+        connection,
+        ExtID.__table__,
+        {
+            "extid": [extid_for(userid) for userid in ids],
+            "game": [DEFAULT_GAME] * count,
+            "userid": userids,
+        },
+    )
+    insert_rows(
+        connection,
+        RefID.__table__,
+        {
+            "refid": [refid_for(userid) for userid in ids],
+            "game": [DEFAULT_GAME] * count,
+            "version": [DEFAULT_VERSION] * count,
+            "userid": userids,
+        },
+    )
+
+    name_lengths = rng.integers(1, 9, count).tolist()
+    names = rng.choice(NAME_CHARS, (count, 8))
+    insert_rows(
+        connection,
+        UserAccount.__table__,
+        {
+            "userid": userids,
+            "name": ["".join(name[:n]) for name, n in zip(names, name_lengths)],
+            "chara": rng.integers(0, 12, count),
+            "is_succession": rng.random(count) < 0.05,
+        },
+    )
+
+    # Credits per user, and the minute (counted back from now) of every credit
+    mean_credits = max(population.plays_per_user / STAGES, 1.0)
+    mu = np.log(mean_credits) - CREDITS_SIGMA**2 / 2
+    credits = np.maximum(1, np.rint(rng.lognormal(mu, CREDITS_SIGMA, count))).astype(
+        np.int64
+    )
+    # Minutes since the user's first credit, long enough for all of their credits
+    period = population.days * 24 * 60
+    age = np.clip(rng.integers(1, period + 1, count), credits * CREDIT_MINUTES, period)
+    credit_user = np.repeat(np.arange(count), credits)
+    credit_minute = 1 + (rng.random(len(credit_user)) * age[credit_user]).astype(
+        np.int64
+    )
+
+    play_user = np.repeat(credit_user, STAGES)
+    play_minute = np.repeat(credit_minute, STAGES)
+    plays = len(play_user)
+    stage = np.tile(np.arange(1, STAGES + 1), len(credit_user))
+    play_musicid = rng.choice(musicids, plays, p=popularity)
+
+    skill = rng.beta(2, 3, count)
+    seqmode = rng.choice([1, 2, 3, 4], plays, p=[0.2, 0.35, 0.3, 0.15])
+    difficulty = np.clip(seqmode * 18 + rng.integers(-10, 20, plays), 1, 99)
+    rate = np.clip(
+        skill[play_user] + rng.normal(0, 0.1, plays) - (difficulty / 100 - 0.4), 0, 1
+    )
+    notes = rng.integers(200, 1200, plays)
+    clear = rate >= 0.5
+
+    slot = userids * SLOT_MULTIPLIER % MINUTE_US
+    play_minute_start = (now - play_minute.astype("timedelta64[m]")).astype(
+        "datetime64[us]"
+    )
+    playdate = play_minute_start + slot[play_user].astype("timedelta64[us]")
+    total_plays = np.bincount(play_user, minlength=count)
+
+    insert_rows(
+        connection,
+        UserData.__table__,
+        {
+            "userid": userids,
+            "style": [2097152] * count,
+            "style_2": [0] * count,
+            "secret_music": [
+                [int(x) for x in row] for row in rng.integers(0, 65536, (count, 32))
+            ],
+            "secret_chara": rng.integers(0, 2**16, count),
+            "syogo": [
+                [int(x) for x in row] for row in rng.integers(0, 200, (count, 2))
+            ],
+            "perfect": total_plays * 400,
+            "great": total_plays * 150,
+            "good": total_plays * 40,
+            "poor": total_plays * 20,
+            "miss": total_plays * 30,
+            "time": credits * 600,
+        },
+    )
+
+    insert_rows(
+        connection,
+        PlayData.__table__,
+        {
+            "userid": userids[play_user],
+            "no": stage,
+            "musicid": play_musicid,
+            "seqmode": seqmode,
+            "clear": clear,
+            "auto_clear": rng.random(plays) < 0.01,
+            "score": np.rint(rate * 1_000_000).astype(np.int64),
+            "flags": [0] * plays,
+            "fullcombo": rate >= 0.93,
+            "excellent": rate >= 0.995,
+            "combo": np.rint(rate * notes).astype(np.int64),
+            "skill_point": np.where(clear, np.rint(difficulty * rate * 20), 0).astype(
+                np.int64
+            ),
+            "skill_perc": np.rint(rate * 10000).astype(np.int64),
+            "result_rank": np.digitize(rate, [0.3, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95]),
+            "difficulty": difficulty,
+            "combo_rate": np.rint(rate * 100).astype(np.int64),
+            "perfect_rate": np.rint(rate**2 * 100).astype(np.int64),
+            "playdate": playdate,
+        },
+    )
+
+    # Inserting in primary key order touches every page of the hitchart index once per
+    # chunk, instead of once per row once the index no longer fits in the cache
+    hitchart_minute = unique_hitchart_minutes(play_user, play_musicid, play_minute)
+    hitchart_playdate = (now - hitchart_minute.astype("timedelta64[m]")).astype(
+        "datetime64[us]"
+    ) + slot[play_user].astype("timedelta64[us]")
+    order = np.lexsort((hitchart_playdate, play_musicid))
+    insert_rows(
+        connection,
+        HitChart.__table__,
+        {"musicid": play_musicid[order], "playdate": hitchart_playdate[order]},
+    )
+
+    return plays
+
+
+def populate(
+    connection: Connection,
+    population: Population,
+    songs: int = 150,
+    seed: Optional[int] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> int:
+    """
+    Add `population.users` users after the existing ones, returning the number of play
+    rows added. Every chunk of users is committed on its own.
+
+    Args:
+        connection (Connection): Connection to insert with, not in a transaction
+        population (Population): How many users to add, and how much they play
+        songs (int): Synthetic songs to add if the catalog is empty
+        seed (Optional[int]): Seed for the random generator
+        progress (Optional[Callable[[int, int], None]]): Called with the users and play
+            rows added so far after every chunk
+
+    Returns:
+        int: The number of play data rows added
+    """
+    if connection.dialect.name == "sqlite":
+        # Nothing of value is lost if the machine crashes while generating
+        connection.execute("PRAGMA synchronous = OFF")
+
+    with connection.begin():
+        first = (connection.execute(select([func.max(User.userid)])).scalar() or 0) + 1
+        musicids = np.array(ensure_songs(connection, songs))
+
+    last = first + population.users
+    if last > MAX_USERS:
+        raise PopulationException(f"Can't generate more than {MAX_USERS} users")
+    if population.days > MAX_DAYS:
+        raise PopulationException(f"Can't spread plays over more than {MAX_DAYS} days")
+
+    rng = np.random.default_rng(seed)
+    # Song popularity follows the song's rank in a random order
+    popularity = 1 / np.arange(1, len(musicids) + 1) ** SONG_ZIPF
+    popularity = rng.permutation(popularity / popularity.sum())
+    now = np.datetime64(datetime.now().replace(second=0, microsecond=0), "m")
+
+    plays = 0
+    for start in range(first, last, CHUNK_USERS):
+        userids = np.arange(start, min(start + CHUNK_USERS, last), dtype=np.int64)
+        with connection.begin():
+            plays += generate_chunk(
+                connection, userids, population, musicids, popularity, now, rng
+            )
+        if progress is not None:
+            progress(int(userids[-1]) - first + 1, plays)
+
+    return plays
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic population")
+    parser.add_argument("database", help="SQLite file or SQLAlchemy URI")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--plays-per-user", type=float, default=100.0)
+    parser.add_argument("--songs", type=int, default=150, help="If there are none")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    setup_database(args.database)
+    population = Population(args.users, args.plays_per_user, args.days)
+    start = perf_counter()
+
+    def progress(users: int, plays: int) -> None:
+        seconds = perf_counter() - start
+        print(
+            f"{users}/{args.users} users, {plays} plays in {seconds:.0f}s "
+            f"({plays / seconds:.0f} plays/s)"
+        )
+
+    with db.engine.connect() as connection:
+        try:
+            populate(connection, population, args.songs, args.seed, progress)
+        except PopulationException as e:
+            sys.exit(str(e))
+        print(f"{user_count(connection)} users in the database")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,189 @@
+"""
+Time the queries that run on every credit against growing synthetic populations (see
+`population.py`), to find the ones that get slower as the database grows.
+
+    python benchmarks/queries.py [--scales N,N,...] [--plays-per-user N]
+                                 [--database PATH] [--min-time SECONDS] [--seed N]
+                                 [--output PATH]
+
+The database (a temporary SQLite file by default) is grown to every number of users in
+`--scales` in turn, and all queries are timed at each of them. Every call starts with an
+empty session, like a request does, and each query runs until `--min-time` seconds have
+passed. The results are written as JSON to benchmarks/results/ (or `--output`).
+
+Needs the server's dependencies installed (`pip install -e .`)
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import environment  # noqa: F401
+from loadgen import percentile, setup_database
+from population import Population, cardid_for, populate, refid_for, user_count
+from sqlalchemy import func, select
+
+from v8_server import app, db
+from v8_server.model.song import HitChart, Song
+from v8_server.model.user import (
+    PersonalBest,
+    PlayData,
+    RefID,
+    User,
+    UserAccount,
+    UserData,
+)
+
+
+RESULTS_PATH = Path(__file__).parent / "results"
+
+# Same as the number of songs a cabinet asks for with demodata.get
+RANKING_SIZE = 100
+
+
+class Query(NamedTuple):
+    name: str
+    # Runs the query once, picking its arguments with the random generator
+    func: Callable[[random.Random], Any]
+
+
+def queries(users: int, musicids: List[int]) -> List[Query]:
+    def userid(rng: random.Random) -> int:
+        return rng.randint(1, users)
+
+    return [
+        Query(
+            "User.from_cardid", lambda rng: User.from_cardid(cardid_for(userid(rng)))
+        ),
+        Query(
+            "User.from_cardid[new card]",
+            # A random card, with 2^48 card IDs it is practically never a known one
+            lambda rng: User.from_cardid(f"E004{rng.getrandbits(47) | 1 << 47:012X}"),
+        ),
+        Query("User.from_refid", lambda rng: User.from_refid(refid_for(userid(rng)))),
+        Query("RefID.from_userid", lambda rng: RefID.from_userid(userid(rng))),
+        Query(
+            "UserAccount.from_userid", lambda rng: UserAccount.from_userid(userid(rng))
+        ),
+        Query("UserData.from_userid", lambda rng: UserData.from_userid(userid(rng))),
+        Query(
+            "PersonalBest.lookup",
+            lambda rng: PersonalBest.lookup(
+                userid(rng), rng.choice(musicids), rng.randint(1, 4)
+            ),
+        ),
+        Query("HitChart.get_ranking", lambda _: HitChart.get_ranking(RANKING_SIZE)),
+    ]
+
+
+def measure(query: Query, min_time: float, rng: random.Random) -> Dict[str, Any]:
+    """
+    Call the query until `min_time` seconds have passed, at least once
+    """
+    timings = []
+    start = perf_counter()
+    while perf_counter() - start < min_time or not timings:
+        db.session.remove()
+        call_start = perf_counter()
+        query.func(rng)
+        timings.append(perf_counter() - call_start)
+    db.session.remove()
+
+    timings.sort()
+    return {
+        "calls": len(timings),
+        "mean_ms": sum(timings) / len(timings) * 1000,
+        "p50_ms": percentile(timings, 50) * 1000,
+        "p99_ms": percentile(timings, 99) * 1000,
+        "max_ms": timings[-1] * 1000,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Time the hot queries at scale")
+    parser.add_argument(
+        "--scales",
+        type=lambda value: sorted(int(n) for n in value.split(",")),
+        default=[1_000, 10_000, 100_000],
+        help="Comma separated numbers of users",
+    )
+    parser.add_argument("--plays-per-user", type=float, default=100.0)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--database", type=Path, help="SQLite file to grow")
+    parser.add_argument("--min-time", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=573)
+    parser.add_argument("--output", type=Path, help="Result file to write")
+    args = parser.parse_args(argv)
+
+    database = args.database or Path(tempfile.mkdtemp()) / "population.db"
+    setup_database(database)
+    print(f"Using database {database}")
+
+    results: Dict[str, Any] = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+            "database": db.engine.dialect.name,
+        },
+        "plays_per_user": args.plays_per_user,
+        "min_time": args.min_time,
+        "scales": [],
+    }
+    rng = random.Random(args.seed)
+
+    for users in args.scales:
+        with db.engine.connect() as connection:
+            existing = user_count(connection)
+            if existing < users:
+                print(f"\nAdding {users - existing} users...")
+                start = perf_counter()
+                populate(
+                    connection,
+                    Population(users - existing, args.plays_per_user, args.days),
+                    seed=rng.getrandbits(32),
+                )
+                print(f"Added in {perf_counter() - start:.0f}s")
+            users = max(users, existing)
+            plays = connection.execute(
+                select([func.count()]).select_from(PlayData.__table__)
+            ).scalar()
+            musicids = [row[0] for row in connection.execute(select([Song.musicid]))]
+
+        print(f"\n{users} users, {plays} plays")
+        print(
+            f"{'query':<28} {'calls':>7} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} "
+            f"{'max ms':>9}"
+        )
+        scale: Dict[str, Any] = {"users": users, "plays": plays, "queries": {}}
+        with app.app_context():
+            for query in queries(users, musicids):
+                result = measure(query, args.min_time, rng)
+                scale["queries"][query.name] = result
+                print(
+                    f"{query.name:<28} {result['calls']:>7} {result['mean_ms']:>9.3f} "
+                    f"{result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f} "
+                    f"{result['max_ms']:>9.3f}"
+                )
+        results["scales"].append(scale)
+
+    output = args.output
+    if output is None:
+        RESULTS_PATH.mkdir(exist_ok=True)
+        output = RESULTS_PATH / f"queries-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,261 @@
+"""
+Replay captured cabinet traffic against a fresh server, and check that every response
+still matches the captured one.
+
+    python benchmarks/replay.py CAPTURES [--url URL] [--database PATH]
+                                [--pace] [--speed X] [--show N] [--output PATH]
+
+CAPTURES is a directory of `eamuse_*_req.xml` / `eamuse_*_resp.xml` files written by the
+server (`logs/requests`). Requests are replayed one at a time in the order they were
+captured, encrypted if they originally were and with the compression they were sent
+with. They are sent as fast as possible, or with `--pace` at the pace they were captured
+at (`--speed 2` for twice as fast).
+
+RefIDs handed out by the fresh server are mapped onto the captured ones, and fields
+that change on every request (timestamps) are ignored when diffing the responses.
+Without `--url` the server runs in this process on a fresh SQLite database, with its own
+captures written to a temporary directory.
+
+Needs the server's dependencies installed (`pip install -e .`)
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+from time import perf_counter, sleep
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import environment  # noqa: F401
+from kbinxml import KBinXML
+from loadgen import (
+    HttpTransport,
+    TestClientTransport,
+    call_stats,
+    decode_response,
+    encode_request,
+    print_calls,
+    service_path,
+    setup_database,
+)
+from lxml import etree
+
+from v8_server.eamuse.services import ServiceRequest
+
+
+CAPTURE_RE = re.compile(
+    r"eamuse_(?P<date>\d{4}(?:_\d\d){5})_(?P<uid>[^_]+)_(?P<id>\d+)"
+    r"(?:_(?P<compression>[^_]+))?_(?P<kind>req|resp)\.xml"
+)
+
+# Response fields that are different on every request
+VOLATILE_FIELDS = {"now_time", "start", "end"}
+
+# Fields holding RefIDs, which the fresh server generates anew
+REFID_FIELDS = {"refid", "dataid"}
+
+
+class Capture(NamedTuple):
+    request: Path
+    response: Optional[Path]
+    encrypted: bool
+    # Captures from before the compression was recorded are replayed uncompressed
+    compression: str
+    time: float
+
+
+def load_captures(path: Path) -> List[Capture]:
+    """
+    Pair up the captured requests and responses, in the order they were captured
+    """
+    files: Dict[str, Dict[tuple, Path]] = {"req": {}, "resp": {}}
+    for file in path.glob("eamuse_*.xml"):
+        match = CAPTURE_RE.fullmatch(file.name)
+        if match is not None:
+            key = (match["uid"], match["id"], match["compression"])
+            files[match["kind"]][key] = file
+
+    captures = []
+    for key, request in files["req"].items():
+        uid, _, compression = key
+        captures.append(
+            Capture(
+                request,
+                files["resp"].get(key),
+                uid.startswith("1-"),
+                compression or "none",
+                request.stat().st_mtime,
+            )
+        )
+    return sorted(captures, key=lambda c: (c.time, c.request.name))
+
+
+def map_refids(element: etree._Element, refids: Dict[str, str]) -> None:
+    """
+    Replace the captured RefIDs in a request with the ones the server handed out
+    """
+    for node in element.iter():
+        for name, value in node.attrib.items():
+            if value in refids:
+                node.set(name, refids[value])
+        if node.text in refids:
+            node.text = refids[node.text]
+
+
+def learn_refids(
+    expected: etree._Element, actual: etree._Element, refids: Dict[str, str]
+) -> None:
+    """
+    Remember the RefIDs the server handed out in place of the captured ones
+    """
+    for old, new in zip(expected.iter(), actual.iter()):
+        if old.tag != new.tag:
+            return
+        for name in REFID_FIELDS:
+            if old.get(name) and new.get(name) and old.get(name) != new.get(name):
+                refids[old.get(name)] = new.get(name)
+        if old.tag in REFID_FIELDS and old.text and new.text and old.text != new.text:
+            refids[old.text] = new.text
+
+
+def response_diff(
+    expected: etree._Element,
+    actual: etree._Element,
+    refids: Dict[str, str],
+    path: str = "",
+) -> List[str]:
+    """
+    Describe every difference between the captured and the replayed response
+    """
+    path = f"{path}/{expected.tag}"
+    if expected.tag != actual.tag:
+        return [f"{path}: element {actual.tag} instead"]
+
+    diffs = []
+    for name in sorted(set(expected.attrib) | set(actual.attrib)):
+        if name in VOLATILE_FIELDS:
+            continue
+        old = expected.get(name)
+        new = actual.get(name)
+        if refids.get(old, old) != new:
+            diffs.append(f"{path}@{name}: {old!r} != {new!r}")
+
+    if expected.tag not in VOLATILE_FIELDS:
+        old = " ".join((expected.text or "").split())
+        new = " ".join((actual.text or "").split())
+        if refids.get(old, old) != new:
+            diffs.append(f"{path}: {old!r} != {new!r}")
+
+    if len(expected) != len(actual):
+        diffs.append(f"{path}: {len(expected)} children != {len(actual)}")
+    for old_child, new_child in zip(expected, actual):
+        diffs += response_diff(old_child, new_child, refids, path)
+    return diffs
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Replay captured requests")
+    parser.add_argument("captures", type=Path)
+    parser.add_argument("--url", help="Server to replay against")
+    parser.add_argument("--database", type=Path, help="SQLite file for the app")
+    parser.add_argument("--pace", action="store_true", help="Keep the captured pace")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--show", type=int, default=10, help="Diffs to print")
+    parser.add_argument("--output", type=Path, help="Write the results as JSON")
+    args = parser.parse_args(argv)
+
+    captures = load_captures(args.captures)
+    if not captures:
+        sys.exit(f"No captured requests in {args.captures}")
+
+    if args.url is None:
+        database = args.database or Path(tempfile.mkdtemp()) / "replay.db"
+        setup_database(database)
+        ServiceRequest.LOG_DIR = Path(tempfile.mkdtemp())
+        transport: Any = TestClientTransport()
+    else:
+        transport = HttpTransport(args.url)
+
+    rng = random.Random()
+    refids: Dict[str, str] = {}
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    diffs: Dict[str, int] = defaultdict(int)
+    shown = 0
+
+    start = perf_counter()
+    for capture in captures:
+        if args.pace:
+            due = (capture.time - captures[0].time) / args.speed
+            delay = due - (perf_counter() - start)
+            if delay > 0:
+                sleep(delay)
+
+        call = etree.fromstring(capture.request.read_bytes())
+        map_refids(call, refids)
+        module = call[0].tag
+        name = f"{module}.{call[0].get('method')}"
+
+        body, headers = encode_request(
+            call, capture.compression, capture.encrypted, rng
+        )
+        sent = perf_counter()
+        try:
+            status, data, resp_headers = transport.post(
+                service_path(module), body, headers
+            )
+        except Exception as e:
+            errors[name] += 1
+            print(f"{capture.request.name}: {e!r}", file=sys.stderr)
+            continue
+        latencies[name].append(perf_counter() - sent)
+
+        if status != 200:
+            errors[name] += 1
+            print(f"{capture.request.name}: status {status}", file=sys.stderr)
+            continue
+        if capture.response is None:
+            continue
+
+        # Responses are captured before they are kbin encoded, put the captured one
+        # through kbin too so both are compared the way the cabinet sees them
+        expected = decode_response(
+            KBinXML(capture.response.read_bytes()).to_binary(), {}
+        )
+        actual = decode_response(data, resp_headers)
+        learn_refids(expected, actual, refids)
+        found = response_diff(expected, actual, refids)
+        if found:
+            diffs[name] += 1
+            if shown < args.show:
+                shown += 1
+                print(f"{capture.response.name}:")
+                for diff in found:
+                    print(f"    {diff}")
+
+    seconds = perf_counter() - start
+    calls = call_stats(latencies, errors, seconds)
+    for name, call in calls.items():
+        call["diffs"] = diffs[name]
+
+    print_calls(calls)
+    print(
+        f"\n{len(captures)} requests in {seconds:.1f}s, "
+        f"{sum(errors.values())} errors, {sum(diffs.values())} responses differ"
+    )
+
+    if args.output is not None:
+        args.output.write_text(
+            json.dumps({"seconds": seconds, "calls": calls}, indent=2)
+        )
+
+    if sum(errors.values()) or sum(diffs.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,122 @@
+"""
+Compare the threaded WSGI app with the asyncio ASGI app (`v8_server.asgi`), playing
+the same load generator sessions against both at several numbers of cabinets.
+
+    python benchmarks/serving.py [--cabinets N,N,...] [--credits N] [--plain]
+                                 [--seed N] [--output PATH]
+
+In WSGI mode every cabinet's requests are served on the cabinet's own thread, like a
+threaded server with one thread per connection. In ASGI mode the requests are served
+from one event loop, with the handlers on its pool of `ASGI_HANDLER_THREADS` threads.
+Both run in this process on a fresh SQLite database per run, so the cabinets' own
+encoding work shares the CPU with the server in both modes.
+
+Results are written as JSON to benchmarks/results/ (or `--output`).
+
+Needs the server's dependencies installed (`pip install -e .`)
+"""
+
+import argparse
+import json
+import random
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import environment  # noqa: F401
+from loadgen import (
+    AsgiTransport,
+    TestClientTransport,
+    make_cabinets,
+    percentile,
+    play,
+    setup_database,
+)
+
+
+RESULTS_PATH = Path(__file__).parent / "results"
+
+MODES = ("wsgi", "asgi")
+
+
+def run(mode: str, cabinets: int, credits: int, plain: bool, seed: int) -> Dict:
+    setup_database(Path(tempfile.mkdtemp()) / f"serving-{mode}.db")
+
+    shared = AsgiTransport() if mode == "asgi" else None
+    transport: Callable[[], Any] = (
+        TestClientTransport if shared is None else lambda: shared
+    )
+    try:
+        players = make_cabinets(
+            cabinets, max(1, (credits + 1) // 2), transport, plain, random.Random(seed)
+        )
+        result = play(players, credits)
+    finally:
+        if shared is not None:
+            shared.close()
+
+    latencies = sorted(
+        value
+        for cabinet in players
+        for values in cabinet.latencies.values()
+        for value in values
+    )
+    result["p50_ms"] = percentile(latencies, 50) * 1000 if latencies else None
+    result["p99_ms"] = percentile(latencies, 99) * 1000 if latencies else None
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Compare the WSGI and ASGI apps")
+    parser.add_argument(
+        "--cabinets",
+        type=lambda value: [int(n) for n in value.split(",")],
+        default=[1, 4, 16],
+        help="Comma separated numbers of cabinets",
+    )
+    parser.add_argument("--credits", type=int, default=5, help="Credits per cabinet")
+    parser.add_argument("--plain", action="store_true", help="No encryption/lz77")
+    parser.add_argument("--seed", type=int, default=573)
+    parser.add_argument("--output", type=Path, help="Result file to write")
+    args = parser.parse_args(argv)
+
+    print(
+        f"{'mode':<6} {'cabinets':>8} {'credits/s':>10} {'req/s':>8} {'p50 ms':>8} "
+        f"{'p99 ms':>8} {'errors':>6}"
+    )
+    runs = []
+    for cabinets in args.cabinets:
+        for mode in MODES:
+            result = run(mode, cabinets, args.credits, args.plain, args.seed)
+            runs.append({"mode": mode, **result})
+            print(
+                f"{mode:<6} {cabinets:>8} {result['credits_per_sec']:>10.2f} "
+                f"{result['requests_per_sec']:>8.1f} {result['p50_ms']:>8.1f} "
+                f"{result['p99_ms']:>8.1f} {result['errors']:>6}"
+            )
+
+    output = args.output
+    if output is None:
+        RESULTS_PATH.mkdir(exist_ok=True)
+        output = RESULTS_PATH / f"serving-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.write_text(
+        json.dumps(
+            {
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "credits": args.credits,
+                "plain": args.plain,
+                "runs": runs,
+            },
+            indent=2,
+        )
+    )
+    print(f"\nResults written to {output}")
+
+    if any(run["errors"] for run in runs):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
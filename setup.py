@@ -19,6 +19,7 @@ REQUIREMENTS = [
     "flask_sqlalchemy",
     "kbinxml",
     "lxml",
+    "numpy",
     "pycryptodome",
     "pyopenssl",
     "sqlalchemy",
@@ -26,7 +27,12 @@ REQUIREMENTS = [
     "watchdog",
 ]
 
+POSTGRES_DEPS = ["psycopg2"]
+ASGI_DEPS = ["uvicorn"]
+
 EXTRAS = {
+    "postgres": POSTGRES_DEPS,
+    "asgi": ASGI_DEPS,
     "test": TEST_DEPS,
     "docs": DOCS_DEPS,
     "check": CHECK_DEPS,
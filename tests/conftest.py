@@ -0,0 +1,87 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+# The app picks its config and opens its log files when it is first imported, so this
+# has to happen before anything imports `v8_server`. The log files are kept out of the
+# repo's `logs/`.
+os.environ["ENV"] = "test"
+LOG_DIR = tempfile.TemporaryDirectory(prefix="v8_server_logs_")
+os.environ["V8_LOG_PATH"] = LOG_DIR.name
+
+import pytest  # noqa: E402
+from kbinxml import KBinXML  # noqa: E402
+from lxml import etree  # noqa: E402
+
+from v8_server import app, db  # noqa: E402
+from v8_server.eamuse.services import (  # noqa: E402
+    ServiceRequest,
+    Services,
+    ServiceType,
+    gametop,
+)
+from v8_server.model import player, song, user  # noqa: E402, F401
+from v8_server.utils.queries import count_queries  # noqa: E402
+
+
+@pytest.fixture(autouse=True, scope="session")
+def request_logs(tmp_path_factory):
+    """
+    Write the xml of the requests the tests make to a temporary directory
+    """
+    log_dir = ServiceRequest.LOG_DIR
+    ServiceRequest.LOG_DIR = tmp_path_factory.mktemp("requests")
+    yield ServiceRequest.LOG_DIR
+    ServiceRequest.LOG_DIR = log_dir
+
+
+@pytest.fixture
+def database(monkeypatch):
+    db.create_all()
+    # Don't let anything cached by an earlier test leak into this one
+    song.reload_catalog()
+    player.player_cache.clear()
+    # The tests run in a single process, so they keep the player cache on even where
+    # the config turns it off for PostgreSQL
+    monkeypatch.setattr(player.player_cache, "idle_timeout", 900)
+    gametop.GET_RESPONSES.clear()
+    yield db
+    db.session.remove()
+    db.drop_all()
+
+
+@pytest.fixture
+def client(database):
+    with app.test_client() as client:
+        yield client
+
+
+def call(client, xml: str) -> etree:
+    """
+    POST an unencrypted, uncompressed eAmuse call to the service route and return the
+    parsed response
+    """
+    resp = client.post(
+        f"{Services.SERVICE_ROUTE}/{ServiceType.LOCAL}/",
+        data=KBinXML(xml.encode("UTF-8")).to_binary(),
+    )
+    assert resp.status_code == 200
+    return etree.fromstring(KBinXML(resp.data).to_text().encode("UTF-8"))
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """
+    Fail if the code in the `with` block runs more than `limit` SQL statements, and
+    list the statements it ran
+    """
+    with count_queries() as queries:
+        yield queries
+
+    statements = "\n".join(
+        f"{count:>4} x {statement}" for statement, count in queries.statements.items()
+    )
+    assert (
+        queries.count <= limit
+    ), f"Ran {queries.count} statements, expected at most {limit}:\n{statements}"
@@ -0,0 +1,107 @@
+import struct
+
+import pytest
+
+from v8_server.eamuse.utils.arc import ARC, ArcException, extract
+from v8_server.eamuse.utils.lz77 import Lz77
+
+
+def make_arc(files):
+    """
+    Build an archive from `(name, data, compress)` tuples
+    """
+    names = b""
+    blobs = b""
+    entries = []
+    header_size = 16 + 16 * len(files)
+    name_offsets = []
+    for name, _, _ in files:
+        name_offsets.append(header_size + len(names))
+        names += name.encode("ascii") + b"\0"
+
+    for (name, data, compress), name_offset in zip(files, name_offsets):
+        stored = Lz77().compress(data) if compress else data
+        offset = header_size + len(names) + len(blobs)
+        entries.append(
+            struct.pack("<IIII", name_offset, offset, len(data), len(stored))
+        )
+        blobs += stored
+
+    header = ARC.MAGIC + struct.pack("<III", 1, len(files), 0)
+    return header + b"".join(entries) + names + blobs
+
+
+FILES = [
+    ("data/stored.bin", bytes(range(200)), False),
+    ("data/packed.xml", b"<xml>" + b"abcdef" * 300 + b"</xml>", True),
+    ("other.bin", b"x" * 100, True),
+]
+
+
+def test_arc_bytes_and_mmap(tmp_path):
+    data = make_arc(FILES)
+    path = tmp_path / "test.arc"
+    path.write_bytes(data)
+
+    with ARC.open(path) as mapped:
+        arc = ARC(data)
+        assert mapped.filenames == arc.filenames == [name for name, _, _ in FILES]
+
+        for name, contents, _ in FILES:
+            assert arc.read_file(name) == contents
+            member = mapped.read_file(name)
+            assert member == contents
+            if isinstance(member, memoryview):
+                member.release()
+
+        stored = mapped.read_file("data/stored.bin")
+        assert isinstance(stored, memoryview)
+        stored.release()
+
+        # Decompressed members come out of the cache the second time
+        assert mapped.read_file("data/packed.xml") is mapped.read_file(
+            "data/packed.xml"
+        )
+
+
+def test_arc_cache_is_bounded():
+    arc = ARC(make_arc(FILES), cache_size=1850)
+
+    packed = arc.read_file("data/packed.xml")
+    assert len(packed) > 1000
+    assert arc.read_file("data/packed.xml") is packed
+
+    # Reading another member pushes the least recently used one out
+    arc.read_file("other.bin")
+    assert arc.read_file("other.bin") is arc.read_file("other.bin")
+    assert arc.read_file("data/packed.xml") is not packed
+
+
+def test_extract(tmp_path):
+    path = tmp_path / "test.arc"
+    path.write_bytes(make_arc(FILES))
+
+    for workers in (1, 2):
+        output = tmp_path / f"out{workers}"
+        result = extract(path, output, workers)
+
+        assert result.files == 3
+        assert result.uncompressed_bytes == sum(len(data) for _, data, _ in FILES)
+        for name, data, _ in FILES:
+            assert (output / name).read_bytes() == data
+
+
+def test_extract_checks_members(tmp_path):
+    path = tmp_path / "test.arc"
+
+    # Claim a bigger uncompressed size than the member really has
+    data = bytearray(make_arc(FILES))
+    struct.pack_into("<I", data, 16 + 16 + 8, 10000)
+    path.write_bytes(data)
+    with pytest.raises(ArcException):
+        extract(path, tmp_path / "out", workers=1)
+
+    path.write_bytes(make_arc([("../evil.bin", b"x", False)]))
+    with pytest.raises(ArcException):
+        extract(path, tmp_path / "out", workers=1)
+    assert not (tmp_path / "evil.bin").exists()
@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from v8_server.model import archive
+from v8_server.model.archive import archive_rows, compact_database, read_archive
+from v8_server.model.song import HitChart, Song
+from v8_server.model.user import PersonalBest, PlayData, User
+
+
+def play(userid, musicid, score, playdate, clear=False):
+    return PlayData(
+        userid=userid,
+        no=1,
+        musicid=musicid,
+        seqmode=1,
+        clear=clear,
+        auto_clear=False,
+        score=score,
+        flags=0,
+        fullcombo=False,
+        excellent=False,
+        combo=0,
+        skill_point=score // 10,
+        skill_perc=0,
+        result_rank=0,
+        difficulty=0,
+        combo_rate=0,
+        perfect_rate=0,
+        playdate=playdate,
+    )
+
+
+def test_archive_rows(database, tmp_path):
+    now = datetime.now()
+    old = now - timedelta(days=100)
+
+    user = User(pin="1234")
+    database.session.add_all([user, Song(musicid=1, bpm=120, title_ascii="a")])
+    database.session.add(Song(musicid=2, bpm=120, title_ascii="b"))
+    database.session.flush()
+    database.session.add_all(
+        [
+            play(user.userid, 1, 900, old, clear=True),
+            play(user.userid, 1, 500, old + timedelta(days=1)),
+            play(user.userid, 1, 700, now),
+            HitChart(musicid=1, playdate=old),
+            HitChart(musicid=1, playdate=old + timedelta(seconds=1)),
+            HitChart(musicid=2, playdate=now),
+            HitChart(musicid=2, playdate=now + timedelta(seconds=1)),
+            HitChart(musicid=2, playdate=now + timedelta(seconds=2)),
+        ]
+    )
+    database.session.commit()
+    userid = user.userid
+
+    counts = archive_rows(tmp_path, now - timedelta(days=30))
+    compact_database()
+
+    assert counts == {"play_data": 2, "hitchart": 2}
+    assert database.session.query(PlayData).count() == 1
+    assert database.session.query(HitChart).count() == 3
+    assert HitChart.get_ranking(2) == [2, 1]
+
+    best = PersonalBest.lookup(userid, 1, 1)
+    assert (best.score, best.clear, best.play_count) == (900, True, 3)
+
+    # Archiving again merges into the existing summaries
+    archive_rows(tmp_path, now + timedelta(days=1))
+    assert database.session.query(PlayData).count() == 0
+    assert HitChart.get_ranking(2) == [2, 1]
+    best = PersonalBest.lookup(userid, 1, 1)
+    assert (best.score, best.clear, best.play_count) == (900, True, 3)
+
+    archived = list(read_archive(tmp_path, "play_data"))
+    assert [row["score"] for row in archived] == [900, 500, 700]
+    assert archived[0]["playdate"] == old
+    assert len(list(read_archive(tmp_path, "play_data", end=old.date()))) == 1
+    assert len(list(read_archive(tmp_path, "hitchart", end=old.date()))) == 2
+
+
+def test_archive_again_after_rollback(database, tmp_path, monkeypatch):
+    old = datetime.now() - timedelta(days=100)
+    user = User(pin="1234")
+    database.session.add_all([user, Song(musicid=1, bpm=120, title_ascii="a")])
+    database.session.flush()
+    database.session.add_all(
+        [play(user.userid, 1, 900, old), HitChart(musicid=1, playdate=old)]
+    )
+    database.session.commit()
+
+    def fail(bests, hitcounts):
+        raise RuntimeError("Summaries can't be saved")
+
+    # Nothing is archived when the rows can't be deleted
+    with monkeypatch.context() as m:
+        m.setattr(archive, "_save_summaries", fail)
+        with pytest.raises(RuntimeError):
+            archive_rows(tmp_path, datetime.now())
+    assert list(read_archive(tmp_path, "play_data")) == []
+    assert database.session.query(PlayData).count() == 1
+
+    assert archive_rows(tmp_path, datetime.now()) == {"play_data": 1, "hitchart": 1}
+    assert [row["score"] for row in read_archive(tmp_path, "play_data")] == [900]
+    assert len(list(read_archive(tmp_path, "hitchart"))) == 1
+    assert (
+        sorted(path.name for path in tmp_path.glob("*/*"))
+        == [f"{old.date().isoformat()}.jsonl.gz"] * 2
+    )
+
+
+def test_rows_left_pending_after_commit_are_published(database, tmp_path, monkeypatch):
+    old = datetime.now() - timedelta(days=100)
+    user = User(pin="1234")
+    database.session.add_all([user, Song(musicid=1, bpm=120, title_ascii="a")])
+    database.session.flush()
+    database.session.add_all(
+        [play(user.userid, 1, 900, old), HitChart(musicid=1, playdate=old)]
+    )
+    database.session.commit()
+
+    def fail(writer):
+        raise OSError("No space left on device")
+
+    # The rows are gone from the database, but never made it into the partitions
+    with monkeypatch.context() as m:
+        m.setattr(archive._PartitionWriter, "publish", fail)
+        with pytest.raises(OSError):
+            archive_rows(tmp_path, datetime.now())
+    assert database.session.query(PlayData).count() == 0
+    assert list(read_archive(tmp_path, "play_data")) == []
+
+    # A copy that was being written when the process died, and the rows of a run
+    # that never committed
+    day = old.date().isoformat()
+    (tmp_path / "play_data" / f"{day}.jsonl.gz.publish").write_bytes(b"partial")
+    (tmp_path / "hitchart" / f"{day}.jsonl.gz.0123456789abcdef.pending").write_bytes(
+        b"rolled back"
+    )
+
+    assert archive_rows(tmp_path, datetime.now()) == {"play_data": 0, "hitchart": 0}
+    assert [row["score"] for row in read_archive(tmp_path, "play_data")] == [900]
+    assert len(list(read_archive(tmp_path, "hitchart"))) == 1
+    assert sorted(path.name for path in tmp_path.glob("*/*")) == [f"{day}.jsonl.gz"] * 2
+    assert database.session.query(archive.ArchiveRun).count() == 0
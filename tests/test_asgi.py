@@ -0,0 +1,139 @@
+import asyncio
+import threading
+from binascii import unhexlify
+
+from conftest import call
+from kbinxml import KBinXML
+from lxml import etree
+
+from v8_server import app
+from v8_server.asgi import AsgiApp
+from v8_server.eamuse.services import ServiceRequest, Services, ServiceType
+from v8_server.eamuse.utils.arc4 import EAmuseARC4
+from v8_server.eamuse.utils.lz77 import Lz77
+from v8_server.utils.queries import count_queries
+
+
+INFO = "1-5f8c2b1a-1234"
+
+INQUIRE = (
+    '<call model="K32:J:B:A:2011033000" srcid="00010203040506070809">'
+    '<cardmng cardid="E00401007F7AD7A4" cardtype="1" method="inquire" update="1"/>'
+    "</call>"
+)
+
+
+def asgi_request(application, method, path, body=b"", headers=None):
+    """
+    Send one http request to an ASGI app, returning the status, headers and body
+    """
+    messages = [{"type": "http.request", "body": body[:10], "more_body": True}]
+    messages.append({"type": "http.request", "body": body[10:], "more_body": False})
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "query_string": b"",
+        "headers": [
+            (k.lower().encode("latin-1"), v.encode("latin-1"))
+            for k, v in (headers or {}).items()
+        ],
+    }
+    asyncio.run(application(scope, receive, send))
+
+    start, response = sent
+    headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in start["headers"]}
+    return start["status"], headers, response["body"]
+
+
+def test_service_request(client):
+    application = AsgiApp(app, 2)
+    try:
+        body = EAmuseARC4(unhexlify("5f8c2b1a1234")).encrypt(
+            Lz77().compress(KBinXML(INQUIRE.encode("UTF-8")).to_binary())
+        )
+        with count_queries() as queries:
+            status, headers, data = asgi_request(
+                application,
+                "POST",
+                f"{Services.SERVICE_ROUTE}/{ServiceType.CARDMNG}/",
+                body,
+                {"x-eamuse-info": INFO, "x-compress": "lz77"},
+            )
+    finally:
+        application.shutdown()
+
+    assert status == 200
+    assert int(headers["content-length"]) == len(data)
+    # The handler's statements are counted, although it ran on the handler pool
+    assert queries.count > 0
+    info = headers["x-eamuse-info"]
+    data = EAmuseARC4(unhexlify(info[2:].replace("-", ""))).decrypt(data)
+    xml = etree.fromstring(KBinXML(Lz77().decompress(data)).to_text().encode("UTF-8"))
+
+    # Same response as through the Flask view
+    assert etree.tostring(xml) == etree.tostring(call(client, INQUIRE))
+
+
+def test_service_request_off_loop(client, monkeypatch):
+    # The request and response captures are written off the event loop's thread
+    save_xml = ServiceRequest._save_xml
+    threads = []
+
+    def record(self, data, kind):
+        threads.append(threading.get_ident())
+        save_xml(self, data, kind)
+
+    monkeypatch.setattr(ServiceRequest, "_save_xml", record)
+    application = AsgiApp(app, 1)
+    try:
+        status, _, _ = asgi_request(
+            application,
+            "POST",
+            f"{Services.SERVICE_ROUTE}/{ServiceType.CARDMNG}/",
+            Lz77().compress(KBinXML(INQUIRE.encode("UTF-8")).to_binary()),
+            {"x-compress": "lz77"},
+        )
+    finally:
+        application.shutdown()
+
+    assert status == 200
+    assert len(threads) == 2
+    assert threading.get_ident() not in threads
+
+
+def test_unknown_method(client):
+    application = AsgiApp(app, 1)
+    try:
+        status, _, _ = asgi_request(
+            application,
+            "POST",
+            f"{Services.SERVICE_ROUTE}/{ServiceType.LOCAL}/",
+            KBinXML(INQUIRE.replace("inquire", "nothing").encode("UTF-8")).to_binary(),
+        )
+    finally:
+        application.shutdown()
+
+    assert status == 500
+
+
+def test_other_routes_use_flask(client):
+    application = AsgiApp(app, 1)
+    try:
+        status, headers, data = asgi_request(application, "GET", "/metrics")
+    finally:
+        application.shutdown()
+
+    assert status == 200
+    assert headers["content-type"].startswith("text/plain")
+    assert data.endswith(b"\n")
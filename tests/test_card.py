@@ -0,0 +1,40 @@
+import random
+
+import pytest
+
+from v8_server.common.card import CardCipher, CardCipherException
+
+
+def random_cardids(count):
+    rng = random.Random(573)
+    return [
+        rng.choice(["E004", "0120"]) + f"{rng.getrandbits(48):012X}"
+        for _ in range(count)
+    ]
+
+
+def test_encode_decode_many_match_scalar():
+    cardids = random_cardids(500)
+
+    encoded = CardCipher.encode_many(cardids)
+    assert encoded == [CardCipher.encode(cardid) for cardid in cardids]
+
+    # Spaces, dashes and confusable characters are cleaned up the same way too
+    displayed = [f"{c[:4]}-{c[4:8]} {c[8:]}".lower().replace("0", "O") for c in encoded]
+    assert CardCipher.decode_many(displayed) == cardids
+    assert CardCipher.encode_many([]) == CardCipher.decode_many([]) == []
+
+
+@pytest.mark.parametrize(
+    "method, values",
+    [
+        (CardCipher.encode_many, ["E004010000000000", "E00401"]),
+        (CardCipher.encode_many, ["E004010000000000", "FF04010000000000"]),
+        (CardCipher.encode_many, ["E004010000000000", "E00401000000000G"]),
+        (CardCipher.decode_many, ["E2YTA1652ABDSR1G", "E2YTA1652ABDSR1H"]),
+        (CardCipher.decode_many, ["E2YTA1652ABDSR1G", "E2YTA1652ABDSR!G"]),
+    ],
+)
+def test_many_invalid(method, values):
+    with pytest.raises((CardCipherException, ValueError)):
+        method(values)
@@ -0,0 +1,107 @@
+import pytest
+from conftest import call
+from sqlalchemy.exc import IntegrityError
+
+from v8_server.common.card import CardCipher
+from v8_server.model.user import (
+    DEFAULT_GAME,
+    Card,
+    ExtID,
+    RefID,
+    User,
+    insert_unique,
+)
+
+
+CARDID = "E00401007F7AD7A4"
+
+GETREFID = f"""
+<call model="K32:J:B:A:2011033000" srcid="00010203040506070809">
+    <cardmng
+        cardid="{CARDID}" cardtype="1" method="getrefid" newflag="0" passwd="1234"
+    />
+</call>
+"""
+
+
+def test_getrefid_registers_card(client, database):
+    resp = call(client, GETREFID)
+    refid = resp.find("cardmng").attrib["refid"]
+
+    user = User.from_cardid(CARDID)
+    assert user is not None
+    assert user.pin == "1234"
+    assert User.from_refid(refid).userid == user.userid
+    assert (
+        database.session.query(ExtID).filter(ExtID.userid == user.userid).count() == 1
+    )
+
+    # The printed card number is stored with the card
+    display_id = CardCipher.encode(CARDID)
+    assert user.card.display_id == display_id
+    assert Card.from_display_id(display_id.lower()).cardid == CARDID
+
+
+def test_getrefid_retries_refid_collision(client, database, monkeypatch):
+    # Force the first RefID candidate to collide with an existing one
+    call(client, GETREFID)
+    existing = database.session.query(RefID).one()
+    candidates = iter([int(existing.refid, 16), 0x1234])
+    monkeypatch.setattr(
+        "v8_server.model.user.random.getrandbits", lambda _: next(candidates)
+    )
+
+    resp = call(client, GETREFID.replace(CARDID, "E00401007F7AD7A5"))
+
+    assert resp.find("cardmng").attrib["refid"] == "0000000000001234"
+    assert database.session.query(Card).count() == 2
+    assert database.session.query(RefID).count() == 2
+
+
+def test_search_display_id(database):
+    cardids = [f"E0040100000000{i:02X}" for i in range(20)]
+    user = User(pin="1234")
+    database.session.add_all([Card(cardid=c, user=user) for c in cardids])
+    database.session.commit()
+
+    display_ids = sorted(CardCipher.encode_many(cardids))
+    prefix = display_ids[0][:2]
+    expected = [d for d in display_ids if d.startswith(prefix)]
+
+    found = Card.search_display_id(f"{prefix[0]}-{prefix[1].lower()}")
+    assert [card.display_id for card in found] == expected
+    assert len(Card.search_display_id("", limit=5)) == 5
+    assert Card.search_display_id("V") == []
+
+
+def test_create_extid_leaves_commit_to_caller(database):
+    user = User(pin="1234")
+    database.session.add(user)
+    database.session.commit()
+
+    ExtID.create_with_userid(user.userid)
+    database.session.rollback()
+
+    assert database.session.query(ExtID).count() == 0
+
+
+def test_insert_unique_only_retries_id_collisions(database):
+    users = [User(pin="1234"), User(pin="1234")]
+    database.session.add_all(users)
+    database.session.flush()
+    database.session.add(ExtID(extid=1, game=DEFAULT_GAME, userid=users[0].userid))
+    database.session.flush()
+    extids = iter([1, 2, 3])
+
+    # A clash on the id itself is retried
+    extid = insert_unique(
+        lambda: ExtID(extid=next(extids), game=DEFAULT_GAME, userid=users[1].userid)
+    )
+    assert extid.extid == 2
+
+    # The user already has a GFDM ExtID, a new id won't help
+    with pytest.raises(IntegrityError):
+        insert_unique(
+            lambda: ExtID(extid=next(extids), game=DEFAULT_GAME, userid=users[0].userid)
+        )
+    assert next(extids, None) is None
@@ -0,0 +1,49 @@
+from binascii import unhexlify
+from time import sleep, time
+
+from v8_server.eamuse.utils.arc4 import EAmuseARC4
+from v8_server.eamuse.utils.keypool import KeyPool, ResponseKey
+
+
+def test_response_key_matches_arc4():
+    # Shorter and longer than the precomputed keystream
+    for size in (0, 10, 64, 1000):
+        data = bytes(range(256)) * 4
+        data = data[:size]
+        key = ResponseKey("1-5f8c2b1a-1234", prefix=64)
+        expected = EAmuseARC4(unhexlify("5f8c2b1a1234")).encrypt(data)
+        assert key.encrypt(data) == expected
+
+
+def wait_for_pool(pool):
+    for _ in range(100):
+        if len(pool) == pool.size:
+            return
+        sleep(0.01)
+    raise AssertionError("The key pool wasn't filled")
+
+
+def test_key_pool():
+    pool = KeyPool(size=4, prefix=32, max_age=0.5)
+
+    # The first key is generated on the spot, and starts filling the pool
+    infos = [pool.take().info]
+    wait_for_pool(pool)
+
+    infos += [pool.take().info for _ in range(20)]
+    assert len(set(infos)) == len(infos)
+    for info in infos:
+        assert abs(int(info.split("-")[1], 16) - time()) < 2
+
+    # Old keys are thrown away and replaced
+    wait_for_pool(pool)
+    old = set(pool._keys)
+    sleep(0.6)
+    wait_for_pool(pool)
+    assert old.isdisjoint(pool._keys)
+
+
+def test_key_pool_disabled():
+    pool = KeyPool(size=0, prefix=32, max_age=1)
+    assert pool.take().info != pool.take().info
+    assert pool._thread is None
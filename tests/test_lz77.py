@@ -0,0 +1,46 @@
+import random
+
+from v8_server.eamuse.utils.lz77 import Lz77
+
+
+def sample_data(size, seed=573):
+    rng = random.Random(seed)
+    words = [
+        bytes(rng.randrange(256) for _ in range(rng.randint(3, 12))) for _ in range(200)
+    ]
+    data = b""
+    while len(data) < size:
+        data += rng.choice(words)
+    return data[:size]
+
+
+def test_backref_at_ring_length():
+    # The only match for the second "XYZ" is exactly one ring length back
+    rng = random.Random(1)
+    data = b"XYZ" + bytes(rng.randrange(0, 200) for _ in range(4093)) + b"XYZtail"
+    assert Lz77().decompress(Lz77().compress(data)) == data
+
+
+def test_compress_parallel():
+    lz = Lz77()
+    for size in (100, 20000, 20003):
+        data = sample_data(size)
+        compressed = lz.compress_parallel(data, workers=2, block_size=4096)
+        assert lz.decompress(compressed) == data
+
+    # Small inputs aren't split up at all
+    data = sample_data(1000)
+    assert lz.compress_parallel(data, workers=2) == lz.compress(data)
+
+
+def test_compress_high_ratio():
+    lz = Lz77(high_ratio=True)
+    for size in (0, 1, 3, 1000, 20000):
+        data = sample_data(size)
+        compressed = lz.compress(data)
+        assert Lz77().decompress(compressed) == data
+
+    data = sample_data(20000)
+    assert len(lz.compress(data)) <= len(Lz77().compress(data))
+    compressed = lz.compress_parallel(data, workers=2, block_size=4096)
+    assert Lz77().decompress(compressed) == data
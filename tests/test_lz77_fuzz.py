@@ -0,0 +1,33 @@
+import pytest
+from test_lz77 import sample_data
+
+from v8_server.eamuse.utils.lz77 import Lz77, LzException
+from v8_server.eamuse.utils.lz77_fuzz import build_corpus, fuzz, load_corpus
+
+
+def test_truncated_copy():
+    compressed = Lz77().compress_literal(bytes(range(20)))
+    with pytest.raises(LzException):
+        Lz77().decompress(compressed[:5])
+
+
+def test_build_corpus(tmp_path):
+    captures = tmp_path / "captures"
+    captures.mkdir()
+    (captures / "eamuse_1_req.xml").write_text(
+        '<call model="K32:J:B:A:2011033000"><pcbtracker method="alive"/></call>'
+    )
+    (captures / "eamuse_2_req.xml").write_text("not xml")
+
+    corpus = tmp_path / "corpus"
+    added = build_corpus(corpus, captures)
+    assert added == len(load_corpus(corpus)) > 1
+
+    # Payloads are only added once
+    assert build_corpus(corpus, captures) == 0
+
+
+def test_fuzz():
+    report = fuzz([sample_data(3000)], iterations=5, seed=1)
+    assert report.ok, report.failures
+    assert all(stats.runs > 0 for stats in report.engines.values())
@@ -0,0 +1,101 @@
+import logging
+
+import pytest
+from test_lz77 import sample_data
+
+import v8_server
+from v8_server.eamuse.utils.lz77 import Lz77
+from v8_server.eamuse.utils.offload import CompressionPool
+from v8_server.utils.metrics import metrics
+from v8_server.utils.workers import worker_pool
+
+
+def app_state():
+    return v8_server.WORKER, len(logging.getLogger("v8_server").handlers)
+
+
+@pytest.fixture
+def pool(request):
+    pool = CompressionPool(**request.param)
+    yield pool
+    # Let the workers finish whatever was left behind after a deadline
+    pool.shutdown(wait=True)
+
+
+@pytest.mark.parametrize("size", [0, 1, 8, 9, 100])
+def test_compress_literal(size):
+    data = sample_data(size)
+    assert Lz77().decompress(Lz77().compress_literal(data)) == data
+
+
+@pytest.mark.parametrize("pool", [{"threshold": 1000, "workers": 1}], indirect=True)
+def test_compression_pool(pool):
+    inline = metrics.get("compression_inline_total")
+    offloaded = metrics.get("compression_pool_total")
+
+    small = sample_data(500)
+    large = sample_data(5000)
+    assert pool.compress(small) == Lz77().compress(small)
+    assert pool.compress(large) == Lz77().compress(large)
+
+    assert metrics.get("compression_inline_total") == inline + 1
+    assert metrics.get("compression_pool_total") == offloaded + 1
+
+
+@pytest.mark.parametrize(
+    "pool", [{"threshold": 1000, "workers": 1, "deadline": 0.001}], indirect=True
+)
+def test_compression_pool_deadline(pool):
+    fallbacks = metrics.get("compression_pool_fallback_total")
+
+    data = sample_data(100000)
+    compressed = pool.compress(data)
+
+    assert compressed == Lz77().compress_literal(data)
+    assert metrics.get("compression_pool_fallback_total") == fallbacks + 1
+
+
+@pytest.mark.parametrize(
+    "pool", [{"threshold": 1000, "workers": 1, "deadline": 0.001}], indirect=True
+)
+def test_compression_pool_saturated(pool):
+    offloaded = metrics.get("compression_pool_total")
+    saturated = metrics.get("compression_pool_saturated_total")
+
+    # The worker is still busy with the first payload after its deadline, so the
+    # second one isn't queued behind it
+    data = sample_data(100000)
+    pool.compress(data)
+    assert pool.compress(data) == Lz77().compress_literal(data)
+
+    assert metrics.get("compression_pool_total") == offloaded + 1
+    assert metrics.get("compression_pool_saturated_total") == saturated + 1
+
+
+@pytest.mark.parametrize("pool", [{"threshold": 1000, "workers": 1}], indirect=True)
+def test_compression_pool_queues_without_deadline(pool):
+    offloaded = metrics.get("compression_pool_total")
+    saturated = metrics.get("compression_pool_saturated_total")
+
+    # Without a deadline the payload waits for the busy worker, instead of being
+    # compressed on the request thread
+    data = sample_data(100000)
+    pool._submit(data)
+    assert pool.compress(data) == Lz77().compress(data)
+
+    assert metrics.get("compression_pool_total") == offloaded + 1
+    assert metrics.get("compression_pool_saturated_total") == saturated
+
+
+def test_workers_leave_the_app_alone():
+    # Workers import the package to run `app_state`, but don't open the log files
+    assert app_state() == (False, 1)
+    with worker_pool(1) as executor:
+        assert executor.submit(app_state).result() == (True, 0)
+
+
+def test_metrics_view(client):
+    metrics.inc("test_requests_total")
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert b"# TYPE test_requests_total counter" in resp.data
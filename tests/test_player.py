@@ -0,0 +1,137 @@
+import pytest
+from conftest import assert_max_queries, call
+from test_cardmng import CARDID, GETREFID
+
+from v8_server.model import player
+from v8_server.model.player import (
+    MissingRefIDException,
+    PlayerCache,
+    load_cardid,
+    player_cache,
+)
+from v8_server.model.user import Card, RefID, UserData
+from v8_server.utils.metrics import metrics
+
+
+INQUIRE = f"""
+<call model="K32:J:B:A:2011033000" srcid="00010203040506070809">
+    <cardmng cardid="{CARDID}" cardtype="1" method="inquire" update="1"/>
+</call>
+"""
+
+REGIST = """
+<call model="K32:J:B:A:2011033000" srcid="00010203040506070809">
+    <cardutil method="regist">
+        <data no="1">
+            <refid __type="str">{refid}</refid>
+            <name __type="str">AAAA</name>
+            <chara __type="u8">3</chara>
+            <uid __type="str">{cardid}</uid>
+            <cabid __type="u32">1</cabid>
+            <is_succession __type="s8">0</is_succession>
+        </data>
+    </cardutil>
+</call>
+"""
+
+CHECK = """
+<call model="K32:J:B:A:2011033000" srcid="00010203040506070809">
+    <cardutil method="check">
+        <card no="1">
+            <refid __type="str">{refid}</refid>
+            <uid __type="str">{cardid}</uid>
+        </card>
+    </cardutil>
+</call>
+"""
+
+CUSTOMIZE = """
+<call model="K32:J:B:A:2011033000" srcid="00010203040506070809">
+    <customize method="regist">
+        <player no="1">
+            <refid __type="str">{refid}</refid>
+            <syogodata>
+                <get>
+                    <syogo __type="s16">4</syogo>
+                    <syogo __type="s16">7</syogo>
+                </get>
+            </syogodata>
+        </player>
+    </customize>
+</call>
+"""
+
+
+def test_session_uses_cached_player(client, database):
+    refid = call(client, GETREFID).find("cardmng").attrib["refid"]
+    call(client, REGIST.format(refid=refid, cardid=CARDID))
+    player_cache.clear()
+
+    # Inquire loads the player, the rest of the session reads the cached copy
+    resp = call(client, INQUIRE)
+    assert resp.find("cardmng").attrib["binded"] == "1"
+    assert player_cache.get(refid).account.chara == 3
+
+    hits = metrics.get("player_cache_hits_total")
+    resp = call(client, CHECK.format(refid=refid, cardid=CARDID))
+    assert resp.find("cardutil/card/chara").text == "3"
+    assert metrics.get("player_cache_hits_total") == hits + 1
+
+    # Writes go through to the cached copy as well as the database
+    call(client, CUSTOMIZE.format(refid=refid))
+    assert list(player_cache.get(refid).data.syogo) == [4, 7]
+    assert list(database.session.query(UserData).one().syogo) == [4, 7]
+    resp = call(client, CHECK.format(refid=refid, cardid=CARDID))
+    assert resp.find("cardutil/card/syogo").text == "4 7"
+
+
+def test_idle_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(player, "monotonic", lambda: now[0])
+    cache = PlayerCache(60)
+    state = player.PlayerState(1, "1234", "E9D2DD02072F05C5", None, None)
+
+    cache.put(state)
+    now[0] += 50
+    assert cache.get(state.refid) == state
+
+    # Every use restarts the idle timer
+    now[0] += 50
+    assert cache.get(state.refid) == state
+    now[0] += 61
+    assert cache.get(state.refid) is None
+
+    # Expired entries are swept out even if nobody asks for them again
+    cache.put(state)
+    now[0] += 61
+    cache.put(state._replace(refid="0000000000001234"))
+    assert len(cache) == 1
+
+
+def test_stale_load_is_not_cached():
+    cache = PlayerCache(60)
+    data = player.DataState(0, 0, [], 0, [], 0, 0, 0, 0, 0, 0)
+    state = player.PlayerState(1, "1234", "E9D2DD02072F05C5", None, data)
+
+    # A lookup reads the row, then a write is committed before the lookup caches it
+    generation = cache.generation()
+    cache.update_data(state.refid, style=1)
+    cache.put(state, generation)
+    assert cache.get(state.refid) is None
+
+    # Loads that started after the write are cached
+    cache.put(state._replace(data=data._replace(style=1)), cache.generation())
+    assert cache.get(state.refid).data.style == 1
+
+
+def test_card_without_refid(client, database):
+    call(client, GETREFID)
+    database.session.query(RefID).delete()
+    database.session.commit()
+    cardid = database.session.query(Card).one().cardid
+
+    # Telling an unknown card from a card without a RefID only takes one query
+    with assert_max_queries(1):
+        assert load_cardid("0000000000000000") is None
+    with assert_max_queries(1), pytest.raises(MissingRefIDException):
+        load_cardid(cardid)
@@ -0,0 +1,89 @@
+import logging
+import re
+
+import pytest
+from conftest import assert_max_queries, call
+from lxml import etree
+from test_cardmng import CARDID, GETREFID
+from test_player import CHECK, CUSTOMIZE, INQUIRE, REGIST
+from test_responses import GAMETOP
+
+from v8_server.eamuse.services import gameend
+from v8_server.model import song
+from v8_server.model.song import Song
+from v8_server.utils.queries import count_queries, track_queries
+
+
+AUTHPASS = """
+<call model="K32:J:B:A:2011033000" srcid="00010203040506070809">
+    <cardmng method="authpass" pass="1234" refid="{refid}"/>
+</call>
+"""
+
+
+def gameend_request(refid: str) -> str:
+    # The example request documented on the handler, with one stage
+    xml = re.search(r"<call .*</call>", gameend.Regist.__doc__, re.S).group(0)
+    root = etree.fromstring(xml, etree.XMLParser(remove_blank_text=True))
+    # Long arrays are wrapped over several lines in the docstring
+    for element in root.iter():
+        if element.text is not None:
+            element.text = " ".join(element.text.split())
+    root.find("gameend/player/playerinfo/refid").text = refid
+    return etree.tostring(root).decode("UTF-8")
+
+
+def test_session_query_counts(client, database):
+    # The song the gameend request plays, the hit chart it counts towards refers to it
+    database.session.add(Song(musicid=1849, bpm=120, title_ascii="a"))
+    database.session.commit()
+    song.reload_catalog()
+
+    # A returning player's credit only has to touch the database to find the card
+    # and to save the results
+    with assert_max_queries(1):
+        call(client, INQUIRE)
+    with assert_max_queries(9):
+        refid = call(client, GETREFID).find("cardmng").attrib["refid"]
+    with assert_max_queries(5):
+        call(client, REGIST.format(refid=refid, cardid=CARDID))
+
+    with assert_max_queries(1):
+        call(client, INQUIRE)
+    with assert_max_queries(0):
+        call(client, AUTHPASS.format(refid=refid))
+        call(client, CHECK.format(refid=refid, cardid=CARDID))
+        call(client, GAMETOP.format(refid=refid))
+    with assert_max_queries(3):
+        call(client, gameend_request(refid))
+    with assert_max_queries(1):
+        call(client, CUSTOMIZE.format(refid=refid))
+
+
+def test_limit_failure_lists_statements(database):
+    with pytest.raises(AssertionError, match=r"Ran 2 statements.*\n\s+2 x SELECT 1"):
+        with assert_max_queries(1):
+            database.session.execute("SELECT 1")
+            database.session.execute("SELECT 1")
+
+
+def test_requests_log_queries(client, caplog):
+    caplog.set_level(logging.INFO, logger="requests")
+    with count_queries() as queries:
+        call(client, INQUIRE)
+
+    assert queries.count == 1
+    assert "cardmng.inquire: 1 queries in" in caplog.text
+
+
+def test_repeated_statements(database):
+    with count_queries() as outer:
+        stats = track_queries()
+        for _ in range(3):
+            database.session.execute("SELECT  1")
+        database.session.execute("SELECT 2")
+
+    # Statements are also counted by the enclosing block
+    assert stats.count == outer.count == 4
+    assert stats.repeated(3) == [("SELECT 1", 3)]
+    assert stats.repeated(4) == []
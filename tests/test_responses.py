@@ -0,0 +1,132 @@
+from conftest import call
+from lxml import etree
+from lxml.builder import E
+from test_cardmng import CARDID, GETREFID
+from test_player import CUSTOMIZE, INQUIRE, REGIST
+
+from v8_server import app
+from v8_server.eamuse.services.facility import Get as FacilityGet
+from v8_server.eamuse.services.gametop import GET_RESPONSES, get_key
+from v8_server.eamuse.utils import responses
+from v8_server.eamuse.utils.responses import RenderedResponse, VersionedResponses
+from v8_server.model.player import player_cache
+from v8_server.model.user import UserData
+
+
+GAMETOP = """
+<call model="K32:J:B:A:2011033000" srcid="00010203040506070809">
+    <gametop method="get">
+        <player card="use" no="1">
+            <refid __type="str">{refid}</refid>
+            <request>
+                <kind __type="u8">0</kind>
+                <offset __type="u16">0</offset>
+                <music_nr __type="u16">250</music_nr>
+                <cabid __type="u32">1</cabid>
+            </request>
+        </player>
+    </gametop>
+</call>
+"""
+
+
+def test_responses_are_kept_until_bumped():
+    responses = VersionedResponses(2)
+    renders = []
+
+    def render():
+        renders.append(None)
+        return E.response(E.gametop(str(len(renders))))
+
+    first = responses.get("a", render)
+    assert responses.get("a", render) is first
+    assert first == RenderedResponse.render(E.response(E.gametop("1")))
+
+    responses.bump("a")
+    assert responses.get("a", render).xml_bytes != first.xml_bytes
+    assert len(renders) == 2
+
+    # Only the most recently used keys are kept
+    responses.get("b", render)
+    responses.get("c", render)
+    assert len(responses) == 2
+    responses.get("a", render)
+    assert len(renders) == 5
+
+
+def test_bump_while_rendering_is_not_lost():
+    responses = VersionedResponses(2)
+
+    def render():
+        # The data changes after it has been read for this render
+        responses.bump("a")
+        return E.response()
+
+    responses.get("a", render)
+    assert responses._entries["a"][1] is None
+
+
+def test_idle_responses_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(responses, "monotonic", lambda: now[0])
+    cache = VersionedResponses(2, idle_timeout=60)
+
+    first = cache.get("a", E.response)
+    now[0] += 50
+    assert cache.get("a", E.response) is first
+    now[0] += 61
+    assert cache.get("b", E.response) is not None
+    assert list(cache._entries) == ["b"]
+
+
+def test_gametop_response_is_reused(client, database):
+    refid = call(client, GETREFID).find("cardmng").attrib["refid"]
+    call(client, REGIST.format(refid=refid, cardid=CARDID))
+
+    first = call(client, GAMETOP.format(refid=refid))
+    key = get_key(refid, player_cache.get(refid).data)
+    cached = GET_RESPONSES._entries[key][1]
+    assert cached is not None
+    assert call(client, GAMETOP.format(refid=refid)).find("gametop") is not None
+    assert GET_RESPONSES._entries[key][1] is cached
+
+    # Changes to data the response doesn't show keep it
+    call(client, CUSTOMIZE.format(refid=refid))
+    assert call(client, GAMETOP.format(refid=refid)).find("gametop") is not None
+    assert GET_RESPONSES._entries[key][1] is cached
+    assert etree.tostring(call(client, GAMETOP.format(refid=refid))) == etree.tostring(
+        first
+    )
+
+
+def test_gametop_follows_changes_behind_the_cache(client, database):
+    refid = call(client, GETREFID).find("cardmng").attrib["refid"]
+    call(client, REGIST.format(refid=refid, cardid=CARDID))
+    call(client, INQUIRE)
+    resp = call(client, GAMETOP.format(refid=refid))
+    assert resp.find("gametop/player/style").text == "2097152"
+
+    # Another process saves the player, and the next session starts on this one
+    database.session.query(UserData).update({UserData.style: 1})
+    database.session.commit()
+    call(client, INQUIRE)
+
+    resp = call(client, GAMETOP.format(refid=refid))
+    assert resp.find("gametop/player/style").text == "1"
+
+
+def test_static_response_follows_config(client, monkeypatch):
+    facility = (
+        '<call model="K32:J:B:A:2011033000" srcid="00010203040506070809">'
+        '<facility encoding="SHIFT_JIS" method="get"/></call>'
+    )
+
+    first = call(client, facility)
+    cached = dict(FacilityGet.RESPONSES._entries)
+    assert call(client, facility).find("facility") is not None
+    assert FacilityGet.RESPONSES._entries == cached
+
+    monkeypatch.setitem(app.config, "FACILITY_NAME", "Other Arcade")
+    second = call(client, facility)
+    assert first.find("facility/location/name").text == "SenPi Arcade"
+    assert second.find("facility/location/name").text == "Other Arcade"
@@ -0,0 +1,83 @@
+import os
+import tracemalloc
+from binascii import unhexlify
+
+from flask import Request
+from kbinxml import KBinXML
+from werkzeug.test import EnvironBuilder
+
+from v8_server.eamuse.services import ServiceRequest, Services
+from v8_server.eamuse.utils.arc4 import KEYSTREAM_CHUNK, EAmuseARC4
+from v8_server.eamuse.utils.lz77 import Lz77
+
+
+INFO = "1-5f8c2b1a-1234"
+KEY = unhexlify("5f8c2b1a1234")
+
+
+def test_encrypted_compressed_request(client):
+    kbin = KBinXML(
+        b'<call model="K32:J:B:A:2011033000" srcid="00010203040506070809">'
+        b'<services method="get"/></call>'
+    ).to_binary()
+    body = EAmuseARC4(KEY).encrypt(Lz77().compress(kbin))
+
+    resp = client.post(
+        Services.SERVICES_ROUTE,
+        data=body,
+        headers={"x-eamuse-info": INFO, "x-compress": "lz77"},
+    )
+
+    assert resp.status_code == 200
+    info = resp.headers["x-eamuse-info"]
+    assert info != INFO
+    data = EAmuseARC4(unhexlify(info[2:].replace("-", ""))).decrypt(resp.data)
+    xml = KBinXML(Lz77().decompress(data)).xml_doc
+    assert xml.find("services") is not None
+
+
+def test_read_payload_in_place(monkeypatch):
+    # Skip the xml parsing, only the body handling is measured here
+    monkeypatch.setattr(ServiceRequest, "read", lambda self: None)
+
+    size = 1024 * 1024
+    plain = os.urandom(size)
+    environ = EnvironBuilder(
+        method="POST",
+        data=EAmuseARC4(KEY).encrypt(plain),
+        headers={"x-eamuse-info": INFO},
+    ).get_environ()
+    req = ServiceRequest(Request(environ))
+
+    tracemalloc.start()
+    try:
+        payload = req.read_payload()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert payload == plain
+    # One buffer for the body, plus a bounded amount for reading and the keystream
+    assert peak < size + ServiceRequest.READ_CHUNK + 2 * KEYSTREAM_CHUNK
+
+
+def test_captures_are_paired(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(ServiceRequest, "LOG_DIR", tmp_path)
+    kbin = KBinXML(
+        b'<call model="K32:J:B:A:2011033000" srcid="00010203040506070809">'
+        b'<services method="get"/></call>'
+    ).to_binary()
+
+    client.post(
+        Services.SERVICES_ROUTE,
+        data=EAmuseARC4(KEY).encrypt(Lz77().compress(kbin)),
+        headers={"x-eamuse-info": INFO, "x-compress": "lz77"},
+    )
+
+    # Both are named after the request, and record how it was compressed
+    names = sorted(path.name.split("_", 7)[-1] for path in tmp_path.iterdir())
+    request_id = ServiceRequest.REQUEST_ID - 1
+    assert names == [
+        f"{INFO}_{request_id:04d}_lz77_req.xml",
+        f"{INFO}_{request_id:04d}_lz77_resp.xml",
+    ]
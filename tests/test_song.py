@@ -0,0 +1,73 @@
+import json
+
+from v8_server import app
+from v8_server.model.song import (
+    HitChart,
+    Song,
+    get_catalog,
+    import_songs,
+    is_known_song,
+    read_mdb,
+    reload_catalog,
+)
+
+
+def write_mdb(path, songs):
+    path.write_text(
+        json.dumps(
+            {
+                "musicdb": {
+                    "songs": {
+                        str(musicid): {"bpm": bpm, "title_ascii": title}
+                        for musicid, bpm, title in songs
+                    }
+                }
+            }
+        )
+    )
+
+
+def test_import_songs(database, tmp_path):
+    mdb = tmp_path / "mdb.json"
+    write_mdb(mdb, [(1, 120, "a"), (2, 140, "b")])
+
+    # Everything is accepted until songs are in the catalog
+    assert is_known_song(4)
+    with database.engine.begin() as connection:
+        result = import_songs(connection, read_mdb(mdb))
+    assert (result.added, result.updated) == (2, 0)
+    assert HitChart.query.count() == 2
+
+    # Only the new and the changed songs are written, nothing is ever deleted
+    write_mdb(mdb, [(2, 150, "b"), (3, 160, "c")])
+    with database.engine.begin() as connection:
+        result = import_songs(connection, read_mdb(mdb))
+    assert (result.added, result.updated) == (1, 1)
+    assert HitChart.query.count() == 3
+    assert Song.query.get(2).bpm == 150
+    assert Song.query.count() == 3
+
+    catalog = reload_catalog()
+    assert get_catalog() is catalog
+    assert catalog[3].title_ascii == "c"
+    assert is_known_song(1)
+    assert not is_known_song(4)
+
+
+def test_catalog_picks_up_imported_songs(database, tmp_path, monkeypatch):
+    mdb = tmp_path / "mdb.json"
+    write_mdb(mdb, [(1, 120, "a")])
+    assert get_catalog() == {}
+
+    # Songs imported by another process are found at the next check
+    with database.engine.begin() as connection:
+        import_songs(connection, read_mdb(mdb))
+    assert is_known_song(2)
+    monkeypatch.setitem(app.config, "SONG_CATALOG_CHECK_INTERVAL", 0)
+    assert is_known_song(1)
+    assert not is_known_song(2)
+
+    write_mdb(mdb, [(1, 120, "a"), (2, 140, "b")])
+    with database.engine.begin() as connection:
+        import_songs(connection, read_mdb(mdb))
+    assert is_known_song(2)
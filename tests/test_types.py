@@ -0,0 +1,130 @@
+import pytest
+from sqlalchemy import text
+
+from v8_server import db
+from v8_server.common.card import CardCipher
+from v8_server.model.migrations import (
+    MIGRATIONS,
+    add_card_display_id,
+    backfill_card_display_ids,
+    pack_user_data_int_arrays,
+    refid_version_to_string,
+)
+from v8_server.model.user import DEFAULT_VERSION, Card, RefID, User, UserData
+
+
+def make_user_data(database, **kwargs):
+    user = User(pin="1234")
+    database.session.add(user)
+    database.session.flush()
+
+    values = {
+        "userid": user.userid,
+        "style": 0,
+        "style_2": 0,
+        "secret_music": list(range(32)),
+        "secret_chara": 0,
+        "syogo": [4, -1],
+        "perfect": 0,
+        "great": 0,
+        "good": 0,
+        "poor": 0,
+        "miss": 0,
+        "time": 0,
+    }
+    values.update(kwargs)
+    database.session.add(UserData(**values))
+    database.session.commit()
+    return user.userid
+
+
+def test_packed_int_array_round_trip(database):
+    userid = make_user_data(database)
+    database.session.expunge_all()
+
+    user_data = UserData.from_userid(userid)
+    assert list(user_data.secret_music) == list(range(32))
+    assert user_data.syogo.to_xml_text() == "4 -1"
+
+    raw = database.session.execute(text("SELECT secret_music FROM user_data")).scalar()
+    assert len(raw) == 64
+
+
+@pytest.mark.skipif(
+    db.engine.dialect.name != "sqlite", reason="Only SQLite databases have text rows"
+)
+def test_migrate_text_int_arrays(database):
+    userid = make_user_data(database)
+    database.session.execute(
+        text("UPDATE user_data SET secret_music = :music, syogo = '7 8'"),
+        {"music": " ".join(["3"] * 32)},
+    )
+    database.session.commit()
+
+    with database.engine.begin() as connection:
+        assert pack_user_data_int_arrays(connection) == 1
+        assert pack_user_data_int_arrays(connection) == 0
+
+    database.session.expunge_all()
+    user_data = UserData.from_userid(userid)
+    assert list(user_data.secret_music) == [3] * 32
+    assert list(user_data.syogo) == [7, 8]
+
+
+@pytest.mark.skipif(
+    db.engine.dialect.name != "sqlite", reason="Needs SQLite to drop the column"
+)
+def test_migrate_card_display_id(database):
+    database.session.add(User(pin="1234", userid=1))
+    database.session.commit()
+    database.session.remove()
+
+    # Recreate the cards table the way it was before `display_id` was added
+    with database.engine.begin() as connection:
+        connection.execute(text("DROP TABLE cards"))
+        connection.execute(
+            text("CREATE TABLE cards (cardid VARCHAR(16) PRIMARY KEY, userid INTEGER)")
+        )
+        connection.execute(
+            text("INSERT INTO cards VALUES ('E00401007F7AD7A4', 1), ('FF00', 1)")
+        )
+
+    with database.engine.begin() as connection:
+        assert add_card_display_id(connection) == 1
+        assert add_card_display_id(connection) == 0
+        # The invalid card ID is skipped rather than failing the whole batch
+        assert backfill_card_display_ids(connection) == 1
+        assert backfill_card_display_ids(connection) == 0
+
+    card = Card.from_display_id(CardCipher.encode("E00401007F7AD7A4"))
+    assert card.cardid == "E00401007F7AD7A4"
+
+
+def test_migrations_leave_current_schema_alone(database):
+    make_user_data(database)
+    with database.engine.begin() as connection:
+        assert [migration(connection) for migration in MIGRATIONS] == [0] * len(
+            MIGRATIONS
+        )
+
+
+@pytest.mark.skipif(
+    db.engine.dialect.name != "postgresql",
+    reason="SQLite stores the version in an INTEGER column anyway",
+)
+def test_migrate_refid_version(database):
+    with database.engine.begin() as connection:
+        connection.execute(
+            text("ALTER TABLE refids ALTER COLUMN version TYPE INTEGER USING 8")
+        )
+
+    with database.engine.begin() as connection:
+        assert refid_version_to_string(connection) == 1
+        assert refid_version_to_string(connection) == 0
+
+    user = User(pin="1234")
+    database.session.add(user)
+    database.session.flush()
+    RefID.create_with_userid(user.userid)
+    database.session.commit()
+    assert RefID.from_userid(user.userid).version == DEFAULT_VERSION
@@ -0,0 +1,58 @@
+import pytest
+from conftest import call
+from kbinxml import KBinXML
+from lxml import etree
+from test_asgi import INQUIRE
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from v8_server import app
+from v8_server.eamuse.services import Services, ServiceType
+from v8_server.wsgi import ServiceFastLane
+
+
+@pytest.fixture
+def lane_client(database):
+    return Client(ServiceFastLane(app, app.wsgi_app), Response)
+
+
+def test_service_request(client, lane_client):
+    resp = lane_client.post(
+        f"{Services.SERVICE_ROUTE}/{ServiceType.CARDMNG}/",
+        data=KBinXML(INQUIRE.encode("UTF-8")).to_binary(),
+    )
+
+    assert resp.status_code == 200
+    assert int(resp.headers["Content-Length"]) == len(resp.data)
+    xml = etree.fromstring(KBinXML(resp.data).to_text().encode("UTF-8"))
+    # Same response as through the Flask view
+    assert etree.tostring(xml) == etree.tostring(call(client, INQUIRE))
+
+
+def test_services_request(lane_client):
+    resp = lane_client.post(
+        Services.SERVICES_ROUTE,
+        data=KBinXML(
+            INQUIRE.replace("cardmng", "services").encode("UTF-8")
+        ).to_binary(),
+    )
+
+    assert resp.status_code == 200
+    assert KBinXML(resp.data).xml_doc.find("services") is not None
+
+
+def test_other_routes_use_flask(lane_client):
+    resp = lane_client.get("/metrics")
+
+    assert resp.status_code == 200
+    assert resp.headers["Content-Type"].startswith("text/plain")
+
+
+def test_errors_propagate_when_testing(lane_client):
+    with pytest.raises(AttributeError):
+        lane_client.post(
+            f"{Services.SERVICE_ROUTE}/{ServiceType.LOCAL}/",
+            data=KBinXML(
+                INQUIRE.replace("inquire", "nothing").encode("UTF-8")
+            ).to_binary(),
+        )
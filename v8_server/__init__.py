@@ -7,8 +7,9 @@ from typing import Optional, Union
 from flask import Flask, has_request_context, request
 from flask_sqlalchemy import SQLAlchemy
 
-from v8_server.config import Development, Production
+from v8_server.config import Development, Production, Testing
 from v8_server.utils.flask import generate_secret_key
+from v8_server.utils.workers import in_worker
 
 from .version import __version__
 
@@ -41,76 +42,92 @@ def make_log(path):
             f.write("")
 
 
-# Define the logger
-LOG_PATH = Path(__file__).parent.parent / "logs"
-LOG_PATH.mkdir(parents=True, exist_ok=True)
-make_log(LOG_PATH / "debug.log")
-make_log(LOG_PATH / "requests.log")
-make_log(LOG_PATH / "all.log")
-make_log(LOG_PATH / "werkzeug.log")
-dictConfig(
-    {
-        "version": 1,
-        "formatters": {
-            "default": {
-                "format": "[ %(asctime)s | %(levelname)-8s | %(name)s ]\n%(message)s"
+def configure_logging(path):
+    path.mkdir(parents=True, exist_ok=True)
+    make_log(path / "debug.log")
+    make_log(path / "requests.log")
+    make_log(path / "all.log")
+    make_log(path / "werkzeug.log")
+    dictConfig(
+        {
+            "version": 1,
+            "formatters": {
+                "default": {
+                    "format": (
+                        "[ %(asctime)s | %(levelname)-8s | %(name)s ]\n%(message)s"
+                    )
+                },
+                "detailed": {
+                    "()": RequestFormatter,
+                    "format": (
+                        "[ %(asctime)s | %(levelname)-8s | %(method)-4s "
+                        "| %(encrypted)-15s | %(compressed)-4s | %(name)s ]\n"
+                        "%(message)s"
+                    ),
+                },
             },
-            "detailed": {
-                "()": RequestFormatter,
-                "format": (
-                    "[ %(asctime)s | %(levelname)-8s | %(method)-4s | %(encrypted)-15s "
-                    "| %(compressed)-4s | %(name)s ]\n%(message)s"
-                ),
+            "handlers": {
+                "wsgi": {
+                    "class": "logging.StreamHandler",
+                    "stream": "ext://flask.logging.wsgi_errors_stream",
+                    "formatter": "default",
+                },
+                "debugfile": {
+                    "class": "logging.handlers.TimedRotatingFileHandler",
+                    "filename": path / "debug.log",
+                    "formatter": "default",
+                    "when": "midnight",
+                },
+                "requestsfile": {
+                    "class": "logging.handlers.TimedRotatingFileHandler",
+                    "filename": path / "requests.log",
+                    "formatter": "detailed",
+                    "when": "midnight",
+                },
+                "allfile": {
+                    "class": "logging.handlers.TimedRotatingFileHandler",
+                    "filename": path / "all.log",
+                    "formatter": "detailed",
+                    "when": "midnight",
+                },
+                "werkzeugfile": {
+                    "class": "logging.handlers.TimedRotatingFileHandler",
+                    "filename": path / "werkzeug.log",
+                    "formatter": "detailed",
+                    "when": "midnight",
+                },
             },
-        },
-        "handlers": {
-            "wsgi": {
-                "class": "logging.StreamHandler",
-                "stream": "ext://flask.logging.wsgi_errors_stream",
-                "formatter": "default",
+            "loggers": {
+                "": {"handlers": ["wsgi", "allfile"]},
+                "v8_server": {"level": "DEBUG", "handlers": ["debugfile"]},
+                "requests": {"level": "DEBUG", "handlers": ["requestsfile"]},
+                "werkzeug": {"level": "DEBUG", "handlers": ["werkzeugfile"]},
             },
-            "debugfile": {
-                "class": "logging.handlers.TimedRotatingFileHandler",
-                "filename": LOG_PATH / "debug.log",
-                "formatter": "default",
-                "when": "midnight",
-            },
-            "requestsfile": {
-                "class": "logging.handlers.TimedRotatingFileHandler",
-                "filename": LOG_PATH / "requests.log",
-                "formatter": "detailed",
-                "when": "midnight",
-            },
-            "allfile": {
-                "class": "logging.handlers.TimedRotatingFileHandler",
-                "filename": LOG_PATH / "all.log",
-                "formatter": "detailed",
-                "when": "midnight",
-            },
-            "werkzeugfile": {
-                "class": "logging.handlers.TimedRotatingFileHandler",
-                "filename": LOG_PATH / "werkzeug.log",
-                "formatter": "detailed",
-                "when": "midnight",
-            },
-        },
-        "loggers": {
-            "": {"handlers": ["wsgi", "allfile"]},
-            "v8_server": {"level": "DEBUG", "handlers": ["debugfile"]},
-            "requests": {"level": "DEBUG", "handlers": ["requestsfile"]},
-            "werkzeug": {"level": "DEBUG", "handlers": ["werkzeugfile"]},
-        },
-    }
-)
-logging.getLogger("").setLevel(logging.INFO)
+        }
+    )
+    logging.getLogger("").setLevel(logging.INFO)
+
+
+# Processes started by the codec pools only import the package to find the function
+# they were handed, so they leave out everything that touches the log files or the
+# database (see `v8_server.utils.workers`)
+WORKER = in_worker()
+
+# Define the logger, logs are written to V8_LOG_PATH if it is set
+LOG_PATH = Path(os.environ.get("V8_LOG_PATH", Path(__file__).parent.parent / "logs"))
+if not WORKER:
+    configure_logging(LOG_PATH)
 
 # Set the proper config values
-config: Optional[Union[Production, Development]] = None
+config: Optional[Union[Production, Development, Testing]] = None
 if os.environ.get("ENV", "dev") == "prod":
     config = Production()
+elif os.environ.get("ENV", "dev") == "test":
+    config = Testing()
 else:
     config = Development()
-    print(" * THIS APP IS IN DEV MODE")
+    if not WORKER:
+        print(" * THIS APP IS IN DEV MODE")
 
 # Set the location for the static files and templates
 # We might not even need this?
@@ -125,10 +142,18 @@ app.config.from_object(config)
 db = SQLAlchemy(app)
 
 # Make sure the database has been created
-db.create_all()
+if not WORKER:
+    db.create_all()
 
-# We need to import the views here specifically once the flask app has been initialized
+# We need to import the views and cli commands here specifically once the flask app has
+# been initialized
+import v8_server.cli  # noqa: F401, E402
 import v8_server.view  # noqa: F401, E402
+from v8_server.wsgi import ServiceFastLane  # noqa: E402
+
+
+if app.config["SERVICE_FAST_LANE"]:
+    app.wsgi_app = ServiceFastLane(app, app.wsgi_app)  # type: ignore
 
 
 __all__ = ["__version__", "app", "db", "LOG_PATH"]
@@ -0,0 +1,239 @@
+"""
+Serve the app from an asyncio event loop, with any ASGI server:
+
+    uvicorn v8_server.asgi:application
+
+Cabinet requests to the service routes are read on the event loop, so a slow cabinet
+upload doesn't hold a thread. Decoding and encoding write the request captures and can
+wait on the compression pool, so they run on the loop's default executor. The handlers,
+which block on the database, run on a bounded pool of threads (`ASGI_HANDLER_THREADS`),
+each inside an app context. `ServiceRequest` and the handlers are the same ones the
+Flask views use.
+
+Every other route is passed to the Flask app on the same pool.
+"""
+
+import asyncio
+import contextvars
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from flask import Flask
+
+from v8_server import app
+from v8_server.eamuse.services import ServiceRequest, Services, get_handler
+from v8_server.wsgi import EnvironRequest, is_service_request
+
+
+logger = logging.getLogger(__name__)
+
+Scope = Dict[str, Any]
+Message = Dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def read_body(receive: Receive) -> bytes:
+    """
+    Read the whole request body
+    """
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected()
+
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            return bytes(body)
+
+
+def wsgi_environ(scope: Scope, body: bytes) -> Dict[str, Any]:
+    """
+    Build the WSGI environ for an ASGI http request
+    """
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("UTF-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("UTF-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        value = raw_value.decode("latin-1")
+        if name == "CONTENT_LENGTH":
+            continue
+        key = name if name == "CONTENT_TYPE" else f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    return environ
+
+
+class AsgiApp(object):
+    """
+    ASGI application wrapping the Flask app, see the module docstring
+    """
+
+    def __init__(self, flask_app: Flask, threads: int) -> None:
+        self.flask_app = flask_app
+        self.threads = threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                self.threads, thread_name_prefix="v8-handler"
+            )
+        return self._executor
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            raise ValueError(f"Unsupported ASGI scope: {scope['type']}")
+
+        try:
+            body = await read_body(receive)
+        except ClientDisconnected:
+            return
+
+        environ = wsgi_environ(scope, body)
+        if not is_service_request(environ):
+            status, header_list, data = await self.run_wsgi(environ)
+            await self.respond(send, status, header_list, data)
+            return
+
+        path = scope["path"]
+        # Every step of the request runs in the same context, so the statements the
+        # handler runs are counted for the request it started
+        context = contextvars.copy_context()
+        try:
+            req = await self.run_off_loop(
+                context, ServiceRequest, EnvironRequest(environ)
+            )
+            if path == Services.SERVICES_ROUTE:
+                xml = Services().get_services()
+            else:
+                handler = get_handler(req)
+                xml = await self.run_in_app_context(handler.response, context)
+            data, headers = await self.run_off_loop(context, req.response, xml)
+            status = 200
+        except Exception:
+            logger.exception(f"Exception on {path} [{scope['method']}]")
+            status = 500
+            data = b"Internal Server Error"
+            headers = {"Content-Type": "text/plain"}
+
+        await self.respond(send, status, headers.items(), data)
+
+    async def run_in_app_context(
+        self,
+        func: Callable[[], Any],
+        context: Optional[contextvars.Context] = None,
+    ) -> Any:
+        """
+        Call `func` on the handler pool inside an app context. Leaving the context
+        removes the thread's database session. `func` runs in `context`, by default a
+        copy of the calling task's context, so its SQL statements are counted for the
+        request.
+        """
+
+        def run() -> Any:
+            with self.flask_app.app_context():
+                return func()
+
+        if context is None:
+            context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, context.run, run
+        )
+
+    async def run_off_loop(
+        self, context: contextvars.Context, func: Callable[..., Any], *args: Any
+    ) -> Any:
+        """
+        Call `func` in `context` on the loop's default executor, for work that doesn't
+        need the database but would still block the loop
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            None, context.run, func, *args
+        )
+
+    async def run_wsgi(
+        self, environ: Dict[str, Any]
+    ) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        """
+        Run the Flask app for a request on the handler pool
+        """
+        response: Dict[str, Any] = {}
+
+        def start_response(status: str, headers: List[Tuple[str, str]], exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = headers
+
+        def run() -> bytes:
+            result = self.flask_app.wsgi_app(environ, start_response)
+            try:
+                return b"".join(result)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+
+        data = await asyncio.get_running_loop().run_in_executor(self.executor, run)
+        return response["status"], response["headers"], data
+
+    async def respond(
+        self, send: Send, status: int, headers: Iterable[Tuple[str, str]], data: bytes
+    ) -> None:
+        raw_headers = [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in headers
+            if name.lower() != "content-length"
+        ]
+        raw_headers.append((b"content-length", str(len(data)).encode("latin-1")))
+        await send(
+            {"type": "http.response.start", "status": status, "headers": raw_headers}
+        )
+        await send({"type": "http.response.body", "body": data})
+
+    async def lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+application = AsgiApp(app, app.config["ASGI_HANDLER_THREADS"])
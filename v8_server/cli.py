@@ -0,0 +1,163 @@
+import json
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+import click
+
+from v8_server import LOG_PATH, app, db
+from v8_server.eamuse.utils import arc, lz77_fuzz
+from v8_server.model import archive, migrations, song
+
+
+@app.cli.command("migrate")
+def migrate() -> None:
+    """
+    Create any missing tables and migrate existing rows to the current schema
+    """
+    db.create_all()
+    migrations.run_migrations()
+    click.echo("Database is up to date")
+
+
+@app.cli.command("backfill-display-ids")
+def backfill_display_ids() -> None:
+    """
+    Fill in the printed card number of cards that don't have one yet
+    """
+    with db.engine.begin() as connection:
+        count = migrations.backfill_card_display_ids(connection)
+    click.echo(f"Updated {count} cards")
+
+
+@app.cli.command("import-songs")
+@click.option(
+    "--path",
+    type=click.Path(exists=True, dir_okay=False),
+    help="mdb.json to import, defaults to the one shipped with the server",
+)
+def import_songs(path: Optional[str]) -> None:
+    """
+    Add new songs and update changed songs from mdb.json
+    """
+    mdb_path = Path(path) if path is not None else song.MDB_PATH
+    songs = song.read_mdb(mdb_path)
+
+    with db.engine.begin() as connection:
+        result = song.import_songs(connection, songs)
+    song.reload_catalog()
+
+    click.echo(
+        f"Read {len(songs)} songs: {result.added} added, {result.updated} updated"
+    )
+    if result.updated:
+        click.echo("Restart running servers to pick up the updated songs")
+
+
+@app.cli.command("archive")
+@click.option("--days", type=int, help="Keep this many days of rows in the database")
+@click.option("--path", type=click.Path(file_okay=False), help="Archive directory")
+@click.option("--vacuum/--no-vacuum", default=True, help="Compact the database after")
+def archive_command(days: Optional[int], path: Optional[str], vacuum: bool) -> None:
+    """
+    Move old play data and hitchart rows to the archive
+    """
+    days = days if days is not None else app.config["ARCHIVE_RETENTION_DAYS"]
+    archive_path = Path(path) if path is not None else app.config["ARCHIVE_PATH"]
+    cutoff = datetime.now() - timedelta(days=days)
+
+    counts = archive.archive_rows(archive_path, cutoff)
+    for table, count in counts.items():
+        click.echo(f"Archived {count} {table} rows older than {cutoff}")
+
+    if vacuum:
+        archive.compact_database()
+
+
+@app.cli.command("archive-read")
+@click.argument("table", type=click.Choice(list(archive.ARCHIVED_TABLES)))
+@click.option("--path", type=click.Path(file_okay=False), help="Archive directory")
+@click.option("--start", type=click.DateTime(["%Y-%m-%d"]), help="First day to read")
+@click.option("--end", type=click.DateTime(["%Y-%m-%d"]), help="Last day to read")
+def archive_read(
+    table: str,
+    path: Optional[str],
+    start: Optional[datetime],
+    end: Optional[datetime],
+) -> None:
+    """
+    Write archived rows to stdout as JSON lines
+    """
+    archive_path = Path(path) if path is not None else app.config["ARCHIVE_PATH"]
+    rows = archive.read_archive(
+        archive_path,
+        table,
+        start.date() if start is not None else None,
+        end.date() if end is not None else None,
+    )
+    for row in rows:
+        sys.stdout.write(json.dumps(row, default=str) + "\n")
+
+
+@app.cli.command("extract-arc")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.argument("output", type=click.Path(file_okay=False))
+@click.option("--workers", type=int, help="Worker processes, defaults to one per CPU")
+def extract_arc(path: str, output: str, workers: Optional[int]) -> None:
+    """
+    Extract every file in an .arc archive
+    """
+    result = arc.extract(path, output, workers)
+    click.echo(
+        f"Extracted {result.files} files ({result.uncompressed_bytes} bytes) in "
+        f"{result.seconds:.2f}s, {result.throughput / (1024 * 1024):.2f} MiB/s"
+    )
+
+
+@app.cli.command("lz77-corpus")
+@click.argument("output", type=click.Path(file_okay=False))
+@click.option(
+    "--captures",
+    type=click.Path(exists=True, file_okay=False),
+    help="Captured request XML, defaults to logs/requests",
+)
+def lz77_corpus(output: str, captures: Optional[str]) -> None:
+    """
+    Build a corpus of kbin payloads for the Lz77 fuzzer
+    """
+    capture_path = Path(captures) if captures else LOG_PATH / "requests"
+    added = lz77_fuzz.build_corpus(
+        Path(output), capture_path if capture_path.is_dir() else None
+    )
+    click.echo(f"Added {added} payloads to {output}")
+
+
+@app.cli.command("lz77-fuzz")
+@click.option("--corpus", type=click.Path(exists=True, file_okay=False))
+@click.option("--iterations", type=int, default=1000, help="Generated inputs to check")
+@click.option("--seed", type=int, help="Seed, to reproduce a previous run")
+def lz77_fuzz_command(
+    corpus: Optional[str], iterations: int, seed: Optional[int]
+) -> None:
+    """
+    Check that every Lz77 engine round trips the corpus and generated inputs
+    """
+    samples = lz77_fuzz.load_corpus(Path(corpus)) if corpus else []
+    report = lz77_fuzz.fuzz(samples, iterations, seed)
+
+    for name, stats in report.engines.items():
+        click.echo(
+            f"{name:>12}: {stats.runs} runs, {stats.bytes_in} -> {stats.bytes_out} "
+            f"bytes, {stats.throughput / 1024:.0f} KiB/s"
+        )
+    click.echo(f"{report.truncations} truncated streams checked")
+
+    for failure in report.failures:
+        click.echo(
+            f"FAIL {failure.engine} (ring {failure.backref}): {failure.reason}, "
+            f"input {failure.data[:32].hex()}... ({len(failure.data)} bytes)",
+            err=True,
+        )
+    if not report.ok:
+        sys.exit(1)
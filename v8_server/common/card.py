@@ -2,7 +2,9 @@
 # https://github.com/ByteFun/bemaniutils/
 # blob/bd467a9b732a25a1c8aba75106dc459fbdff61b0/bemani/common/card.py
 
-from typing import List
+from typing import Callable, List, Sequence, Tuple
+
+import numpy as np
 
 
 class CardCipherException(Exception):
@@ -722,6 +724,21 @@ class CardCipher:
         # Convert to chars and return
         return "".join([CardCipher.VALID_CHARS[i] for i in groups])
 
+    @staticmethod
+    def clean(cardid: str) -> str:
+        """
+        Normalize a card string the way it was typed in: remove dashes and spaces,
+        uppercase it and convert confusing characters (I to 1, O to 0). The result is
+        not validated, so this also works on partial card strings.
+
+        Parameters:
+            cardid - String representation of (part of) the card string.
+
+        Returns:
+            The normalized card string.
+        """
+        return cardid.replace(" ", "").replace("-", "").upper().translate(_CONV_TABLE)
+
     @staticmethod
     def decode(cardid: str) -> str:
         """
@@ -736,11 +753,7 @@ class CardCipher:
             16 digit card ID (hex values stored as string).
         """
         # First sanitize the input
-        cardid = cardid.replace(" ", "")
-        cardid = cardid.replace("-", "")
-        cardid = cardid.upper()
-        for c in CardCipher.CONV_CHARS:
-            cardid = cardid.replace(c, CardCipher.CONV_CHARS[c])
+        cardid = CardCipher.clean(cardid)
 
         if len(cardid) != 16:
             raise CardCipherException(
@@ -803,6 +816,111 @@ class CardCipher:
             raise CardCipherException("Card type mismatch")
         return finalvalue
 
+    @staticmethod
+    def encode_many(cardids: Sequence[str]) -> List[str]:
+        """
+        Batch version of `encode`. All cards are converted at once with NumPy, which is
+        much faster than calling `encode` in a loop once there are more than a handful.
+
+        Parameters:
+            cardids - 16 digit card IDs (hex values stored as string).
+
+        Returns:
+            Card strings, in the same order as `cardids`.
+        """
+        if len(cardids) == 0:
+            return []
+
+        types = np.empty(len(cardids), dtype=np.uint8)
+        for idx, cardid in enumerate(cardids):
+            if len(cardid) != 16:
+                _raise_invalid(CardCipher.encode, cardid)
+            types[idx] = _CARD_TYPES.get(cardid[:2].upper(), 0)
+
+        # Card IDs as 8 bytes each
+        nibbles = _HEX_VALUES[_ascii_array(cardids, 16)]
+        bad = (types == 0) | (nibbles == 0xFF).any(axis=1)
+        if bad.any():
+            _raise_invalid(CardCipher.encode, cardids[int(bad.argmax())])
+        cardbytes = (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+
+        # The bytes are reversed before enciphering, so the halves of the cipher state
+        # are just the big endian halves of the card ID
+        halves = cardbytes.view(">u4").astype(np.uint32)
+        x, y = _encipher(halves[:, 1], halves[:, 0])
+
+        # Treat the 8 enciphered bytes as one big endian 64 bit value, and split it
+        # into 13 x 5 bit groups, with the missing last bit being 0
+        ciphered = (
+            np.stack([x, y], axis=1).astype("<u4").view(np.uint8).view(">u8")[:, 0]
+        ).astype(np.uint64)
+        groups = np.zeros((len(cardids), 16), dtype=np.uint8)
+        for i in range(0, 12):
+            groups[:, i] = (ciphered >> np.uint64(59 - i * 5)) & np.uint64(0x1F)
+        groups[:, 12] = (ciphered & np.uint64(0xF)) << np.uint64(1)
+
+        # Smear 13 groups out into 14 groups
+        groups[:, 13] = 1
+        groups[:, 0] ^= types
+        groups[:, :14] = np.bitwise_xor.accumulate(groups[:, :14], axis=1)
+
+        groups[:, 14] = types
+        groups[:, 15] = _checksum_many(groups)
+
+        return _split_strings(_VALID_CHAR_CODES[groups].tobytes().decode("ascii"), 16)
+
+    @staticmethod
+    def decode_many(cardids: Sequence[str]) -> List[str]:
+        """
+        Batch version of `decode`, see `encode_many`.
+
+        Parameters:
+            cardids - String representations of the card strings.
+
+        Returns:
+            16 digit card IDs (hex values stored as string), in the same order as
+            `cardids`.
+        """
+        if len(cardids) == 0:
+            return []
+
+        # First sanitize the input
+        cleaned = [CardCipher.clean(cardid) for cardid in cardids]
+        for idx, cardid in enumerate(cleaned):
+            if len(cardid) != 16:
+                _raise_invalid(CardCipher.decode, cardids[idx])
+
+        # Convert chars to groups and verify scheme and checksum
+        groups = _CHAR_VALUES[_ascii_array(cleaned, 16)]
+        types = groups[:, 14].copy()
+        bad = (groups == 0xFF).any(axis=1) | ((types != 1) & (types != 2))
+        bad |= groups[:, 15] != _checksum_many(groups)
+        if bad.any():
+            _raise_invalid(CardCipher.decode, cardids[int(bad.argmax())])
+
+        # Un-smear 14 fields back into 13
+        groups[:, 1:14] ^= groups[:, 0:13].copy()
+        groups[:, 0] ^= types
+
+        # Join the 13 groups back into a 64 bit value, dropping the padding bit
+        ciphered = np.zeros(len(cardids), dtype=np.uint64)
+        for i in range(0, 12):
+            ciphered |= groups[:, i].astype(np.uint64) << np.uint64(59 - i * 5)
+        ciphered |= groups[:, 12].astype(np.uint64) >> np.uint64(1)
+
+        halves = ciphered.astype(">u8").view(np.uint8).view("<u4").astype(np.uint32)
+        x, y = _decipher(halves[0::2], halves[1::2])
+
+        # The deciphered halves are the big endian halves of the card ID
+        cardbytes = np.stack([y, x], axis=1).astype(">u4").view(np.uint8)
+        decoded = _split_strings(cardbytes.tobytes().hex().upper(), 16)
+
+        # Verify we have the same type
+        mismatch = np.array([_CARD_TYPES.get(c[:2], 0) for c in decoded]) != types
+        if mismatch.any():
+            _raise_invalid(CardCipher.decode, cardids[int(mismatch.argmax())])
+        return decoded
+
     @staticmethod
     def __checksum(data: List[int]) -> int:
         checksum = 0
@@ -1004,3 +1122,153 @@ class CardCipher:
     @staticmethod
     def __ror(val: int, amount: int) -> int:
         return ((val << (32 - amount)) & 0xFFFFFFFF) | ((val >> amount) & 0xFFFFFFFF)
+
+
+# Lookup tables for the batch versions of the cipher
+
+_CARD_TYPES = {"E0": 1, "01": 2}
+
+_VALID_CHAR_CODES = np.frombuffer(CardCipher.VALID_CHARS.encode("ascii"), np.uint8)
+_CHAR_VALUES = np.full(256, 0xFF, dtype=np.uint8)
+_CHAR_VALUES[_VALID_CHAR_CODES] = np.arange(len(_VALID_CHAR_CODES), dtype=np.uint8)
+_CONV_TABLE = str.maketrans(CardCipher.CONV_CHARS)
+
+_HEX_VALUES = np.full(256, 0xFF, dtype=np.uint8)
+for _value, _char in enumerate("0123456789ABCDEF"):
+    _HEX_VALUES[ord(_char)] = _value
+    _HEX_VALUES[ord(_char.lower())] = _value
+
+_CHECKSUM_WEIGHTS = np.array([i % 3 + 1 for i in range(0, 15)], dtype=np.uint32)
+
+_KEY = np.array(CardCipher.KEY, dtype=np.uint32)
+_LUT_A = [
+    np.array(lut, dtype=np.uint32)
+    for lut in (
+        CardCipher.LUT_A0,
+        CardCipher.LUT_A1,
+        CardCipher.LUT_A2,
+        CardCipher.LUT_A3,
+    )
+]
+_LUT_B = [
+    np.array(lut, dtype=np.uint32)
+    for lut in (
+        CardCipher.LUT_B0,
+        CardCipher.LUT_B1,
+        CardCipher.LUT_B2,
+        CardCipher.LUT_B3,
+    )
+]
+
+Halves = Tuple[np.ndarray, np.ndarray]
+
+
+def _raise_invalid(func: Callable[[str], str], cardid: str) -> None:
+    # Let the scalar version raise its usual error for the first bad card in a batch
+    func(cardid)
+    raise CardCipherException(f"Invalid card ID {cardid}")
+
+
+def _ascii_array(strings: Sequence[str], width: int) -> np.ndarray:
+    # Anything that isn't ASCII becomes "?", which none of the lookup tables accept
+    data = "".join(strings).encode("ascii", errors="replace")
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, width)
+
+
+def _split_strings(data: str, width: int) -> List[str]:
+    return [data[i : i + width] for i in range(0, len(data), width)]
+
+
+def _checksum_many(groups: np.ndarray) -> np.ndarray:
+    checksum = groups[:, :15].astype(np.uint32) @ _CHECKSUM_WEIGHTS
+    while (checksum >= 0x20).any():
+        checksum = np.where(
+            checksum >= 0x20, (checksum & 0x1F) + (checksum >> 5), checksum
+        )
+    return checksum.astype(np.uint8)
+
+
+def _ror(val: np.ndarray, amount: int) -> np.ndarray:
+    return (val << np.uint32(32 - amount)) | (val >> np.uint32(amount))
+
+
+def _round(val: np.ndarray, key_a: int, key_b: int) -> np.ndarray:
+    # One round of the cipher, every sbox is applied to the whole column of cards
+    va = val ^ _KEY[key_a]
+    vb = _ror(val ^ _KEY[key_b], 28)
+    out = _LUT_A[0][(va >> 26) & 0x3F] ^ _LUT_B[0][(vb >> 26) & 0x3F]
+    for idx, shift in enumerate((18, 10, 2), start=1):
+        out ^= _LUT_A[idx][(va >> shift) & 0x3F] ^ _LUT_B[idx][(vb >> shift) & 0x3F]
+    return out
+
+
+def _to_state(in_x: np.ndarray, in_y: np.ndarray) -> Halves:
+    v7 = (((in_x ^ (in_y >> 4)) & 0xF0F0F0F) << 4) ^ in_y
+    v8 = ((in_x ^ (in_y >> 4)) & 0xF0F0F0F) ^ in_x
+
+    v9 = (v7 ^ (v8 >> 16)) & 0x0000FFFF
+    v10 = ((v7 ^ (v8 >> 16)) << 16) ^ v8
+
+    v11 = v9 ^ v7
+    v12 = (v10 ^ (v11 >> 2)) & 0x33333333
+    v13 = v11 ^ (v12 << 2)
+
+    v14 = v12 ^ v10
+    v15 = (v13 ^ (v14 >> 8)) & 0x00FF00FF
+    v16 = v14 ^ (v15 << 8)
+
+    v17 = _ror(v15 ^ v13, 1)
+    v18 = (v16 ^ v17) & 0x55555555
+
+    return _ror(v18 ^ v16, 1), v18 ^ v17
+
+
+def _from_state(v3: np.ndarray, v4: np.ndarray) -> Halves:
+    v22 = _ror(v4, 31)
+    v23 = (v3 ^ v22) & 0x55555555
+    v24 = v23 ^ v22
+
+    v25 = _ror(v23 ^ v3, 31)
+    v26 = (v25 ^ (v24 >> 8)) & 0x00FF00FF
+    v27 = v24 ^ (v26 << 8)
+
+    v28 = v26 ^ v25
+    v29 = ((v28 >> 2) ^ v27) & 0x33333333
+    v30 = (v29 << 2) ^ v28
+
+    v31 = v29 ^ v27
+    v32 = (v30 ^ (v31 >> 16)) & 0x0000FFFF
+    v33 = v31 ^ (v32 << 16)
+
+    v34 = v32 ^ v30
+    v35 = (v33 ^ (v34 >> 4)) & 0xF0F0F0F
+
+    return v35 ^ v33, (v35 << 4) ^ v34
+
+
+def _operator_a(off: int, x: np.ndarray, y: np.ndarray) -> Halves:
+    v3, v4 = _to_state(x, y)
+    for i in range(0, 32, 4):
+        v4 = v4 ^ _round(v3, off + i, off + i + 1)
+        v3 = v3 ^ _round(v4, off + i + 2, off + i + 3)
+    return _from_state(v3, v4)
+
+
+def _operator_b(off: int, x: np.ndarray, y: np.ndarray) -> Halves:
+    v3, v4 = _to_state(x, y)
+    for i in range(0, 32, 4):
+        v4 = v4 ^ _round(v3, off + 30 - i, off + 31 - i)
+        v3 = v3 ^ _round(v4, off + 28 - i, off + 29 - i)
+    return _from_state(v3, v4)
+
+
+def _encipher(x: np.ndarray, y: np.ndarray) -> Halves:
+    x, y = _operator_a(0x00, x, y)
+    x, y = _operator_b(0x20, x, y)
+    return _operator_a(0x40, x, y)
+
+
+def _decipher(x: np.ndarray, y: np.ndarray) -> Halves:
+    x, y = _operator_b(0x40, x, y)
+    x, y = _operator_a(0x20, x, y)
+    return _operator_b(0x00, x, y)
@@ -1,24 +1,155 @@
+import os
 from pathlib import Path
+from typing import Any, Dict, Optional
+from urllib.parse import quote_plus
 
 
 DEV_DB_PATH = Path(__file__).parent.parent / "database"
 PROD_DB_PATH = Path("/var/db")
 
+# Database settings are read from the environment so that the same code can be deployed
+# against SQLite on a single cabinet or PostgreSQL for multiple cabinets/workers.
+# V8_DB_BACKEND is either "sqlite" (the default) or "postgresql".
+DB_BACKEND = os.environ.get("V8_DB_BACKEND", "sqlite")
+DB_SERVER = os.environ.get("V8_DB_SERVER", "localhost")
+DB_PORT = int(os.environ.get("V8_DB_PORT", "5432"))
+DB_USER = os.environ.get("V8_DB_USER", "v8")
+DB_PASSWORD = os.environ.get("V8_DB_PASSWORD", "")
+
+
+def database_uri(sqlite_path: Optional[Path], db_name: str) -> str:
+    """
+    Build the SQLAlchemy URI for the configured backend
+
+    Args:
+        sqlite_path (Optional[Path]): SQLite database file, or None for in-memory
+        db_name (str): PostgreSQL database name
+
+    Returns:
+        str: The database URI
+    """
+    if DB_BACKEND == "postgresql":
+        return (
+            f"postgresql+psycopg2://{quote_plus(DB_USER)}:{quote_plus(DB_PASSWORD)}"
+            f"@{DB_SERVER}:{DB_PORT}/{db_name}"
+        )
+    if sqlite_path is None:
+        return "sqlite://"
+    return f"sqlite+pysqlite:///{sqlite_path}"
+
+
+def engine_options() -> Dict[str, Any]:
+    """
+    Connection pool settings. SQLite connections are cheap and can't be shared between
+    threads, so pooling is only configured for PostgreSQL.
+    """
+    if DB_BACKEND != "postgresql":
+        return {}
+
+    return {
+        "pool_size": int(os.environ.get("V8_DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.environ.get("V8_DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": int(os.environ.get("V8_DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.environ.get("V8_DB_POOL_RECYCLE", "1800")),
+        # Cabinets can sit idle for hours, make sure we don't hand out a connection
+        # the server has already closed
+        "pool_pre_ping": True,
+    }
+
 
 class Config(object):
     DEBUG: bool = False
     TESTING: bool = False
-    DB_SERVER: str = "localhost"
+    DB_SERVER: str = DB_SERVER
     SECRET_KEY_FILENAME: str = "v8_server.key"
-    SQLALCHEMY_DATABASE_URI: str = f"sqlite+pysqlite:///{ PROD_DB_PATH / 'v8.db'}"
+    SQLALCHEMY_DATABASE_URI: str = database_uri(
+        PROD_DB_PATH / "v8.db", os.environ.get("V8_DB_NAME", "v8")
+    )
+    SQLALCHEMY_ENGINE_OPTIONS: Dict[str, Any] = engine_options()
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Play data and hitchart rows older than this are moved to the archive by
+    # `flask archive`
+    ARCHIVE_PATH: Path = PROD_DB_PATH / "archive"
+    ARCHIVE_RETENTION_DAYS: int = 90
+
+    # Running servers check the songs table for newly imported songs this often, in
+    # seconds (see `v8_server.model.song.get_catalog`)
+    SONG_CATALOG_CHECK_INTERVAL: float = 60
+
+    # Encrypted responses use keys from a pool that is filled in the background. The
+    # first RESPONSE_KEY_PREFIX bytes of each keystream are generated ahead of time, and
+    # keys older than RESPONSE_KEY_MAX_AGE seconds are replaced. A pool size of 0
+    # generates every key on demand.
+    RESPONSE_KEY_POOL_SIZE: int = 32
+    RESPONSE_KEY_PREFIX: int = 4096
+    RESPONSE_KEY_MAX_AGE: float = 2.0
+
+    # Responses of at least COMPRESSION_POOL_THRESHOLD bytes are compressed by a pool
+    # of COMPRESSION_POOL_WORKERS processes (0 compresses everything on the request
+    # thread). If COMPRESSION_POOL_DEADLINE seconds pass first, the response is sent
+    # literal-only encoded instead. While every worker is busy, responses wait for the
+    # next free worker, or are sent literal-only encoded if there is a deadline.
+    COMPRESSION_POOL_THRESHOLD: int = 10 * 1024
+    COMPRESSION_POOL_WORKERS: int = 2
+    COMPRESSION_POOL_DEADLINE: Optional[float] = None
+
+    # Compress responses with the high ratio Lz77 mode (lazy, longest match), which
+    # produces smaller responses for slow shop links
+    COMPRESSION_HIGH_RATIO: bool = False
+
+    # When served from an event loop (`v8_server.asgi`), requests are decoded and
+    # encoded on the loop and the handlers, which block on the database, run on a pool
+    # of this many threads
+    ASGI_HANDLER_THREADS: int = 8
+
+    # Serve the routes cabinets post to straight from the WSGI environ, ahead of Flask
+    # (see `v8_server.wsgi`)
+    SERVICE_FAST_LANE: bool = os.environ.get("V8_SERVICE_FAST_LANE", "0") == "1"
+
+    # The rows a cabinet session reads are loaded once at `cardmng.inquire` and kept
+    # per refid until they haven't been used for this many seconds (0 disables it, see
+    # `v8_server.model.player`). The cache is per process, so it is off by default when
+    # several processes share a PostgreSQL database. Only turn it on there if every
+    # call of a cabinet session is routed to the same process.
+    PLAYER_CACHE_IDLE_TIMEOUT: float = float(
+        os.environ.get(
+            "V8_PLAYER_CACHE_IDLE_TIMEOUT", "0" if DB_BACKEND == "postgresql" else "900"
+        )
+    )
+
+    # Rendered gametop.get responses are kept for this many players (0 disables it),
+    # until they haven't been used for this many seconds
+    GAMETOP_RESPONSE_CACHE_SIZE: int = 1024
+    GAMETOP_RESPONSE_IDLE_TIMEOUT: float = 900
+
+    # The arcade the facility.get response tells cabinets they are in
+    FACILITY_ID: str = "CA-123"
+    FACILITY_COUNTRY: str = "CA"
+    FACILITY_REGION: str = "MB"
+    FACILITY_NAME: str = "SenPi Arcade"
+
+    # Every service request logs how many SQL statements it ran, and warns about any
+    # statement it ran at least this many times
+    REPEATED_QUERY_WARNING: int = 10
+
 
 class Development(Config):
     DEBUG: bool = True
     SECRET_KEY_FILENAME: str = "dev_v8_server.key"
-    SQLALCHEMY_DATABASE_URI: str = f"sqlite+pysqlite:///{ DEV_DB_PATH / 'v8_dev.db'}"
+    SQLALCHEMY_DATABASE_URI: str = database_uri(
+        DEV_DB_PATH / "v8_dev.db", os.environ.get("V8_DB_NAME", "v8_dev")
+    )
+    ARCHIVE_PATH: Path = DEV_DB_PATH / "archive"
 
 
 class Production(Config):
     pass
+
+
+class Testing(Config):
+    TESTING: bool = True
+    SECRET_KEY_FILENAME: str = "test_v8_server.key"
+    SQLALCHEMY_DATABASE_URI: str = database_uri(
+        None, os.environ.get("V8_DB_NAME", "v8_test")
+    )
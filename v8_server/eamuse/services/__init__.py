@@ -1,4 +1,16 @@
-from v8_server.eamuse.services.services import ServiceRequest, Services, ServiceType
+from v8_server.eamuse.services.services import (
+    ServiceRequest,
+    Services,
+    ServiceType,
+    get_handler,
+    static_response,
+)
 
 
-__all__ = ["ServiceRequest", "ServiceType", "Services"]
+__all__ = [
+    "ServiceRequest",
+    "ServiceType",
+    "Services",
+    "get_handler",
+    "static_response",
+]
@@ -5,7 +5,8 @@ from lxml import etree
 from v8_server import db
 from v8_server.eamuse.services.services import ServiceRequest
 from v8_server.eamuse.xml.utils import get_xml_attrib, load_xml_template
-from v8_server.model.user import Card, RefID, User, UserAccount
+from v8_server.model.player import load_cardid, lookup
+from v8_server.model.user import Card, RefID, User
 from v8_server.utils.convert import bool_to_int as btoi, int_to_bool as itob
 
 
@@ -72,19 +73,12 @@ class Inquire(object):
             ]
         }
 
-        # We have a returning user
-        if (user := User.from_cardid(self.cardid)) is not None:
-            refid = RefID.from_userid(user.userid)
-            bound = UserAccount.from_userid(user.userid) is not None
-
-            if refid is None:
-                # TODO: better exception?
-                raise Exception("RefID Should not be None here!")
-
+        # We have a returning user, this also caches them for the rest of the session
+        if (player := load_cardid(self.cardid)) is not None:
             args = {
-                "refid": refid.refid,
+                "refid": player.refid,
                 "newflag": 0,
-                "binded": btoi(bound),
+                "binded": btoi(player.account is not None),
                 "status": CardStatus.SUCCESS,
             }
             drop_attributes = None
@@ -124,20 +118,19 @@ class Getrefid(object):
         self.passwd = get_xml_attrib(req.xml[0], "passwd")
 
     def response(self) -> etree:
-        # Create a new user object with the given pin
+        # Create a new user object with the given pin, and tie the card to it. We only
+        # flush here so that the user gets its userid, everything is committed together
+        # once the refid has been generated.
         user = User(pin=self.passwd)
         db.session.add(user)
-        db.session.commit()
-
-        # Create the card, tie it to the user account
-        card = Card(cardid=self.cardid, userid=user.userid)
-        db.session.add(card)
-        db.session.commit()
+        db.session.add(Card(cardid=self.cardid, user=user))
+        db.session.flush()
 
         # Generate the refid and return it
-        refid = RefID.create_with_userid(user.userid)
+        refid = RefID.create_with_userid(user.userid).refid
+        db.session.commit()
 
-        return load_xml_template("cardmng", "getrefid", {"refid": refid.refid})
+        return load_xml_template("cardmng", "getrefid", {"refid": refid})
 
     def __repr__(self) -> str:
         return (
@@ -163,16 +156,15 @@ class Authpass(object):
         self.refid = get_xml_attrib(req.xml[0], "refid")
 
     def response(self) -> etree:
-        # Grab the refid
-        refid = db.session.query(RefID).filter(RefID.refid == self.refid).one_or_none()
+        # Grab the player
+        player = lookup(self.refid)
 
-        if refid is None:
+        if player is None:
             raise Exception("RefID Is None Here!")
 
         # Check if the pin is valid for the user
-        user = refid.user
         status = (
-            CardStatus.SUCCESS if user.pin == self.passwd else CardStatus.INVALID_PIN
+            CardStatus.SUCCESS if player.pin == self.passwd else CardStatus.INVALID_PIN
         )
 
         return load_xml_template("cardmng", "authpass", {"status": status})
@@ -199,12 +191,12 @@ class Bindmodel(object):
         self.newflag = itob(int(get_xml_attrib(req.xml[0], "newflag")))
 
     def response(self) -> etree:
-        refid = db.session.query(RefID).filter(RefID.refid == self.refid).one_or_none()
+        player = lookup(self.refid)
 
-        if refid is None:
+        if player is None:
             raise Exception("RefID is None Here!")
 
-        return load_xml_template("cardmng", "bindmodel", {"refid": refid.refid})
+        return load_xml_template("cardmng", "bindmodel", {"refid": player.refid})
 
     def __repr__(self) -> str:
         return f'CardMng.Bindmodel<refid = "{self.refid}", newflag = {self.newflag}>'
@@ -6,6 +6,13 @@ from lxml import etree
 from v8_server import db
 from v8_server.eamuse.services.services import ServiceRequest
 from v8_server.eamuse.xml.utils import get_xml_attrib, load_xml_template
+from v8_server.model.player import (
+    AccountState,
+    DataState,
+    PlayerState,
+    lookup,
+    player_cache,
+)
 from v8_server.model.user import User, UserAccount, UserData
 from v8_server.utils.convert import int_to_bool as itob
 
@@ -60,11 +67,7 @@ class Check(object):
         return f"Cardutil.Check<card = {self.card}>"
 
     def response(self) -> etree:
-        user = User.from_refid(self.card.refid)
-
-        new_user = (
-            user is None or (account := UserAccount.from_userid(user.userid)) is None
-        )
+        player = lookup(self.card.refid)
 
         # New User
         args: Dict[str, Any] = {"state": CheckStatus.NEW_USER}
@@ -81,17 +84,19 @@ class Check(object):
         }
 
         # Existing User
-        if not new_user and account is not None and user is not None:
-            user_data = user.user_data
+        if player is not None and player.account is not None:
+            if player.data is None:
+                raise Exception("User data should exist for a registered user")
+
             # TODO: Add GDP, skill, all_skill here
             args = {
                 "state": CheckStatus.EXISTING_USER,
-                "name": account.name,
+                "name": player.account.name,
                 "gdp": 0,
                 "skill": 0,
                 "all_skill": 0,
-                "syogo": " ".join(map(str, user_data.syogo)),
-                "chara": account.chara,
+                "syogo": player.data.syogo.to_xml_text(),
+                "chara": player.account.chara,
             }
             drop_children = None
 
@@ -178,6 +183,15 @@ class Regist(object):
             time=0,
         )
         db.session.add(user_data)
+        # Copy the new rows before committing expires them
+        player = PlayerState(
+            user.userid,
+            user.pin,
+            self.data.refid,
+            AccountState.from_row(user_account),
+            DataState.from_row(user_data),
+        )
         db.session.commit()
+        player_cache.put(player)
 
         return load_xml_template("cardutil", "regist")
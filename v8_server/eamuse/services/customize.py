@@ -5,7 +5,8 @@ from lxml import etree
 from v8_server import db
 from v8_server.eamuse.services.services import ServiceRequest
 from v8_server.eamuse.xml.utils import get_xml_attrib, load_xml_template
-from v8_server.model.user import User
+from v8_server.model.player import lookup, packed, player_cache
+from v8_server.model.user import UserData
 
 
 logger = logging.getLogger(__name__)
@@ -82,12 +83,16 @@ class Regist(object):
 
     def response(self) -> etree:
         # Save the syogo data (assume single player right now)
-        user = User.from_refid(self.players[0].refid)
-        if user is None:
+        refid = self.players[0].refid
+        player = lookup(refid)
+        if player is None:
             raise Exception("user should not be none")
 
-        user_data = user.user_data
-        user_data.syogo = self.players[0].syogodata.get.syogo
+        syogo = packed(UserData.syogo, self.players[0].syogodata.get.syogo)
+        db.session.query(UserData).filter(UserData.userid == player.userid).update(
+            {UserData.syogo: syogo}, synchronize_session=False
+        )
         db.session.commit()
+        player_cache.update_data(refid, syogo=syogo)
 
         return load_xml_template("customize", "regist")
@@ -1,9 +1,11 @@
 from lxml import etree
 
-from v8_server.eamuse.services.services import ServiceRequest
+from v8_server import app
+from v8_server.eamuse.services.services import ServiceRequest, static_response
 from v8_server.eamuse.xml.utils import get_xml_attrib, load_xml_template
 
 
+@static_response("FACILITY_ID", "FACILITY_COUNTRY", "FACILITY_REGION", "FACILITY_NAME")
 class Get(object):
     """
     Handle the Facility Get request.
@@ -20,14 +22,11 @@ class Get(object):
         self.encoding = get_xml_attrib(req.xml[0], "encoding")
 
     def response(self) -> etree:
-        # TODO: The facility data should be read in from a config file instead of being
-        # hard coded here
-
         args = {
-            "id": "CA-123",
-            "country": "CA",
-            "region": "MB",
-            "name": "SenPi Arcade",
+            "id": app.config["FACILITY_ID"],
+            "country": app.config["FACILITY_COUNTRY"],
+            "region": app.config["FACILITY_REGION"],
+            "name": app.config["FACILITY_NAME"],
         }
         return load_xml_template("facility", "get", args)
 
@@ -6,8 +6,9 @@ from lxml import etree
 from v8_server import db
 from v8_server.eamuse.services.services import ServiceRequest
 from v8_server.eamuse.xml.utils import get_xml_attrib, load_xml_template
-from v8_server.model.song import HitChart
-from v8_server.model.user import PlayData, User, UserData
+from v8_server.model.player import lookup, packed, player_cache
+from v8_server.model.song import HitChart, is_known_song
+from v8_server.model.user import PlayData, UserData
 from v8_server.utils.convert import int_to_bool as itob
 
 
@@ -444,6 +445,10 @@ class Regist(object):
 
     def response(self) -> etree:
         for musicid in self.hitchart.musicids:
+            # Hitchart rows reference the songs table, skip anything we don't know about
+            if not is_known_song(musicid):
+                logger.warning(f"Ignoring hitchart entry for unknown song: {musicid}")
+                continue
             hc = HitChart(musicid=musicid, playdate=datetime.now())
             logger.debug(f"Saving HitChart: {hc}")
             db.session.add(hc)
@@ -451,32 +456,45 @@ class Regist(object):
 
         # Save player data
         playerinfo = self.player.playerinfo
-        user = User.from_refid(playerinfo.refid)
-        if user is not None:
-            user_data = UserData.from_userid(user.userid)
+        player = lookup(playerinfo.refid)
+        if player is not None:
+            values = {
+                "style": playerinfo.styles,
+                "style_2": playerinfo.styles_2,
+                "secret_music": playerinfo.secret_music,
+                "secret_chara": playerinfo.secret_chara,
+                "perfect": playerinfo.perfect,
+                "great": playerinfo.great,
+                "good": playerinfo.good,
+                "poor": playerinfo.poor,
+                "miss": playerinfo.miss,
+                "time": playerinfo.time,
+            }
+            # Write the new values straight to the row instead of loading it first
+            updated = (
+                db.session.query(UserData)
+                .filter(UserData.userid == player.userid)
+                .update(values, synchronize_session=False)
+            )
 
-            if user_data is None:
+            if updated == 0:
                 raise Exception("user data shouldn't be none here")
-
-            user_data.style = playerinfo.styles
-            user_data.style_2 = playerinfo.styles_2
-            user_data.secret_music = playerinfo.secret_music
-            user_data.secret_chara = playerinfo.secret_chara
-            user_data.perfect = playerinfo.perfect
-            user_data.great = playerinfo.great
-            user_data.good = playerinfo.good
-            user_data.poor = playerinfo.poor
-            user_data.miss = playerinfo.miss
-            user_data.time = playerinfo.time
             db.session.commit()
+
+            values["secret_music"] = packed(
+                UserData.secret_music, values["secret_music"]
+            )
+            player_cache.update_data(playerinfo.refid, **values)
         else:
             raise Exception("This user doesn't exist")
 
         # Save playdata
         for idx, data in enumerate(self.player.playdata):
             musicid = self.modedata.stages[idx].musicid
+            if not is_known_song(musicid):
+                logger.warning(f"Saving play data for unknown song: {musicid}")
             play_data = PlayData(
-                userid=user.userid,
+                userid=player.userid,
                 no=data.no,
                 musicid=musicid,
                 seqmode=data.seqmode,
@@ -2,7 +2,7 @@ import logging
 
 from lxml import etree
 
-from v8_server.eamuse.services.services import ServiceRequest
+from v8_server.eamuse.services.services import ServiceRequest, static_response
 from v8_server.eamuse.utils.crc import calculate_crc8
 from v8_server.eamuse.xml.utils import load_xml_template
 
@@ -23,6 +23,7 @@ class Shop(object):
         return f"Shop<locationid = {self.locationid}, cabid = {self.cabid}>"
 
 
+@static_response()
 class Get(object):
     """
     Handle the Gameinfo Get request.
@@ -1,15 +1,40 @@
 import logging
+from typing import Hashable
 
 from lxml import etree
 
+from v8_server import app
 from v8_server.eamuse.services.services import ServiceRequest
 from v8_server.eamuse.utils.crc import calculate_crc8
+from v8_server.eamuse.utils.responses import RenderedResponse, VersionedResponses
 from v8_server.eamuse.xml.utils import get_xml_attrib, load_xml_template
-from v8_server.model.user import User
+from v8_server.model.player import DataState, lookup
 
 
 logger = logging.getLogger(__name__)
 
+# The Gametop.Get response only depends on a few of the player's UserData fields, so it
+# is kept per refid and values of those fields. A change to them, whichever process
+# made it, gives a new key once the player has been loaded again (at the latest by the
+# next `cardmng.inquire`).
+GET_RESPONSES = VersionedResponses(
+    app.config["GAMETOP_RESPONSE_CACHE_SIZE"],
+    app.config["GAMETOP_RESPONSE_IDLE_TIMEOUT"],
+)
+
+
+def get_key(refid: str, data: DataState) -> Hashable:
+    """
+    The key of the Gametop.Get response, the refid and the UserData it is built from
+    """
+    return (
+        refid,
+        data.style,
+        data.style_2,
+        tuple(data.secret_music),
+        data.secret_chara,
+    )
+
 
 class Request(object):
     """
@@ -74,14 +99,20 @@ class Get(object):
     def __repr__(self) -> str:
         return f"Gametop.Get<player = {self.player}>"
 
-    def response(self) -> etree:
+    def response(self) -> RenderedResponse:
         # Grab user_data
-        user = User.from_refid(self.player.refid)
-        if user is None:
+        player = lookup(self.player.refid)
+        if player is None:
             raise Exception("User should not be none here")
+        if player.data is None:
+            raise Exception("User data should not be none here")
 
-        user_data = user.user_data
+        user_data = player.data
+        return GET_RESPONSES.get(
+            get_key(player.refid, user_data), lambda: self.render(user_data)
+        )
 
+    def render(self, user_data: DataState) -> etree:
         # Generate history rounds (blank for now)
         history_rounds = ""
         for _ in range(0, 10):
@@ -100,7 +131,7 @@ class Get(object):
         tag = calculate_crc8(str(sum(secret_music) + secret_chara))
 
         args = {
-            "secret_music": " ".join(map(str, secret_music)),
+            "secret_music": secret_music.to_xml_text(),
             "style": user_data.style,
             "style_2": user_data.style_2,
             "secret_chara": secret_chara,
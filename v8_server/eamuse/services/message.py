@@ -1,9 +1,10 @@
 from lxml import etree
 
-from v8_server.eamuse.services.services import ServiceRequest
+from v8_server.eamuse.services.services import ServiceRequest, static_response
 from v8_server.eamuse.xml.utils import load_xml_template
 
 
+@static_response()
 class Get(object):
     """
     Handle the Message Get request.
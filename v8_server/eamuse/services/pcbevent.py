@@ -3,7 +3,7 @@ from datetime import datetime
 
 from lxml import etree
 
-from v8_server.eamuse.services.services import ServiceRequest
+from v8_server.eamuse.services.services import ServiceRequest, static_response
 from v8_server.eamuse.xml.utils import load_xml_template
 
 
@@ -36,6 +36,7 @@ class PCBEventPutItem(object):
         )
 
 
+@static_response()
 class Put(object):
     """
     Handle the PCBEvent request.
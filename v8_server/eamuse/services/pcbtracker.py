@@ -1,10 +1,11 @@
 from lxml import etree
 
-from v8_server.eamuse.services.services import ServiceRequest
+from v8_server.eamuse.services.services import ServiceRequest, static_response
 from v8_server.eamuse.xml.utils import get_xml_attrib, load_xml_template
 from v8_server.utils.convert import bool_to_int as btoi
 
 
+@static_response(vary=lambda handler: handler.paseli_active)
 class Alive(object):
     """
     Handle the PCBTracker Alive request.
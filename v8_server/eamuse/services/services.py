@@ -1,30 +1,64 @@
 from __future__ import annotations
 
+import importlib
 import logging
 from binascii import unhexlify
 from datetime import datetime
 from enum import IntEnum
-from random import randint
-from time import time
-from typing import Dict, Optional, Tuple, Union
+from functools import wraps
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Mapping,
+    Optional,
+    Protocol,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
+from zlib import crc32
 
-from flask import Request
 from kbinxml import KBinXML
 from lxml import etree
 from lxml.builder import E
 from lxml.etree import _Element as eElement
 
-from v8_server import LOG_PATH
+from v8_server import LOG_PATH, app
 from v8_server.eamuse.utils.arc4 import EAmuseARC4
 from v8_server.eamuse.utils.eamuse import Model
+from v8_server.eamuse.utils.keypool import KeyPool
 from v8_server.eamuse.utils.lz77 import Lz77
+from v8_server.eamuse.utils.offload import CompressionPool
+from v8_server.eamuse.utils.responses import RenderedResponse, VersionedResponses
 from v8_server.eamuse.xml.utils import get_xml_attrib, get_xml_tag
+from v8_server.utils.metrics import metrics
+from v8_server.utils.queries import track_queries
 
 
 # We want a general logger, and a special logger to log requests separately
 logger = logging.getLogger(__name__)
 rlogger = logging.getLogger("requests")
 
+T = TypeVar("T")
+
+# Keys for encrypting responses, generated ahead of time in the background
+RESPONSE_KEYS = KeyPool(
+    app.config["RESPONSE_KEY_POOL_SIZE"],
+    app.config["RESPONSE_KEY_PREFIX"],
+    app.config["RESPONSE_KEY_MAX_AGE"],
+)
+
+# Large responses are compressed on worker processes
+RESPONSE_COMPRESSION = CompressionPool(
+    app.config["COMPRESSION_POOL_THRESHOLD"],
+    app.config["COMPRESSION_POOL_WORKERS"],
+    app.config["COMPRESSION_POOL_DEADLINE"],
+    app.config["COMPRESSION_HIGH_RATIO"],
+)
+
 
 # Use an Enum for the different services for minimal xml
 class ServiceType(IntEnum):
@@ -108,6 +142,20 @@ class Services(object):
         )
 
 
+class RawRequest(Protocol):
+    """
+    The parts of an incoming request that `ServiceRequest` reads. `flask.Request` has
+    all of them, see also `v8_server.wsgi.EnvironRequest`.
+    """
+
+    headers: Mapping[str, str]
+    content_length: Optional[int]
+    stream: Any
+
+    def get_data(self) -> bytes:
+        ...
+
+
 class ServiceRequest(object):
     # eAmuse Header tags we care about
     X_EAMUSE_INFO = "x-eamuse-info"
@@ -122,9 +170,17 @@ class ServiceRequest(object):
     # Static Request ID
     REQUEST_ID = 0
 
-    def __init__(self, request: Request) -> None:
+    # Request bodies are read from the stream this many bytes at a time
+    READ_CHUNK = 64 * 1024
+
+    def __init__(self, request: RawRequest) -> None:
         # Save the request so we can refer back to it
         self._request = request
+        # Every statement run from here on is counted for this request
+        self.queries = track_queries()
+        self._body = bytearray()
+        # Both captures of this request are numbered with the ID it arrived with
+        self.request_id = ServiceRequest.REQUEST_ID
 
         self.model: Optional[Model] = None
         self.module: Optional[str] = None
@@ -142,23 +198,12 @@ class ServiceRequest(object):
         self.xml = self.read()
 
     def read(self) -> etree:
-        # Lets grab the raw data from the request
-        xml_bin = self._request.data
-
-        # Decrypt the data if necessary
-        x_eamuse_info: Optional[str] = None
-        if self.encrypted:
-            x_eamuse_info, key = self._get_encryption_data()
-            xml_bin = EAmuseARC4(key).decrypt(xml_bin)
-
-        # De-Compress the data if necessary
-        # Right now we only support `lz77`
-        if self.compressed and self.compression == "lz77":
-            xml_bin = Lz77().decompress(xml_bin)
+        # Decrypt and decompress the request body
+        xml_bin = self.read_payload()
 
         # Convert the binary xml data to text bytes, and save a copy
         xml_bytes = KBinXML(xml_bin).to_text().encode(self.ENCODING)
-        self._save_xml(xml_bytes, "req", x_eamuse_info)
+        self._save_xml(xml_bytes, "req")
 
         # Convert the XML text to an eTree
         xml_root = etree.fromstring(xml_bytes)
@@ -181,19 +226,70 @@ class ServiceRequest(object):
         rlogger.debug(f"Request:\n {xml_bytes.decode(self.ENCODING)}")
         return xml_root
 
-    def response(self, xml_bytes: Union[bytes, eElement]):
-        # Firstly, let's make sure xml_bytes is a bytes object
-        if type(xml_bytes) == eElement:
+    def read_payload(self) -> bytearray:
+        """
+        Read the request body and return the binary xml in it. The body is read into a
+        single buffer which is decrypted in place. KBinXML uses a bytearray as is, so
+        uncompressed requests are never copied after being read.
+        """
+        self._body = self._read_body()
+        xml_bin = self._body
+
+        # Decrypt the data if necessary
+        if self.encrypted:
+            _, key = self._get_encryption_data()
+            EAmuseARC4(key).decrypt_into(xml_bin)
+
+        # De-Compress the data if necessary
+        # Right now we only support `lz77`
+        if self.compressed and self.compression == "lz77":
+            xml_bin = Lz77().decompress_buffer(memoryview(xml_bin))
+
+        return xml_bin
+
+    def _read_body(self) -> bytearray:
+        length = self._request.content_length
+        if length is None:
+            return bytearray(self._request.get_data())
+
+        body = bytearray(length)
+        view = memoryview(body)
+        stream = self._request.stream
+        readinto = getattr(stream, "readinto", None)
+
+        pos = 0
+        while pos < length:
+            end = min(pos + self.READ_CHUNK, length)
+            if readinto is not None:
+                count = readinto(view[pos:end])
+            else:
+                chunk = stream.read(end - pos)
+                count = len(chunk)
+                view[pos : pos + count] = chunk
+
+            if not count:
+                raise Exception(f"Request body ended after {pos} of {length} bytes")
+            pos += count
+
+        return body
+
+    def response(self, xml_bytes: Union[bytes, eElement, RenderedResponse]):
+        # Firstly, let's make sure xml_bytes is a bytes object. An already rendered
+        # response comes with its binary xml too.
+        rendered: Optional[bytes] = None
+        if isinstance(xml_bytes, RenderedResponse):
+            xml_bytes, rendered = xml_bytes
+        elif type(xml_bytes) == eElement:
             xml_bytes = etree.tostring(xml_bytes, pretty_print=True)
 
-        # Generate our own encryption key
-        x_eamuse_info, key = self._make_encryption_data()
+        # Grab our own encryption key
+        key = RESPONSE_KEYS.take() if self.encrypted else None
 
         # Save our xml response
-        self._save_xml(xml_bytes, "resp", x_eamuse_info if self.encrypted else None)
+        self._save_xml(xml_bytes, "resp")
 
         # Convert our xml to binary
-        xml_bin = KBinXML(xml_bytes).to_binary()
+        xml_bin = rendered if rendered is not None else KBinXML(xml_bytes).to_binary()
 
         # Common Headers
         headers = {
@@ -204,44 +300,61 @@ class ServiceRequest(object):
         # Compress the data if necessary
         # Right now we only support `lz77`
         if self.compressed and self.compression == "lz77":
-            xml_bin = Lz77().compress(xml_bin)
+            xml_bin = RESPONSE_COMPRESSION.compress(xml_bin)
             headers[self.X_COMPRESS] = "lz77"
 
         # Encrypt the data if necessary
-        if self.encrypted:
-            xml_bin = EAmuseARC4(key).encrypt(xml_bin)
-            headers[self.X_EAMUSE_INFO] = x_eamuse_info
+        if key is not None:
+            xml_bin = key.encrypt(xml_bin)
+            headers[self.X_EAMUSE_INFO] = key.info
 
         rlogger.debug(f"Response:\n{xml_bytes.decode(self.ENCODING)}")
+        self._log_queries()
 
         # Update the Static Request ID
         ServiceRequest.REQUEST_ID += 1
 
         return xml_bin, headers
 
+    def _log_queries(self) -> None:
+        queries = self.queries
+        rlogger.info(
+            f"{self.module}.{self.method}: {queries.count} queries in "
+            f"{queries.seconds * 1000:.1f} ms"
+        )
+        metrics.inc("db_queries_total", queries.count)
+        metrics.observe("db_request_seconds", queries.seconds)
+
+        for statement, count in queries.repeated(app.config["REPEATED_QUERY_WARNING"]):
+            metrics.inc("db_repeated_queries_total")
+            logger.warning(
+                f"{self.module}.{self.method} ran the same statement {count} times, "
+                f"possibly an N+1 query: {statement}"
+            )
+
     def _get_encryption_data(self) -> Tuple[str, bytes]:
         x_eamuse_info = self._request.headers[self.X_EAMUSE_INFO]
         key = unhexlify(x_eamuse_info[2:].replace("-", ""))
         return x_eamuse_info, key
 
-    def _make_encryption_data(self) -> Tuple[str, bytes]:
-        info = f"1-{int(time()):08x}-{randint(0x0000, 0xffff):04x}"
-        key = unhexlify(info[2:].replace("-", ""))
-        return info, key
-
-    def _save_xml(self, data: bytes, kind: str, _id: Optional[str]) -> None:
+    def _save_xml(self, data: bytes, kind: str) -> None:
         # Always make sure the dir exists
         self.LOG_DIR.mkdir(parents=True, exist_ok=True)
 
         # We want a unique identifier to match requests and responses, so let's use the
-        # x-eamuse-info header if it exists, else just a hash of the data
-        uid = _id if _id is not None else str(abs(hash(self._request.data)))[0:8]
+        # request's x-eamuse-info header if it exists, else just a hash of the data. The
+        # compression is recorded so that the request can be replayed as it was sent.
+        uid = (
+            self._request.headers[self.X_EAMUSE_INFO]
+            if self.encrypted
+            else f"{crc32(self._body):08x}"
+        )
 
         # Write out the data
         date = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-        filepath = (
-            self.LOG_DIR
-            / f"eamuse_{date}_{uid}_{ServiceRequest.REQUEST_ID:04d}_{kind}.xml"
+        filepath = self.LOG_DIR / (
+            f"eamuse_{date}_{uid}_{self.request_id:04d}_"
+            f"{self.compression}_{kind}.xml"
         )
         with filepath.open("wb") as f:
             logging.debug(f"Writing File: {filepath}")
@@ -254,3 +367,73 @@ class ServiceRequest(object):
             f"encrypted: {self.encrypted}, compressed: {self.compressed}, "
             f'compression: "{self.compression}">'
         )
+
+
+def get_handler(req: ServiceRequest) -> Any:
+    """
+    Find the handler class for the request's module and method, and create it for the
+    request. Calling `response()` on the handler builds the response xml.
+
+    Args:
+        req (ServiceRequest): The parsed request
+
+    Returns:
+        Any: The handler for the request
+    """
+    if req.method is None:
+        raise Exception(f"Not sure how to handle this Request: {req}")
+
+    method = req.method.title().replace("_", "")
+    try:
+        module = importlib.import_module(f"v8_server.eamuse.services.{req.module}")
+    except ModuleNotFoundError:
+        logger.error(f"No Module found for request: {req}")
+        raise
+
+    try:
+        cls = getattr(module, method)
+    except AttributeError:
+        logger.error(f"No Class found for request: {req}")
+        raise
+
+    handler = cls(req)
+    logger.debug(handler)
+    return handler
+
+
+def static_response(
+    *config: str, vary: Optional[Callable[[Any], Hashable]] = None
+) -> Callable[[Type[T]], Type[T]]:
+    """
+    Class decorator for handlers whose response is always the same, or only depends on
+    the named `app.config` values. The response is rendered and kbin encoded the first
+    time it is needed and then reused, until one of those config values changes.
+
+    Args:
+        config (str): The config values the response is built from
+        vary (Optional[Callable[[Any], Hashable]]): For a response that also depends on
+            the request, returns what it depends on from the handler
+
+    Returns:
+        Callable[[Type[T]], Type[T]]: The class decorator
+    """
+
+    def decorate(cls: Type[T]) -> Type[T]:
+        render = cls.response  # type: ignore
+        # A few renders are kept, so switching a config value back and forth or
+        # varying on a flag doesn't render every time
+        responses = VersionedResponses(8)
+
+        @wraps(render)
+        def response(self) -> RenderedResponse:
+            key = (
+                tuple(app.config[name] for name in config),
+                vary(self) if vary is not None else None,
+            )
+            return responses.get(key, lambda: render(self))
+
+        cls.response = response  # type: ignore
+        cls.RESPONSES = responses  # type: ignore
+        return cls
+
+    return decorate
@@ -2,7 +2,7 @@ import logging
 
 from lxml import etree
 
-from v8_server.eamuse.services.services import ServiceRequest
+from v8_server.eamuse.services.services import ServiceRequest, static_response
 from v8_server.eamuse.xml.utils import get_xml_attrib, load_xml_template
 from v8_server.utils.convert import int_to_bool as itob
 
@@ -152,6 +152,7 @@ class Shop(object):
         )
 
 
+@static_response()
 class Regist(object):
     """
     Handle the Shopinfo Regist request.
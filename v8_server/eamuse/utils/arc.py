@@ -1,7 +1,51 @@
+from __future__ import annotations
+
+import logging
+import mmap
 import struct
-from typing import Dict, List, Tuple
+import threading
+from collections import OrderedDict
+from concurrent.futures import as_completed
+from pathlib import Path, PurePosixPath
+from time import perf_counter
+from typing import Any, Dict, List, NamedTuple, Optional, Union
 
 from v8_server.eamuse.utils.lz77 import Lz77
+from v8_server.utils.workers import worker_pool
+
+
+logger = logging.getLogger(__name__)
+
+ArcData = Union[bytes, mmap.mmap]
+
+
+class ArcException(Exception):
+    pass
+
+
+class ArcMember(NamedTuple):
+    name: str
+    offset: int
+    uncompressed_size: int
+    compressed_size: int
+
+    @property
+    def compressed(self) -> bool:
+        return self.compressed_size != self.uncompressed_size
+
+
+class ExtractResult(NamedTuple):
+    files: int
+    compressed_bytes: int
+    uncompressed_bytes: int
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        """
+        Uncompressed bytes written per second
+        """
+        return self.uncompressed_bytes / self.seconds if self.seconds > 0 else 0.0
 
 
 class ARC:
@@ -10,48 +54,216 @@ class ARC:
     other games that use ESS. Given a serires of bytes, this will allow you to
     query included filenames as well as read the contents of any file inside the
     archive.
+
+    Use `ARC.open` to memory map an archive on disk instead of reading all of it. Stored
+    members of a mapped archive are returned as memoryviews into the map, which need to
+    be released before the archive is closed.
     """
 
-    def __init__(self, data: bytes) -> None:
-        self.__files: Dict[str, Tuple[int, int, int]] = {}
-        self.__data = data
+    # Decompressed members are cached, up to this many bytes in total
+    CACHE_SIZE = 32 * 1024 * 1024
+
+    MAGIC = bytes([0x20, 0x11, 0x75, 0x19])
+
+    def __init__(self, data: ArcData, cache_size: int = CACHE_SIZE) -> None:
+        self.__files: Dict[str, ArcMember] = {}
+        self.__raw = data
+        self.__data: Union[bytes, memoryview] = (
+            memoryview(data) if isinstance(data, mmap.mmap) else data
+        )
+        self.__cache: OrderedDict[str, bytes] = OrderedDict()
+        self.__cache_size = cache_size
+        self.__cached = 0
+        self.__lock = threading.Lock()
         self.__parse_file(data)
 
-    def __parse_file(self, data: bytes) -> None:
+    @classmethod
+    def open(cls, path: Union[str, Path], cache_size: int = CACHE_SIZE) -> ARC:
+        """
+        Memory map the archive at `path`. Only the directory is read up front, members
+        are paged in when they are read.
+        """
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(data, cache_size)
+
+    def __parse_file(self, data: ArcData) -> None:
         # Check file header
-        if data[0:4] != bytes([0x20, 0x11, 0x75, 0x19]):
-            raise Exception("Unknown file format!")
+        if data[0:4] != self.MAGIC:
+            raise ArcException("Unknown file format!")
 
         # Grab header offsets
         (_, numfiles, _) = struct.unpack("<III", data[4:16])
 
-        for fno in range(numfiles):
-            start = 16 + (16 * fno)
-            end = start + 16
-            (nameoffset, fileoffset, uncompressedsize, compressedsize) = struct.unpack(
-                "<IIII", data[start:end]
-            )
-            name = ""
+        entries = struct.iter_unpack("<IIII", data[16 : 16 + (16 * numfiles)])
+        for (nameoffset, fileoffset, uncompressedsize, compressedsize) in entries:
+            nameend = data.find(b"\0", nameoffset)
+            if nameend < 0:
+                raise ArcException("Unterminated file name!")
 
-            while data[nameoffset] != 0:
-                name = name + data[nameoffset : (nameoffset + 1)].decode("ascii")
-                nameoffset = nameoffset + 1
-
-            self.__files[name] = (fileoffset, uncompressedsize, compressedsize)
+            name = data[nameoffset:nameend].decode("ascii")
+            self.__files[name] = ArcMember(
+                name, fileoffset, uncompressedsize, compressedsize
+            )
 
     @property
     def filenames(self) -> List[str]:
         return [f for f in self.__files]
 
-    def read_file(self, filename: str) -> bytes:
-        (fileoffset, uncompressedsize, compressedsize) = self.__files[filename]
+    @property
+    def members(self) -> List[ArcMember]:
+        return list(self.__files.values())
+
+    def read_file(self, filename: str) -> Union[bytes, memoryview]:
+        (_, fileoffset, uncompressedsize, compressedsize) = self.__files[filename]
+        member = self.__data[fileoffset : (fileoffset + compressedsize)]
 
         if compressedsize == uncompressedsize:
             # Just stored
-            return self.__data[fileoffset : (fileoffset + compressedsize)]
-        else:
-            # Compressed
-            lz77 = Lz77()
-            return lz77.decompress(
-                self.__data[fileoffset : (fileoffset + compressedsize)]
+            return member
+
+        # Compressed
+        with self.__lock:
+            cached = self.__cache.get(filename)
+            if cached is not None:
+                self.__cache.move_to_end(filename)
+                return cached
+
+        lz77 = Lz77()
+        data = lz77.decompress(member)
+        self.__store(filename, data)
+        return data
+
+    def close(self) -> None:
+        """
+        Unmap the archive, if it was opened with `ARC.open`
+        """
+        with self.__lock:
+            self.__cache.clear()
+            self.__cached = 0
+
+        if isinstance(self.__data, memoryview):
+            self.__data.release()
+        if isinstance(self.__raw, mmap.mmap):
+            self.__raw.close()
+
+    def __store(self, filename: str, data: bytes) -> None:
+        if len(data) > self.__cache_size:
+            return
+
+        with self.__lock:
+            if filename in self.__cache:
+                return
+
+            self.__cache[filename] = data
+            self.__cached += len(data)
+            while self.__cached > self.__cache_size:
+                _, evicted = self.__cache.popitem(last=False)
+                self.__cached -= len(evicted)
+
+    def __enter__(self) -> ARC:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return f"ARC<files: {len(self.__files)}, cached: {self.__cached}>"
+
+
+# The archive opened by each extraction worker process
+_worker_arc: Optional[ARC] = None
+
+
+def _init_worker(path: str) -> None:
+    global _worker_arc
+    # Members are only read once, so there is no point caching them
+    _worker_arc = ARC.open(path, cache_size=0)
+
+
+def _extract_in_worker(member: ArcMember, output: Path) -> int:
+    if _worker_arc is None:
+        raise ArcException("Extraction worker has not been initialized")
+    return _extract_member(_worker_arc, member, output)
+
+
+def _extract_member(arc: ARC, member: ArcMember, output: Path) -> int:
+    data = arc.read_file(member.name)
+    try:
+        if len(data) != member.uncompressed_size:
+            raise ArcException(
+                f"{member.name}: expected {member.uncompressed_size} bytes, "
+                f"got {len(data)}"
             )
+
+        path = output / member_path(member.name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("wb") as f:
+            f.write(data)
+    finally:
+        if isinstance(data, memoryview):
+            data.release()
+
+    return member.uncompressed_size
+
+
+def member_path(name: str) -> Path:
+    """
+    Return the relative path to extract a member to, refusing anything that would end
+    up outside of the output directory
+    """
+    path = PurePosixPath(name.replace("\\", "/"))
+    if path.is_absolute() or ".." in path.parts or not path.parts:
+        raise ArcException(f"Refusing to extract {name}")
+    return Path(*path.parts)
+
+
+def extract(
+    path: Union[str, Path], output: Union[str, Path], workers: Optional[int] = None
+) -> ExtractResult:
+    """
+    Extract every member of an archive into `output`.
+
+    Members are decompressed by a pool of `workers` processes (one per CPU by default),
+    each with its own mapping of the archive, and written straight to disk. The size of
+    every member is checked against the size recorded in the archive.
+
+    Args:
+        path (Union[str, Path]): The `.arc` file to extract
+        output (Union[str, Path]): Directory to extract into
+        workers (Optional[int]): Number of worker processes, 1 extracts in this process
+
+    Returns:
+        ExtractResult: What was extracted, and how long it took
+    """
+    start = perf_counter()
+    output = Path(output)
+
+    with ARC.open(path) as arc:
+        # Hand out the biggest members first so that no worker is left with a large
+        # one at the end
+        members = sorted(arc.members, key=lambda m: m.compressed_size, reverse=True)
+    for member in members:
+        member_path(member.name)
+
+    if workers == 1:
+        with ARC.open(path, cache_size=0) as arc:
+            for member in members:
+                _extract_member(arc, member, output)
+    else:
+        with worker_pool(workers, _init_worker, (str(path),)) as executor:
+            futures = [
+                executor.submit(_extract_in_worker, member, output)
+                for member in members
+            ]
+            for future in as_completed(futures):
+                future.result()
+
+    result = ExtractResult(
+        len(members),
+        sum(m.compressed_size for m in members),
+        sum(m.uncompressed_size for m in members),
+        perf_counter() - start,
+    )
+    logger.info(f"Extracted {path}: {result}")
+    return result
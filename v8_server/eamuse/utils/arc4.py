@@ -1,9 +1,16 @@
-from typing import Iterable
+from typing import Iterable, Union
 
+import numpy as np
 from Crypto.Cipher import ARC4
 from Crypto.Hash import MD5
 
 
+# In place decryption generates the keystream this many bytes at a time
+KEYSTREAM_CHUNK = 64 * 1024
+
+_ZEROS = memoryview(bytes(KEYSTREAM_CHUNK))
+
+
 class EAmuseARC4(object):
     def __init__(self, eamuse_key) -> None:
         secret_key = 0x69D74627D985EE2187161570D08D93B12455035B6DF0D8205DF5
@@ -16,3 +23,14 @@ class EAmuseARC4(object):
 
     def encrypt(self, data: Iterable[int]) -> bytes:
         return self.arc.encrypt(bytes(data))
+
+    def decrypt_into(self, data: Union[bytearray, memoryview]) -> None:
+        """
+        Decrypt a writable buffer in place. ARC4 from pycryptodome can't write its
+        output into an existing buffer, so the keystream is generated in chunks and
+        XORed into `data`, which keeps the extra memory used to a single chunk.
+        """
+        view = np.frombuffer(data, dtype=np.uint8)
+        for start in range(0, len(view), KEYSTREAM_CHUNK):
+            chunk = view[start : start + KEYSTREAM_CHUNK]
+            chunk ^= np.frombuffer(self.arc.encrypt(_ZEROS[: len(chunk)]), np.uint8)
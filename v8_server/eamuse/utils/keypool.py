@@ -0,0 +1,147 @@
+"""
+Pre-generated ARC4 keys for encrypting responses.
+
+Every encrypted response needs a fresh `x-eamuse-info` header, and the ARC4 key derived
+from it. Deriving the key and running the RC4 key schedule is done ahead of time on a
+background thread, along with the first `prefix` bytes of the keystream. Encrypting a
+response that fits in the prefix is then a single vectorized XOR.
+"""
+
+import logging
+import threading
+from binascii import unhexlify
+from collections import deque
+from random import randint
+from time import monotonic, sleep, time
+from typing import Deque, Optional, Set
+
+import numpy as np
+
+from v8_server.eamuse.utils.arc4 import EAmuseARC4
+
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseKey(object):
+    """
+    A single use response key. `info` is the `x-eamuse-info` header to send along
+    with the response that was encrypted with this key.
+    """
+
+    def __init__(self, info: str, prefix: int = 0) -> None:
+        self.info = info
+        self.created = monotonic()
+        self.arc4 = EAmuseARC4(unhexlify(info[2:].replace("-", "")))
+        # Run the first part of the keystream now, which also leaves the cipher right
+        # where it needs to be to encrypt anything past the prefix
+        self.keystream = np.frombuffer(self.arc4.encrypt(bytes(prefix)), np.uint8)
+
+    def encrypt(self, data: bytes) -> bytes:
+        size = len(self.keystream)
+        head = np.frombuffer(data, np.uint8, count=min(size, len(data)))
+        encrypted = np.bitwise_xor(head, self.keystream[: len(head)]).tobytes()
+        if len(data) > size:
+            encrypted += self.arc4.encrypt(data[size:])
+        return encrypted
+
+    def __repr__(self) -> str:
+        return f'ResponseKey<info: "{self.info}", prefix: {len(self.keystream)}>'
+
+
+class KeyPool(object):
+    """
+    Keeps up to `size` response keys ready. Keys are handed out oldest first, and any
+    key older than `max_age` seconds is thrown away so the timestamp in the header
+    stays close to the time the response is sent. When the pool is empty (or `size` is
+    0) a key is generated on the spot instead.
+
+    Headers are never handed out twice. The header is the current time in seconds plus
+    16 random bits, so the random parts used in the current second are remembered.
+    """
+
+    def __init__(self, size: int, prefix: int, max_age: float) -> None:
+        self.size = size
+        self.prefix = prefix
+        self.max_age = max_age
+
+        self._keys: Deque[ResponseKey] = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+        self._info_lock = threading.Lock()
+        self._info_second = 0
+        self._info_used: Set[int] = set()
+
+    def take(self) -> ResponseKey:
+        """
+        Return a key that hasn't been used before
+        """
+        if self.size <= 0:
+            return ResponseKey(self.make_info())
+
+        with self._cond:
+            self._start()
+            self._expire()
+            key = self._keys.popleft() if self._keys else None
+            self._cond.notify()
+
+        if key is None:
+            logger.debug("Response key pool is empty, generating a key")
+            key = ResponseKey(self.make_info())
+        return key
+
+    def make_info(self) -> str:
+        """
+        Generate a new `x-eamuse-info` header for the current time
+        """
+        with self._info_lock:
+            while True:
+                now = int(time())
+                if now != self._info_second:
+                    self._info_second = now
+                    self._info_used.clear()
+
+                if len(self._info_used) < 0x10000:
+                    break
+                # Every header for this second has been handed out already
+                sleep(now + 1 - time())
+
+            while (rand := randint(0x0000, 0xFFFF)) in self._info_used:
+                pass
+            self._info_used.add(rand)
+
+        return f"1-{now:08x}-{rand:04x}"
+
+    def __len__(self) -> int:
+        with self._cond:
+            self._expire()
+            return len(self._keys)
+
+    def _start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._fill, name="response-key-pool", daemon=True
+            )
+            self._thread.start()
+
+    def _expire(self) -> None:
+        cutoff = monotonic() - self.max_age
+        while self._keys and self._keys[0].created < cutoff:
+            self._keys.popleft()
+
+    def _fill(self) -> None:
+        while True:
+            with self._cond:
+                self._expire()
+                while len(self._keys) >= self.size:
+                    # Wake up in time to replace keys as they expire
+                    self._cond.wait(self.max_age / 2)
+                    self._expire()
+                missing = self.size - len(self._keys)
+
+            # Generating keys doesn't need the lock, only adding them to the pool does
+            for _ in range(missing):
+                key = ResponseKey(self.make_info(), self.prefix)
+                with self._cond:
+                    self._keys.append(key)
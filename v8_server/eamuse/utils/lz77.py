@@ -2,7 +2,10 @@
 # https://github.com/ByteFun/bemaniutils/blob/bd467a9b732a25a1c8aba75106dc459fbdff61b0/
 # bemani/protocol/lz77.py
 from collections import defaultdict
-from typing import Generator, List, Mapping, Optional, Set, Tuple
+from itertools import islice
+from typing import Callable, Dict, Generator, List, Mapping, Optional, Set, Tuple, Union
+
+from v8_server.utils.workers import worker_pool
 
 
 class LzException(Exception):
@@ -141,6 +144,8 @@ class Lz77Decompress:
 
                     # Grab chunk right out of the data source
                     b = self.data[self.read_pos : (self.read_pos + amount)]
+                    if len(b) < amount:
+                        raise LzException("Unexpected EOF mid-copy")
                     self.__ring_write(b)
                     yield b
 
@@ -218,22 +223,27 @@ class Lz77Compress:
     FLAG_COPY = 1
     FLAG_BACKREF = 0
 
-    def __init__(self, data: bytes, backref: Optional[int] = None) -> None:
+    def __init__(
+        self, data: bytes, backref: Optional[int] = None, start: int = 0
+    ) -> None:
         """
         Initialize the object.
 
         Parameters:
             data - Binary blob representing the data to be decompressed.
+            start - Only compress data from this offset. The bytes before it are
+                    used as the backref dictionary, as if they had just been output.
         """
         self.data: bytes = data
-        self.read_pos: int = 0
-        self.left: int = len(self.data)
+        self.read_pos: int = start
+        self.left: int = len(self.data) - start
         self.eof: bool = False
         self.bytes_written: int = 0
         self.ringlength: int = backref or self.RING_LENGTH
         self.locations: Mapping[int, Set[int]] = defaultdict(set)
         self.starts: Mapping[bytes, Set[int]] = defaultdict(set)
         self.last_start: Tuple[int, int, int] = (0, 0, 0)
+        self.__ring_write(data[:start])
 
     def __ring_write(self, bytedata: bytes) -> None:
         """
@@ -299,7 +309,9 @@ class Lz77Compress:
 
                     # Iterate over all spots where the first byte equals, and is in
                     # range.
-                    earliest = max(0, self.bytes_written - self.ringlength)
+                    # A backref of the full ring length would be encoded as 0, which
+                    # is the end of stream marker, so stop one byte short of it.
+                    earliest = max(0, self.bytes_written - self.ringlength + 1)
                     possible_backref_locations: List[int] = [
                         absolute_pos
                         for absolute_pos in self.starts[
@@ -369,20 +381,198 @@ class Lz77Compress:
                 yield bytes([flags]) + b"".join(data[: (flagpos + 1)])
 
 
+class Lz77CompressHigh:
+    """
+    A slower Lz77 compressor that trades speed for a better compression ratio. Every
+    candidate within the window is checked for the longest match (preferring the
+    closest one), and a match is put off by one byte whenever the next position has a
+    longer match (lazy matching). The output is a regular Lz77 stream.
+    """
+
+    MIN_MATCH = 3
+    MAX_MATCH = 18
+
+    # How many earlier occurrences of a 3 byte sequence are checked for each match
+    MAX_CHAIN = 256
+
+    def __init__(
+        self, data: bytes, backref: Optional[int] = None, start: int = 0
+    ) -> None:
+        """
+        Initialize the object.
+
+        Parameters:
+            data - Binary blob representing the data to be compressed.
+            start - Only compress data from this offset. The bytes before it are
+                    used as the backref dictionary, as if they had just been output.
+        """
+        self.data: bytes = data
+        self.start: int = start
+        # A backref of the full ring length can't be encoded, see `Lz77Compress`
+        self.window: int = (backref or Lz77Compress.RING_LENGTH) - 1
+        self.heads: Dict[bytes, List[int]] = defaultdict(list)
+        for pos in range(0, start):
+            self.__insert(pos)
+
+    def __insert(self, pos: int) -> None:
+        if pos + self.MIN_MATCH <= len(self.data):
+            self.heads[self.data[pos : pos + self.MIN_MATCH]].append(pos)
+
+    def __find(self, pos: int) -> Tuple[int, int]:
+        """
+        Find the longest match for the data at `pos`.
+
+        Returns:
+            The match length and its distance back, or (0, 0) if there is no match.
+        """
+        data = self.data
+        limit = min(self.MAX_MATCH, len(data) - pos)
+        if limit < self.MIN_MATCH:
+            return (0, 0)
+
+        best_len, best_dist = 0, 0
+        earliest = pos - self.window
+        candidates = self.heads.get(data[pos : pos + self.MIN_MATCH], [])
+
+        # Most recent first, so the closest of equally long matches wins
+        for candidate in islice(reversed(candidates), self.MAX_CHAIN):
+            if candidate < earliest:
+                break
+
+            length = self.MIN_MATCH
+            while length < limit and data[candidate + length] == data[pos + length]:
+                length += 1
+
+            if length > best_len:
+                best_len, best_dist = length, pos - candidate
+                if length == limit:
+                    break
+
+        return (best_len, best_dist)
+
+    def instructions(self) -> Tuple[bytes, bytes]:
+        """
+        Compress the data.
+
+        Returns:
+            The flag of every instruction (one byte each), and the instruction data
+            without the end of stream marker.
+        """
+        flags = bytearray()
+        payload = bytearray()
+        pos = self.start
+        match = self.__find(pos)
+
+        while pos < len(self.data):
+            length, distance = match
+            if length < self.MIN_MATCH:
+                flags.append(Lz77Compress.FLAG_COPY)
+                payload.append(self.data[pos])
+                self.__insert(pos)
+                pos += 1
+                match = self.__find(pos)
+                continue
+
+            # Lazy matching, if the next byte starts a longer match it is worth sending
+            # this byte as is and taking that match instead
+            self.__insert(pos)
+            following = self.__find(pos + 1)
+            if following[0] > length:
+                flags.append(Lz77Compress.FLAG_COPY)
+                payload.append(self.data[pos])
+                pos += 1
+                match = following
+                continue
+
+            flags.append(Lz77Compress.FLAG_BACKREF)
+            payload.append((distance >> 4) & 0xFF)
+            payload.append(((length - 3) & 0xF) | ((distance & 0xF) << 4))
+            for inserted in range(pos + 1, pos + length):
+                self.__insert(inserted)
+            pos += length
+            match = self.__find(pos)
+
+        return bytes(flags), bytes(payload)
+
+
+def _pack_instructions(flags: bytes, payload: bytes) -> bytes:
+    """
+    Group instructions 8 at a time behind a flag byte, the same as `Lz77Compress`
+    does, and end the stream with the end of stream marker.
+    """
+    out = bytearray()
+    pos = 0
+    for group in range(0, len(flags) + 1, 8):
+        group_flags = flags[group : group + 8]
+        size = sum(2 - flag for flag in group_flags)
+
+        out.append(sum(flag << bit for bit, flag in enumerate(group_flags)))
+        out += payload[pos : pos + size]
+        pos += size
+
+        if len(group_flags) < 8:
+            out += b"\x00\x00"
+    return bytes(out)
+
+
+def _compress_block(
+    data: bytes, start: int, backref: Optional[int], high_ratio: bool = False
+) -> Tuple[bytes, bytes]:
+    """
+    Compress `data[start:]` using `data[:start]` as the dictionary, and split the result
+    into its instructions.
+
+    Returns:
+        The flag of every instruction (one byte each), and the instruction data without
+        the end of stream marker.
+    """
+    if high_ratio:
+        return Lz77CompressHigh(data, backref=backref, start=start).instructions()
+
+    lz = Lz77Compress(data, backref=backref, start=start)
+    compressed = b"".join(lz.compress_bytes())
+
+    flags = bytearray()
+    payload = bytearray()
+    pos = 0
+    while True:
+        flagbyte = compressed[pos]
+        pos += 1
+        for bit in range(8):
+            if (flagbyte >> bit) & 1 == Lz77Compress.FLAG_COPY:
+                flags.append(Lz77Compress.FLAG_COPY)
+                payload += compressed[pos : pos + 1]
+                pos += 1
+            elif compressed[pos] == 0 and compressed[pos + 1] & 0xF0 == 0:
+                return bytes(flags), bytes(payload)
+            else:
+                flags.append(Lz77Compress.FLAG_BACKREF)
+                payload += compressed[pos : pos + 2]
+                pos += 2
+
+
 class Lz77:
     """
     A wrapper class encapsulating Lz77 encoding and decoding.
     """
 
+    # Blocks handed to each worker by `compress_parallel`
+    PARALLEL_BLOCK_SIZE = 64 * 1024
+
     # The point at which we consider it better to trade off smaller data
     # sent over the wire for a more computationally expensive compression.
     REAL_COMPRESSION_THRESHOLD = 10 * 1024
 
-    def __init__(self, backref: Optional[int] = None) -> None:
+    def __init__(self, backref: Optional[int] = None, high_ratio: bool = False) -> None:
         """
         Initialize the object.
+
+        Parameters:
+            high_ratio - Compress with `Lz77CompressHigh`, which is slower but produces
+                         smaller output.
         """
         self.backref = backref
+        self.high_ratio = high_ratio
 
     def decompress(self, data: bytes) -> bytes:
         """
@@ -398,6 +588,20 @@ class Lz77:
         lz = Lz77Decompress(data, backref=self.backref)
         return b"".join(lz.decompress_bytes())
 
+    def decompress_buffer(self, data: Union[bytes, bytearray, memoryview]) -> bytearray:
+        """
+        Same as `decompress`, but the input can be any buffer, for example a memoryview
+        of the request body, and the output is built straight into a bytearray.
+
+        Parameters:
+            data - Lz77-compressed binary data
+
+        Returns:
+            Raw binary data.
+        """
+        lz = Lz77Decompress(data, backref=self.backref)
+        return bytearray().join(lz.decompress_bytes())
+
     def compress(self, data: bytes) -> bytes:
         """
         Given a binary blob, return a new binary blob representing the compressed data.
@@ -408,5 +612,95 @@ class Lz77:
         Returns:
             L7zz-compressed binary data.
         """
+        if self.high_ratio:
+            lz = Lz77CompressHigh(data, backref=self.backref)
+            return _pack_instructions(*lz.instructions())
+
         lz = Lz77Compress(data, backref=self.backref)
         return b"".join(lz.compress_bytes())
+
+    def compress_literal(self, data: bytes) -> bytes:
+        """
+        Encode the data without looking for any backrefs at all. The output is an eighth
+        bigger than the input, but producing it costs next to nothing.
+
+        Parameters:
+            data - Raw binary data.
+
+        Returns:
+            L7zz-compressed binary data.
+        """
+        out = bytearray()
+        full = len(data) - len(data) % 8
+        for pos in range(0, full, 8):
+            out.append(0xFF)
+            out += data[pos : pos + 8]
+
+        # The last flag byte also holds the end of stream marker
+        rest = data[full:]
+        out.append((1 << len(rest)) - 1)
+        out += rest
+        out += b"\x00\x00"
+        return bytes(out)
+
+    def compress_parallel(
+        self,
+        data: bytes,
+        workers: Optional[int] = None,
+        block_size: int = PARALLEL_BLOCK_SIZE,
+    ) -> bytes:
+        """
+        Compress large data on multiple processes. Backrefs can only reach back one
+        ring length, so the data is split into blocks which are compressed separately,
+        each with the ring length of data before it as its dictionary. The blocks
+        don't line up with the flag bytes, so the instructions of all blocks are
+        regrouped into a single stream, which decompresses like any other.
+
+        Parameters:
+            data - Raw binary data.
+            workers - Number of worker processes, defaults to one per CPU.
+            block_size - Size of the blocks handed to each worker.
+
+        Returns:
+            L7zz-compressed binary data.
+        """
+        if len(data) <= block_size or workers == 1:
+            return self.compress(data)
+
+        with worker_pool(workers) as executor:
+            return self.compress_blocks(data, block_size, executor.map)
+
+    def compress_blocks(
+        self, data: bytes, block_size: int, mapper: Callable = map
+    ) -> bytes:
+        """
+        The block splitting behind `compress_parallel`. `mapper` runs the blocks, it
+        is called like the builtin `map`, which runs them all in this process.
+
+        Parameters:
+            data - Raw binary data.
+            block_size - Size of each block.
+            mapper - Function used to compress all blocks.
+
+        Returns:
+            L7zz-compressed binary data.
+        """
+        window = (self.backref or Lz77Compress.RING_LENGTH) - 1
+        blocks = []
+        for start in range(0, len(data), block_size):
+            dictionary = max(0, start - window)
+            blocks.append(data[dictionary : start + block_size])
+
+        results = list(
+            mapper(
+                _compress_block,
+                blocks,
+                [min(i * block_size, window) for i in range(len(blocks))],
+                [self.backref] * len(blocks),
+                [self.high_ratio] * len(blocks),
+            )
+        )
+
+        flags = b"".join(flags for flags, _ in results)
+        payload = b"".join(payload for _, payload in results)
+        return _pack_instructions(flags, payload)
@@ -0,0 +1,265 @@
+"""
+Corpus builder and differential fuzzer for the Lz77 engines.
+
+The corpus is made of real payloads: the kbin encoded requests and responses from the
+request capture directory, plus every response template. The fuzzer compresses corpus
+samples and generated data with every engine, and checks that `Lz77Decompress` gives
+back exactly the original data.
+"""
+
+import hashlib
+import logging
+import random
+import re
+from pathlib import Path
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from kbinxml import KBinXML
+from lxml import etree
+
+from v8_server.eamuse.utils.lz77 import Lz77, LzException
+from v8_server.eamuse.xml.utils import fill, load_xml_template
+
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_PATH = Path(__file__).parent.parent / "xml" / "templates"
+
+PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+COUNT_RE = re.compile(r'__count="(\d+)"[^>]*>\s*\{(\w+)\}')
+
+# Ring lengths the engines are fuzzed with, None is the default of 0x1000
+RING_LENGTHS = [None, 0x100, 0x400]
+
+# Compression engines, given the ring length to use
+Engine = Callable[[Optional[int]], Callable[[bytes], bytes]]
+
+ENGINES: Dict[str, Engine] = {
+    "default": lambda backref: Lz77(backref).compress,
+    "high": lambda backref: Lz77(backref, high_ratio=True).compress,
+    "literal": lambda backref: Lz77(backref).compress_literal,
+    "blocks": lambda backref: lambda data: Lz77(backref).compress_blocks(data, 1000),
+    "high_blocks": lambda backref: lambda data: Lz77(
+        backref, high_ratio=True
+    ).compress_blocks(data, 1000),
+}
+
+
+def template_args(path: Path) -> Dict[str, str]:
+    """
+    Arguments that render a template with zeroes for all of its values
+    """
+    text = path.read_text()
+    args: Dict[str, str] = {name: "0" for name in PLACEHOLDER_RE.findall(text)}
+    args.update({name: fill(int(count)) for count, name in COUNT_RE.findall(text)})
+    return args
+
+
+def template_payloads() -> List[Tuple[str, bytes]]:
+    """
+    Render every response template with zeroes for its values and encode it as kbin
+    """
+    payloads = []
+    for path in sorted(TEMPLATE_PATH.glob("*/*.xml")):
+        xml = load_xml_template(path.parent.name, path.stem, template_args(path))
+        payloads.append((f"{path.parent.name}/{path.name}", KBinXML(xml).to_binary()))
+    return payloads
+
+
+def capture_payloads(capture_path: Path) -> Iterator[Tuple[str, bytes]]:
+    """
+    Encode the captured requests and responses in `capture_path` as kbin, which is
+    exactly what gets compressed on the wire. Captures that can't be encoded are
+    skipped.
+    """
+    for path in sorted(capture_path.glob("*.xml")):
+        try:
+            xml = etree.fromstring(path.read_bytes())
+            yield path.name, KBinXML(xml).to_binary()
+        except Exception as e:
+            logger.warning(f"Skipping capture {path.name}: {e}")
+
+
+def build_corpus(output: Path, capture_path: Optional[Path] = None) -> int:
+    """
+    Write the template payloads, and the captured payloads if `capture_path` is given,
+    to `output` as one `.bin` file each. Files are named after their contents, so
+    building the corpus again only adds new payloads.
+
+    Returns:
+        int: The number of new payloads
+    """
+    output.mkdir(parents=True, exist_ok=True)
+    sources = template_payloads()
+    if capture_path is not None:
+        sources += list(capture_payloads(capture_path))
+
+    added = 0
+    for _, payload in sources:
+        path = output / f"{hashlib.sha1(payload).hexdigest()}.bin"
+        if not path.exists():
+            path.write_bytes(payload)
+            added += 1
+    return added
+
+
+def load_corpus(corpus_path: Path) -> List[bytes]:
+    return [path.read_bytes() for path in sorted(corpus_path.glob("*.bin"))]
+
+
+def generate(rng: random.Random, corpus: List[bytes]) -> bytes:
+    """
+    Generate one fuzz input. Besides random data this produces long runs and short
+    repeating patterns, which make backrefs that overlap the data they copy
+    (`Lz77Decompress.pending_copy_*`), sizes around the ring length, and mutated
+    corpus samples.
+    """
+    kind = rng.randrange(6)
+    size = rng.choice(
+        [rng.randrange(32), rng.randrange(5000), 0x1000 + rng.randrange(-3, 4)]
+    )
+
+    if kind == 0:
+        return bytes(rng.randrange(256) for _ in range(size))
+    if kind == 1:
+        pattern = bytes(rng.randrange(256) for _ in range(rng.randint(1, 20)))
+        return (pattern * (size // len(pattern) + 1))[:size]
+    if kind == 2:
+        words = [
+            bytes(rng.randrange(4) for _ in range(rng.randint(1, 8))) for _ in range(8)
+        ]
+        return b"".join(rng.choice(words) for _ in range(size // 4))
+    if kind == 3 and corpus:
+        data = bytearray(rng.choice(corpus))
+        for _ in range(rng.randint(0, 8)):
+            if data:
+                data[rng.randrange(len(data))] = rng.randrange(256)
+        return bytes(data)
+    if kind == 4 and corpus:
+        return b"".join(rng.choice(corpus) for _ in range(rng.randint(2, 6)))
+    return bytes([rng.randrange(256)]) * size
+
+
+class EngineStats(object):
+    def __init__(self) -> None:
+        self.runs = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """
+        Input bytes compressed per second
+        """
+        return self.bytes_in / self.seconds if self.seconds > 0 else 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"EngineStats<runs: {self.runs}, bytes_in: {self.bytes_in}, "
+            f"bytes_out: {self.bytes_out}, seconds: {self.seconds:.3f}>"
+        )
+
+
+class Failure(NamedTuple):
+    engine: str
+    backref: Optional[int]
+    reason: str
+    data: bytes
+
+
+class FuzzReport(object):
+    def __init__(self) -> None:
+        self.engines: Dict[str, EngineStats] = {name: EngineStats() for name in ENGINES}
+        self.failures: List[Failure] = []
+        self.truncations = 0
+
+    @property
+    def ok(self) -> bool:
+        return not self.failures
+
+
+def check(
+    data: bytes, report: FuzzReport, rng: random.Random, truncate: bool = True
+) -> None:
+    """
+    Run one input through every engine and ring length, and record any mismatch
+    """
+    for backref in RING_LENGTHS:
+        for name, engine in ENGINES.items():
+            compress = engine(backref)
+
+            start = perf_counter()
+            try:
+                compressed = compress(data)
+            except Exception as e:
+                report.failures.append(Failure(name, backref, f"compress: {e!r}", data))
+                continue
+            stats = report.engines[name]
+            stats.seconds += perf_counter() - start
+            stats.runs += 1
+            stats.bytes_in += len(data)
+            stats.bytes_out += len(compressed)
+
+            lz = Lz77(backref)
+            try:
+                decompressed = lz.decompress(compressed)
+                buffered = lz.decompress_buffer(memoryview(compressed))
+            except Exception as e:
+                report.failures.append(
+                    Failure(name, backref, f"decompress: {e!r}", data)
+                )
+                continue
+
+            if decompressed != data:
+                report.failures.append(Failure(name, backref, "round trip", data))
+            elif buffered != decompressed:
+                report.failures.append(
+                    Failure(name, backref, "decompress_buffer", data)
+                )
+            elif truncate and compressed:
+                # A truncated stream has to either fail cleanly, or decode to a prefix
+                # of the original data
+                cut = rng.randrange(len(compressed))
+                report.truncations += 1
+                try:
+                    partial = lz.decompress(compressed[:cut])
+                except LzException:
+                    continue
+                except Exception as e:
+                    report.failures.append(
+                        Failure(name, backref, f"truncated at {cut}: {e!r}", data)
+                    )
+                    continue
+                if not data.startswith(partial):
+                    report.failures.append(
+                        Failure(
+                            name, backref, f"truncated at {cut}: not a prefix", data
+                        )
+                    )
+
+
+def fuzz(
+    corpus: List[bytes], iterations: int, seed: Optional[int] = None
+) -> FuzzReport:
+    """
+    Check every corpus sample, then `iterations` generated inputs.
+
+    Args:
+        corpus (List[bytes]): Real payloads, see `build_corpus`
+        iterations (int): Number of generated inputs to check
+        seed (Optional[int]): Seed for the generated inputs, to reproduce a run
+
+    Returns:
+        FuzzReport: Throughput of every engine and any failures found
+    """
+    rng = random.Random(seed)
+    report = FuzzReport()
+
+    for data in corpus:
+        check(data, report, rng)
+    for _ in range(iterations):
+        check(generate(rng, corpus), report, rng)
+
+    return report
@@ -0,0 +1,129 @@
+"""
+Compress large responses on worker processes.
+
+`Lz77.compress` is pure Python and holds the GIL while it runs, so compressing a large
+response on a request thread stalls every other request in the process. Payloads over
+a size threshold are compressed by a process pool instead, while the request thread
+waits without holding the GIL.
+"""
+
+import logging
+import threading
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    TimeoutError as FutureTimeoutError,
+)
+from concurrent.futures.process import BrokenProcessPool
+from time import perf_counter
+from typing import Optional
+
+from v8_server.eamuse.utils.lz77 import Lz77
+from v8_server.utils.metrics import metrics
+from v8_server.utils.workers import worker_pool
+
+
+logger = logging.getLogger(__name__)
+
+
+def _compress(data: bytes, high_ratio: bool) -> bytes:
+    return Lz77(high_ratio=high_ratio).compress(data)
+
+
+class CompressionPool(object):
+    """
+    Lz77 compression that moves payloads of at least `threshold` bytes to a pool of
+    `workers` processes. A `workers` of 0 compresses everything inline.
+
+    If `deadline` is set and the pool hasn't finished a payload within that many
+    seconds, the payload is sent literal-only encoded instead, which is bigger but
+    still valid. `high_ratio` compresses with `Lz77CompressHigh`.
+
+    Without a deadline, payloads queue up for the next free worker while every worker
+    is busy. A worker can't be stopped once it has started on a payload, so with a
+    deadline a payload that missed it keeps its worker busy until it is done. The pool
+    then never takes on more than `workers` payloads at a time, and while every worker
+    is busy new payloads are handled as if they had missed the deadline, instead of
+    queueing up behind work nobody is waiting for.
+    """
+
+    def __init__(
+        self,
+        threshold: int,
+        workers: int,
+        deadline: Optional[float] = None,
+        high_ratio: bool = False,
+    ) -> None:
+        self.threshold = threshold
+        self.workers = workers
+        self.deadline = deadline
+        self.high_ratio = high_ratio
+
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._busy = 0
+
+    def compress(self, data: bytes) -> bytes:
+        if self.workers <= 0 or len(data) < self.threshold:
+            metrics.inc("compression_inline_total")
+            return _compress(data, self.high_ratio)
+
+        start = perf_counter()
+        future = self._submit(data)
+        if future is None:
+            metrics.inc("compression_pool_saturated_total")
+            return Lz77().compress_literal(data)
+
+        metrics.inc("compression_pool_total")
+        try:
+            return future.result(timeout=self.deadline)
+        except FutureTimeoutError:
+            # Leave the worker to finish on its own, the result is simply dropped
+            metrics.inc("compression_pool_fallback_total")
+            logger.warning(
+                f"Compressing {len(data)} bytes took over {self.deadline}s, "
+                "sending it literal-only encoded"
+            )
+            return Lz77().compress_literal(data)
+        finally:
+            metrics.observe("compression_pool_seconds", perf_counter() - start)
+
+    def shutdown(self, wait: bool = False) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _submit(self, data: bytes) -> Optional[Future]:
+        """
+        Hand `data` to a worker, or return None if there is a deadline and every worker
+        is busy
+        """
+        with self._lock:
+            if self.deadline is not None and self._busy >= self.workers:
+                return None
+
+            if self._executor is None:
+                self._executor = self._new_executor()
+
+            try:
+                future = self._executor.submit(_compress, data, self.high_ratio)
+            except BrokenProcessPool:
+                # A worker died, start over with a fresh pool
+                logger.error("Compression pool is broken, restarting it")
+                self._executor = self._new_executor()
+                future = self._executor.submit(_compress, data, self.high_ratio)
+
+            self._busy += 1
+            metrics.gauge("compression_pool_queue_depth", 1)
+
+        future.add_done_callback(self._done)
+        return future
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return worker_pool(self.workers)
+
+    def _done(self, future: Future) -> None:
+        with self._lock:
+            self._busy -= 1
+        metrics.gauge("compression_pool_queue_depth", -1)
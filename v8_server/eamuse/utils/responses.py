@@ -0,0 +1,121 @@
+"""
+Rendered responses that can be sent again without rebuilding them.
+
+A handler can return a `RenderedResponse` instead of an xml tree, and
+`ServiceRequest.response` then only has to compress and encrypt it.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from itertools import count
+from time import monotonic
+from typing import Callable, Hashable, NamedTuple, Optional, Tuple
+
+from kbinxml import KBinXML
+from lxml import etree
+from lxml.etree import _Element as eElement
+
+
+class RenderedResponse(NamedTuple):
+    """
+    A response xml, as text for the request log and kbin encoded to send
+    """
+
+    xml_bytes: bytes
+    xml_bin: bytes
+
+    @classmethod
+    def render(cls, xml: eElement) -> RenderedResponse:
+        xml_bytes = etree.tostring(xml, pretty_print=True)
+        return cls(xml_bytes, KBinXML(xml_bytes).to_binary())
+
+
+class VersionedResponses(object):
+    """
+    Rendered responses per key, for up to `size` keys (least recently used first out).
+    A response stays valid until `bump` is called for its key, which the code that
+    changes whatever the response is built from does once the change is committed, or
+    until it hasn't been used for `idle_timeout` seconds. A size of 0 renders every
+    response.
+
+    Versions come from one counter, so a key that is dropped and added again never gets
+    a version it had before. A response rendered while its key was bumped is never
+    stored, whichever of the two finished first.
+    """
+
+    def __init__(self, size: int, idle_timeout: Optional[float] = None) -> None:
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._versions = count(1)
+        self._entries: OrderedDict[
+            Hashable, Tuple[int, Optional[RenderedResponse], float]
+        ] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, render: Callable[[], eElement]) -> RenderedResponse:
+        """
+        Return the stored response for `key`, or render and store a new one
+        """
+        if self.size <= 0:
+            return RenderedResponse.render(render())
+
+        now = monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = (next(self._versions), None, now)
+                self._add(key, entry)
+            else:
+                if self.idle_timeout is not None:
+                    self._entries[key] = entry[:2] + (now,)
+                self._entries.move_to_end(key)
+        version, response, _ = entry
+        if response is not None:
+            return response
+
+        # Render outside the lock, the version was taken before reading anything
+        response = RenderedResponse.render(render())
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and current[0] == version:
+                self._entries[key] = (version, response, current[2])
+        return response
+
+    def bump(self, key: Hashable) -> None:
+        """
+        Invalidate the stored response for `key`, and any being rendered right now
+        """
+        if self.size <= 0:
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._add(key, (next(self._versions), None, monotonic()))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _add(
+        self, key: Hashable, entry: Tuple[int, Optional[RenderedResponse], float]
+    ) -> None:
+        self._entries[key] = entry
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def _expire(self, now: float) -> None:
+        # Entries are kept in the order they were last used, so the expired ones are
+        # all at the front
+        if self.idle_timeout is None:
+            return
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry[2] <= self.idle_timeout:
+                break
+            del self._entries[key]
@@ -0,0 +1,337 @@
+"""
+Retention for the tables that grow with every credit played.
+
+`play_data` and `hitchart` rows older than a cutoff are moved out of the database into
+gzipped JSON lines files, one file per table per day:
+
+    <archive path>/play_data/2020-10-18.jsonl.gz
+    <archive path>/hitchart/2020-10-18.jsonl.gz
+
+Before the rows are deleted they are folded into summary tables (`personal_bests` and
+`hitchart_archive`) so that personal bests, play counts and the hitchart ranking don't
+change when rows are archived.
+
+Rows are first written to pending files, which are only added to the partitions once
+the rows have been deleted from the database. The transaction that deletes them also
+records the run in `archive_runs`, so if the process dies before the pending files
+have all been added, the next run knows which of the pending files left behind hold
+rows that only exist there, and adds them. Only one run should be active at a time.
+"""
+
+import gzip
+import json
+import logging
+import os
+import shutil
+import uuid
+from collections import Counter
+from datetime import date, datetime
+from pathlib import Path
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple
+
+from flask_sqlalchemy.model import DefaultMeta
+from sqlalchemy import Column, Table, or_, select, text
+from sqlalchemy.types import DateTime, String
+
+from v8_server import db
+from v8_server.model.song import HitChart, HitChartArchive
+from v8_server.model.upsert import greatest, upsert
+from v8_server.model.user import PersonalBest, PlayData
+
+
+BaseModel: DefaultMeta = db.Model
+logger = logging.getLogger(__name__)
+
+ARCHIVED_TABLES: Dict[str, Table] = {
+    "play_data": PlayData.__table__,
+    "hitchart": HitChart.__table__,
+}
+
+ARCHIVE_SUFFIX = ".jsonl.gz"
+PENDING_SUFFIX = ".pending"
+PUBLISH_SUFFIX = ".publish"
+
+# Rows are streamed out of the database this many at a time
+BATCH_SIZE = 5000
+
+
+class ArchiveException(Exception):
+    pass
+
+
+class ArchiveRun(BaseModel):
+    """
+    Table of the archive runs that have deleted their rows from the database, but not
+    yet added all of them to the archive files
+    """
+
+    __tablename__ = "archive_runs"
+    run = Column(String(32), nullable=False, primary_key=True)
+    committed = Column(DateTime, nullable=False)
+
+    def __repr__(self) -> str:
+        return f'ArchiveRun<run: "{self.run}", committed: {self.committed}>'
+
+
+class _PartitionWriter(object):
+    """
+    Writes the rows of a run to pending files next to the day partitions of a single
+    table. Rows are read in `playdate` order, so only one file is ever open at a time.
+    """
+
+    def __init__(self, path: Path, run: str) -> None:
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.run = run
+        self.day: Optional[date] = None
+        self.file: Optional[IO[str]] = None
+        self.pending: List[Path] = []
+
+    def write(self, row: Dict[str, Any]) -> None:
+        day = row["playdate"].date()
+        if day != self.day or self.file is None:
+            self.close()
+            pending = self.path / (
+                f"{day.isoformat()}{ARCHIVE_SUFFIX}.{self.run}{PENDING_SUFFIX}"
+            )
+            self.file = gzip.open(pending, "wt", encoding="UTF-8")
+            self.pending.append(pending)
+            self.day = day
+
+        self.file.write(json.dumps(row, default=_encode_value) + "\n")
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def publish(self) -> None:
+        for pending in self.pending:
+            _publish(pending)
+        self.pending = []
+
+    def discard(self) -> None:
+        self.close()
+        for pending in self.pending:
+            pending.unlink(missing_ok=True)
+        self.pending = []
+
+
+def _split_pending(pending: Path) -> Tuple[Path, str]:
+    """
+    Return the partition a pending file belongs to, and the run that wrote it
+    """
+    name = pending.name[: -len(PENDING_SUFFIX)]
+    partition, run = name.rsplit(".", 1)
+    return pending.with_name(partition), run
+
+
+def _publish(pending: Path) -> None:
+    """
+    Add the rows of a pending file to its partition. A partition that already exists
+    gets them as a new gzip member, which gzip readers handle transparently, and is
+    replaced in one rename so that it is never seen half written.
+
+    If the process dies between the rename and removing the pending file, its rows are
+    added again by the next run. Archiving a row twice is better than losing it.
+    """
+    partition, _ = _split_pending(pending)
+    publishing = partition.with_name(f"{partition.name}{PUBLISH_SUFFIX}")
+    with publishing.open("wb") as f:
+        for part in (partition, pending):
+            if part.exists():
+                with part.open("rb") as src:
+                    shutil.copyfileobj(src, f)
+    os.replace(publishing, partition)
+    pending.unlink()
+
+
+def _recover(archive_path: Path) -> None:
+    """
+    Deal with the files left behind by runs that didn't finish. The pending files of
+    committed runs are added to their partitions, the ones of runs that never
+    committed are removed, since their rows are still in the database.
+    """
+    committed = {run for run, in db.session.query(ArchiveRun.run)}
+
+    for name in ARCHIVED_TABLES:
+        path = archive_path / name
+        # Half written copies, the files they were copied from are still there
+        for publishing in path.glob(f"*{PUBLISH_SUFFIX}"):
+            publishing.unlink()
+
+        for pending in sorted(path.glob(f"*{PENDING_SUFFIX}")):
+            if _split_pending(pending)[1] in committed:
+                logger.warning(f"Adding rows left behind by an earlier run: {pending}")
+                _publish(pending)
+            else:
+                logger.warning(f"Removing rows of a run that didn't commit: {pending}")
+                pending.unlink()
+
+    if committed:
+        db.session.query(ArchiveRun).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def _encode_value(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Can't archive value of type {type(value)}")
+
+
+def _fold_play_data(bests: Dict[Tuple[int, int, int], PersonalBest], row) -> None:
+    key = (row["userid"], row["musicid"], row["seqmode"])
+    summary = PersonalBest(
+        userid=row["userid"],
+        musicid=row["musicid"],
+        seqmode=row["seqmode"],
+        score=row["score"],
+        skill_point=row["skill_point"],
+        clear=bool(row["clear"]),
+        fullcombo=bool(row["fullcombo"]),
+        excellent=bool(row["excellent"]),
+        play_count=1,
+    )
+    if key in bests:
+        bests[key].merge(summary)
+    else:
+        bests[key] = summary
+
+
+def _save_summaries(
+    bests: Dict[Tuple[int, int, int], PersonalBest], hitcounts: Counter
+) -> None:
+    upsert(
+        PersonalBest.__table__,
+        [
+            {c.name: getattr(best, c.name) for c in PersonalBest.__table__.columns}
+            for best in bests.values()
+        ],
+        lambda current, new: {
+            "score": greatest(current["score"], new["score"]),
+            "skill_point": greatest(current["skill_point"], new["skill_point"]),
+            "clear": or_(current["clear"], new["clear"]),
+            "fullcombo": or_(current["fullcombo"], new["fullcombo"]),
+            "excellent": or_(current["excellent"], new["excellent"]),
+            "play_count": current["play_count"] + new["play_count"],
+        },
+    )
+    upsert(
+        HitChartArchive.__table__,
+        [{"musicid": musicid, "count": count} for musicid, count in hitcounts.items()],
+        lambda current, new: {"count": current["count"] + new["count"]},
+    )
+
+
+def archive_rows(archive_path: Path, cutoff: datetime) -> Dict[str, int]:
+    """
+    Move all `play_data` and `hitchart` rows played before `cutoff` into the archive
+    and update the summary tables. Everything is done in a single transaction, and the
+    archived rows are only added to the archive files once it has been committed. Rows
+    left behind by an earlier run that didn't finish are added first.
+
+    Args:
+        archive_path (Path): Root directory of the archive
+        cutoff (datetime): Rows with a `playdate` older than this are archived
+
+    Returns:
+        Dict[str, int]: Number of rows archived per table
+    """
+    _recover(archive_path)
+
+    bests: Dict[Tuple[int, int, int], PersonalBest] = {}
+    hitcounts: Counter = Counter()
+    archived: Dict[str, int] = {}
+    run = uuid.uuid4().hex
+    writers = [_PartitionWriter(archive_path / name, run) for name in ARCHIVED_TABLES]
+
+    try:
+        for writer, (name, table) in zip(writers, ARCHIVED_TABLES.items()):
+            result = db.session.execute(
+                select([table])
+                .where(table.c.playdate < cutoff)
+                .order_by(table.c.playdate)
+            )
+            archived[name] = 0
+
+            try:
+                while rows := result.fetchmany(BATCH_SIZE):
+                    for row in rows:
+                        values = dict(row)
+                        writer.write(values)
+                        archived[name] += 1
+
+                        if table is PlayData.__table__:
+                            _fold_play_data(bests, values)
+                        else:
+                            hitcounts[values["musicid"]] += 1
+            finally:
+                writer.close()
+                result.close()
+
+        _save_summaries(bests, hitcounts)
+        for table in ARCHIVED_TABLES.values():
+            db.session.execute(table.delete().where(table.c.playdate < cutoff))
+        db.session.add(ArchiveRun(run=run, committed=datetime.now()))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        for writer in writers:
+            writer.discard()
+        raise
+
+    # From here on the rows only exist in the pending files, if this doesn't finish
+    # the next run adds them
+    for writer in writers:
+        writer.publish()
+    db.session.query(ArchiveRun).filter(ArchiveRun.run == run).delete(
+        synchronize_session=False
+    )
+    db.session.commit()
+
+    logger.info(f"Archived rows older than {cutoff}: {archived}")
+    return archived
+
+
+def compact_database() -> None:
+    """
+    Reclaim the space freed by archiving and refresh the query planner statistics.
+    Both statements have to run outside of a transaction.
+    """
+    with db.engine.connect() as connection:
+        autocommit = connection.execution_options(isolation_level="AUTOCOMMIT")
+        autocommit.execute(text("VACUUM"))
+        autocommit.execute(text("ANALYZE"))
+
+
+def read_archive(
+    archive_path: Path,
+    table: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Stream archived rows of a table back out of the archive, oldest first.
+
+    Args:
+        archive_path (Path): Root directory of the archive
+        table (str): The archived table name, `play_data` or `hitchart`
+        start (Optional[date]): Only read partitions from this day onwards
+        end (Optional[date]): Only read partitions up to and including this day
+
+    Returns:
+        Iterator[Dict[str, Any]]: One dict per archived row
+    """
+    if table not in ARCHIVED_TABLES:
+        raise ArchiveException(f"Table is not archived: {table}")
+
+    for path in sorted((archive_path / table).glob(f"*{ARCHIVE_SUFFIX}")):
+        day = date.fromisoformat(path.name[: -len(ARCHIVE_SUFFIX)])
+        if (start is not None and day < start) or (end is not None and day > end):
+            continue
+
+        with gzip.open(path, "rt", encoding="UTF-8") as f:
+            for line in f:
+                row = json.loads(line)
+                row["playdate"] = datetime.fromisoformat(row["playdate"])
+                yield row
@@ -0,0 +1,182 @@
+import logging
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from sqlalchemy import bindparam, inspect, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.types import DateTime, String
+
+from v8_server import db
+from v8_server.common.card import CardCipher, CardCipherException
+from v8_server.model.user import Card, PlayData, RefID, UserData
+
+
+logger = logging.getLogger(__name__)
+
+# Cards are encoded and written this many at a time when backfilling
+BACKFILL_BATCH_SIZE = 10000
+
+
+def pack_user_data_int_arrays(connection: Connection) -> int:
+    """
+    Convert `user_data.secret_music` and `user_data.syogo` from the old space separated
+    text format to packed BLOBs. SQLite doesn't enforce column types, so the packed
+    values are written straight into the existing columns. PostgreSQL databases have
+    always been created with BYTEA columns, so there is nothing to convert there.
+
+    Returns:
+        int: The number of rows that were converted
+    """
+    table = UserData.__table__
+
+    # Use a text query so we get the raw stored values rather than having them run
+    # through `PackedIntArray`
+    rows = connection.execute(
+        text("SELECT userid, secret_music, syogo FROM user_data")
+    ).fetchall()
+
+    params = [
+        {
+            "b_userid": userid,
+            "secret_music": table.c.secret_music.type.unpack(secret_music),
+            "syogo": table.c.syogo.type.unpack(syogo),
+        }
+        for userid, secret_music, syogo in rows
+        if isinstance(secret_music, str) or isinstance(syogo, str)
+    ]
+
+    if params:
+        connection.execute(
+            table.update().where(table.c.userid == bindparam("b_userid")), params
+        )
+
+    return len(params)
+
+
+def add_play_data_playdate(connection: Connection) -> int:
+    """
+    Add the `play_data.playdate` column. We don't know when existing rows were played,
+    so they are stamped with the time of the migration.
+
+    Returns:
+        int: The number of rows that were stamped
+    """
+    columns = [c["name"] for c in inspect(connection).get_columns("play_data")]
+    if "playdate" in columns:
+        return 0
+
+    column_type = DateTime().compile(dialect=connection.dialect)
+    connection.execute(text(f"ALTER TABLE play_data ADD COLUMN playdate {column_type}"))
+    result = connection.execute(
+        PlayData.__table__.update().values(playdate=datetime.now())
+    )
+    return result.rowcount
+
+
+def add_card_display_id(connection: Connection) -> int:
+    """
+    Add the indexed `cards.display_id` column. The printed numbers of existing cards are
+    filled in by `backfill_card_display_ids`.
+
+    Returns:
+        int: 1 if the column was added, otherwise 0
+    """
+    table = Card.__table__
+    inspector = inspect(connection)
+
+    added = 0
+    if "display_id" not in [c["name"] for c in inspector.get_columns("cards")]:
+        column_type = table.c.display_id.type.compile(dialect=connection.dialect)
+        connection.execute(
+            text(f"ALTER TABLE cards ADD COLUMN display_id {column_type}")
+        )
+        added = 1
+
+    existing = {index["name"] for index in inspector.get_indexes("cards")}
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(connection)
+
+    return added
+
+
+def backfill_card_display_ids(connection: Connection) -> int:
+    """
+    Fill in `cards.display_id` for every card that doesn't have one yet. The card IDs
+    are encoded in batches with `CardCipher.encode_many`.
+
+    Returns:
+        int: The number of cards that were updated
+    """
+    table = Card.__table__
+    cardids = [
+        row.cardid
+        for row in connection.execute(
+            select([table.c.cardid]).where(table.c.display_id.is_(None))
+        )
+    ]
+
+    updated = 0
+    for start in range(0, len(cardids), BACKFILL_BATCH_SIZE):
+        batch = cardids[start : start + BACKFILL_BATCH_SIZE]
+        try:
+            display_ids: List[Optional[str]] = list(CardCipher.encode_many(batch))
+        except (CardCipherException, ValueError):
+            # Somebody has an odd card, fall back to encoding them one at a time
+            display_ids = [Card.display_id_for(cardid) for cardid in batch]
+
+        params = [
+            {"b_cardid": cardid, "display_id": display_id}
+            for cardid, display_id in zip(batch, display_ids)
+            if display_id is not None
+        ]
+        if params:
+            connection.execute(
+                table.update().where(table.c.cardid == bindparam("b_cardid")), params
+            )
+        updated += len(params)
+
+    return updated
+
+
+def refid_version_to_string(connection: Connection) -> int:
+    """
+    Convert `refids.version`, which holds the game version ("v8") but used to be created
+    as an INTEGER column. SQLite stores the strings in it regardless, PostgreSQL rejects
+    them, so only PostgreSQL tables are converted.
+
+    Returns:
+        int: 1 if the column was converted, otherwise 0
+    """
+    if connection.dialect.name == "sqlite":
+        return 0
+
+    columns = {c["name"]: c for c in inspect(connection).get_columns("refids")}
+    if isinstance(columns["version"]["type"], String):
+        return 0
+
+    column_type = RefID.__table__.c.version.type.compile(dialect=connection.dialect)
+    connection.execute(
+        text(
+            f"ALTER TABLE refids ALTER COLUMN version TYPE {column_type} "
+            "USING version::text"
+        )
+    )
+    return 1
+
+
+# Every migration must be safe to run against an already migrated database
+MIGRATIONS: List[Callable[[Connection], int]] = [
+    pack_user_data_int_arrays,
+    add_play_data_playdate,
+    add_card_display_id,
+    backfill_card_display_ids,
+    refid_version_to_string,
+]
+
+
+def run_migrations() -> None:
+    with db.engine.begin() as connection:
+        for migration in MIGRATIONS:
+            count = migration(connection)
+            logger.info(f"Migration {migration.__name__}: {count} rows updated")
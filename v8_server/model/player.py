@@ -0,0 +1,296 @@
+"""
+Per refid cache of the rows every step of a cabinet session reads.
+
+A card swipe always runs the same sequence of calls: `cardmng.inquire`, `authpass`,
+`cardutil.check`, `gametop.get` and later `gameend.regist`/`customize.regist`, each of
+which used to load the same user again. `load_cardid` prefetches the user, its RefID,
+UserAccount and UserData in one query at `cardmng.inquire`, and the later calls read
+the copy through `lookup`. Writes go to the database first and then to the cached copy,
+and entries nobody has used for `PLAYER_CACHE_IDLE_TIMEOUT` seconds are dropped.
+
+The cache lives in this process only, so it is only safe while every call of a session
+reaches the same process, which nothing enforces when several processes share a
+database. It is on by default for SQLite (a single cabinet server) and off for
+PostgreSQL, see `PLAYER_CACHE_IDLE_TIMEOUT`. Every `cardmng.inquire` reloads the player
+from the database.
+"""
+
+from __future__ import annotations
+
+import threading
+from time import monotonic
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Tuple
+
+from sqlalchemy import and_
+from sqlalchemy.orm import Query
+
+from v8_server import app, db
+from v8_server.model.types import PackedInts
+from v8_server.model.user import (
+    DEFAULT_GAME,
+    DEFAULT_VERSION,
+    Card,
+    RefID,
+    User,
+    UserAccount,
+    UserData,
+)
+from v8_server.utils.metrics import metrics
+
+
+class MissingRefIDException(Exception):
+    pass
+
+
+def packed(column: Any, values: Iterable[int]) -> PackedInts:
+    """
+    Copy the values written to a `PackedIntArray` column as they would be loaded back
+    """
+    return PackedInts(column.type.typecode, values)
+
+
+class AccountState(NamedTuple):
+    """
+    Immutable copy of a `UserAccount` row
+    """
+
+    name: str
+    chara: int
+    is_succession: bool
+
+    @classmethod
+    def from_row(cls, account: UserAccount) -> AccountState:
+        return cls(account.name, account.chara, account.is_succession)
+
+
+class DataState(NamedTuple):
+    """
+    Immutable copy of a `UserData` row
+    """
+
+    style: int
+    style_2: int
+    secret_music: PackedInts
+    secret_chara: int
+    syogo: PackedInts
+    perfect: int
+    great: int
+    good: int
+    poor: int
+    miss: int
+    time: int
+
+    @classmethod
+    def from_row(cls, data: UserData) -> DataState:
+        values = {field: getattr(data, field) for field in cls._fields}
+        values["secret_music"] = packed(UserData.secret_music, values["secret_music"])
+        values["syogo"] = packed(UserData.syogo, values["syogo"])
+        return cls(**values)
+
+
+class PlayerState(NamedTuple):
+    """
+    Everything the session calls need to know about a player. `account` and `data` are
+    None until the player has registered a profile (`cardutil.regist`).
+    """
+
+    userid: int
+    pin: str
+    refid: str
+    account: Optional[AccountState]
+    data: Optional[DataState]
+
+
+class PlayerCache(object):
+    """
+    Thread safe map of refid to `PlayerState`, where entries expire once they haven't
+    been used for `idle_timeout` seconds. A timeout of 0 disables the cache.
+
+    Every write through the cache is numbered, so a state read from the database can't
+    replace the result of a write that was made while it was being read (see
+    `generation`).
+    """
+
+    def __init__(self, idle_timeout: float) -> None:
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[PlayerState, float]] = {}
+        self._last_sweep = monotonic()
+        self._generation = 0
+        # refid -> (generation, time) of the last write
+        self._written: Dict[str, Tuple[int, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, refid: str) -> Optional[PlayerState]:
+        """
+        Return the cached state for a refid and restart its idle timer, or None if it
+        isn't cached or has expired
+        """
+        now = monotonic()
+        with self._lock:
+            entry = self._entries.get(refid)
+            if entry is None:
+                return None
+            state, last_used = entry
+            if now - last_used > self.idle_timeout:
+                del self._entries[refid]
+                return None
+            self._entries[refid] = (state, now)
+            return state
+
+    def generation(self) -> int:
+        """
+        Take this before reading a state from the database, and pass it to `put`
+        """
+        with self._lock:
+            return self._generation
+
+    def put(self, state: PlayerState, generation: Optional[int] = None) -> None:
+        """
+        Cache a state. With the `generation` taken before it was read, the state isn't
+        cached if it has been written to since. Without one, the state is itself a
+        write that has been committed.
+        """
+        if self.idle_timeout <= 0:
+            return
+
+        now = monotonic()
+        with self._lock:
+            if generation is None:
+                self._wrote(state.refid, now)
+            elif self._written.get(state.refid, (0, now))[0] > generation:
+                return
+            self._entries[state.refid] = (state, now)
+            # Players that walked away never come back for their entry, so every so
+            # often drop everything that has expired
+            if now - self._last_sweep > self.idle_timeout:
+                self._entries = {
+                    refid: entry
+                    for refid, entry in self._entries.items()
+                    if now - entry[1] <= self.idle_timeout
+                }
+                self._written = {
+                    refid: written
+                    for refid, written in self._written.items()
+                    if now - written[1] <= self.idle_timeout
+                }
+                self._last_sweep = now
+
+    def update_data(self, refid: str, **values: Any) -> None:
+        """
+        Write new `UserData` values through to the cached copy, once they have been
+        committed to the database. If the copy has no user data to update it is
+        dropped, and the next lookup reloads it.
+        """
+        with self._lock:
+            self._wrote(refid, monotonic())
+            entry = self._entries.get(refid)
+            if entry is None:
+                return
+            state, last_used = entry
+            if state.data is None:
+                del self._entries[refid]
+                return
+            data = state.data._replace(**values)
+            self._entries[refid] = (state._replace(data=data), last_used)
+
+    def discard(self, refid: str) -> None:
+        with self._lock:
+            self._wrote(refid, monotonic())
+            self._entries.pop(refid, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._written.clear()
+
+    def _wrote(self, refid: str, now: float) -> None:
+        if self.idle_timeout > 0:
+            self._generation += 1
+            self._written[refid] = (self._generation, now)
+
+
+# The player cache for this process
+player_cache = PlayerCache(app.config["PLAYER_CACHE_IDLE_TIMEOUT"])
+
+
+def _player_query() -> Query:
+    """
+    The user with its RefID, UserAccount and UserData, all in one query
+    """
+    return (
+        db.session.query(User, RefID, UserAccount, UserData)
+        .outerjoin(UserAccount, UserAccount.userid == User.userid)
+        .outerjoin(UserData, UserData.userid == User.userid)
+    )
+
+
+def _to_state(row: Tuple[User, RefID, UserAccount, UserData]) -> PlayerState:
+    user, refid, account, data = row
+    return PlayerState(
+        user.userid,
+        user.pin,
+        refid.refid,
+        AccountState.from_row(account) if account is not None else None,
+        DataState.from_row(data) if data is not None else None,
+    )
+
+
+def load_cardid(cardid: str) -> Optional[PlayerState]:
+    """
+    Load the player a card belongs to from the database and cache it. Returns None for
+    a card we don't know, and raises `MissingRefIDException` for a card whose user has
+    no RefID for this game.
+    """
+    generation = player_cache.generation()
+    row = (
+        _player_query()
+        # An outer join, so a user without a RefID is found by the same query
+        .outerjoin(
+            RefID,
+            and_(
+                RefID.userid == User.userid,
+                RefID.game == DEFAULT_GAME,
+                RefID.version == DEFAULT_VERSION,
+            ),
+        )
+        .join(Card, Card.userid == User.userid)
+        .filter(Card.cardid == cardid)
+        .one_or_none()
+    )
+    if row is None:
+        return None
+    if row[1] is None:
+        raise MissingRefIDException(f"User {row[0].userid} has no RefID")
+
+    state = _to_state(row)
+    player_cache.put(state, generation)
+    return state
+
+
+def lookup(refid: str) -> Optional[PlayerState]:
+    """
+    Return the player a refid belongs to, from the cache if possible. Returns None for
+    a refid we don't know.
+    """
+    state = player_cache.get(refid)
+    if state is not None:
+        metrics.inc("player_cache_hits_total")
+        return state
+
+    metrics.inc("player_cache_misses_total")
+    generation = player_cache.generation()
+    row = (
+        _player_query()
+        .join(RefID, RefID.userid == User.userid)
+        .filter(RefID.refid == refid)
+        .one_or_none()
+    )
+    if row is None:
+        return None
+
+    state = _to_state(row)
+    player_cache.put(state, generation)
+    return state
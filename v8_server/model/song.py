@@ -2,16 +2,29 @@ from __future__ import annotations
 
 import json
 import logging
+import threading
 from datetime import datetime
 from pathlib import Path
-from typing import List
+from time import monotonic
+from types import MappingProxyType
+from typing import Dict, List, Mapping, NamedTuple, Optional
 
 from flask_sqlalchemy.model import DefaultMeta
-from sqlalchemy import Column, ForeignKey, PrimaryKeyConstraint, event, func, text
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    PrimaryKeyConstraint,
+    bindparam,
+    event,
+    func,
+    select,
+    union_all,
+)
+from sqlalchemy.engine import Connection
 from sqlalchemy.orm import relationship
 from sqlalchemy.types import DateTime, Integer, String
 
-from v8_server import db
+from v8_server import app, db
 
 
 BaseModel: DefaultMeta = db.Model
@@ -52,13 +65,20 @@ class HitChart(BaseModel):
 
     @classmethod
     def get_ranking(cls, count) -> List[int]:
+        # Combine the live play counts with the counts of rows that have been archived
+        live = select(
+            [HitChart.musicid, func.count(HitChart.musicid).label("count")]
+        ).group_by(HitChart.musicid)
+        archived = select([HitChartArchive.musicid, HitChartArchive.count])
+        counts = union_all(live, archived).alias("counts")
+
+        total = func.sum(counts.c.count).label("count")
+
         items = (
-            db.session.query(
-                HitChart.musicid, func.count(HitChart.musicid).label("count")
-            )
-            .group_by(HitChart.musicid)
-            .order_by(text("count DESC"))
-            .order_by(HitChart.musicid.desc())
+            db.session.query(counts.c.musicid, total)
+            .group_by(counts.c.musicid)
+            .order_by(total.desc())
+            .order_by(counts.c.musicid.desc())
             .limit(count)
             .all()
         )
@@ -70,34 +90,193 @@ class HitChart(BaseModel):
         return results
 
 
-def insert_initial_song_data(target, connection, **kwargs) -> None:
-    # Make sure both Song and HitChart have been created
-    try:
-        db.session.execute("SELECT * FROM songs")
-        db.session.execute("SELECT * FROM hitchart")
-    except Exception:
-        return
+class HitChartArchive(BaseModel):
+    """
+    Table holding the number of hitchart rows per song that have been moved to the
+    archive, so that the ranking still counts them
+    """
+
+    __tablename__ = "hitchart_archive"
+    musicid = Column(
+        Integer, ForeignKey("songs.musicid"), nullable=False, primary_key=True
+    )
+    count = Column(Integer, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"HitChartArchive<musicid: {self.musicid}, count: {self.count}>"
+
+
+# The song database shipped with the server
+MDB_PATH = Path(__file__).parent / "data" / "mdb.json"
+
+
+class CatalogSong(NamedTuple):
+    """
+    Immutable copy of a `Song` row
+    """
+
+    musicid: int
+    bpm: int
+    title_ascii: str
 
-    # Load up the mdb.json file
-    data_path = Path(__file__).parent / "data" / "mdb.json"
-    with data_path.open() as f:
+
+class ImportResult(NamedTuple):
+    added: int
+    updated: int
+
+
+# The in-memory song catalog, see `get_catalog`
+_catalog: Optional[Mapping[int, CatalogSong]] = None
+_catalog_checked = 0.0
+_catalog_lock = threading.Lock()
+
+
+def read_mdb(path: Path = MDB_PATH) -> Dict[int, CatalogSong]:
+    """
+    Read the songs out of an mdb.json file
+    """
+    with path.open() as f:
         json_data = json.loads(f.read())
 
-    for key, song in json_data["musicdb"]["songs"].items():
-        song_obj = Song(musicid=key, bpm=song["bpm"], title_ascii=song["title_ascii"])
-        db.session.add(song_obj)
+    return {
+        int(key): CatalogSong(int(key), song["bpm"], song["title_ascii"])
+        for key, song in json_data["musicdb"]["songs"].items()
+    }
 
-    db.session.commit()
 
-    # Insert initial hitchart data, just add one entry for every song with the current
-    # timestamp
-    now = datetime.now()
-    for key, song in json_data["musicdb"]["songs"].items():
-        hc = HitChart(musicid=key, playdate=now)
-        db.session.add(hc)
+def import_songs(
+    connection: Connection, songs: Mapping[int, CatalogSong]
+) -> ImportResult:
+    """
+    Bring the songs table in line with `songs`. Only songs that are new or have changed
+    are written, each with a single executemany. Songs that are no longer in `songs` are
+    kept, since play data may still refer to them.
 
-    db.session.commit()
+    Every newly added song also gets one hitchart entry so that it shows up in the
+    ranking.
+
+    Args:
+        connection (Connection): Connection to import with, the caller controls the
+            transaction
+        songs (Mapping[int, CatalogSong]): The full song list, keyed by musicid
+
+    Returns:
+        ImportResult: The number of songs added and updated
+    """
+    table = Song.__table__
+    existing = {
+        row.musicid: CatalogSong(row.musicid, row.bpm, row.title_ascii)
+        for row in connection.execute(select([table]))
+    }
+
+    added = [song for musicid, song in songs.items() if musicid not in existing]
+    updated = [
+        song
+        for musicid, song in songs.items()
+        if musicid in existing and existing[musicid] != song
+    ]
+
+    if added:
+        now = datetime.now()
+        connection.execute(table.insert(), [song._asdict() for song in added])
+        connection.execute(
+            HitChart.__table__.insert(),
+            [{"musicid": song.musicid, "playdate": now} for song in added],
+        )
+
+    if updated:
+        connection.execute(
+            table.update().where(table.c.musicid == bindparam("b_musicid")),
+            [
+                {
+                    "b_musicid": song.musicid,
+                    "bpm": song.bpm,
+                    "title_ascii": song.title_ascii,
+                }
+                for song in updated
+            ],
+        )
+
+    return ImportResult(len(added), len(updated))
+
+
+def insert_initial_song_data(target, connection, **kwargs) -> None:
+    # This runs once the hitchart table has been created, which also means the songs
+    # table it depends on exists
+    if not MDB_PATH.exists():
+        logger.warning(f"No song data found at {MDB_PATH}, skipping song import")
+        return
+
+    result = import_songs(connection, read_mdb())
+    logger.info(f"Imported {result.added} songs")
 
 
-event.listen(Song.__table__, "after_create", insert_initial_song_data)
 event.listen(HitChart.__table__, "after_create", insert_initial_song_data)
+
+
+def get_catalog() -> Mapping[int, CatalogSong]:
+    """
+    Return the read-only `musicid -> CatalogSong` map. It is loaded from the database
+    the first time it is needed and then shared by every request, so handlers can check
+    songs without a query.
+
+    Songs can be imported while the server is running (`flask import-songs` runs in its
+    own process), so every `SONG_CATALOG_CHECK_INTERVAL` seconds the number of songs in
+    the database is compared with the catalog, which is reloaded if they differ. Songs
+    are never deleted, so this catches every new song.
+    """
+    global _catalog, _catalog_checked
+
+    interval = app.config["SONG_CATALOG_CHECK_INTERVAL"]
+    catalog = _catalog
+    if catalog is not None and monotonic() - _catalog_checked < interval:
+        return catalog
+
+    with _catalog_lock:
+        # Another thread may have checked while this one was waiting
+        if _catalog is not None and monotonic() - _catalog_checked < interval:
+            return _catalog
+
+        if _catalog is None or _count_songs() != len(_catalog):
+            _catalog = _load_catalog()
+        _catalog_checked = monotonic()
+
+    return _catalog
+
+
+def reload_catalog() -> Mapping[int, CatalogSong]:
+    """
+    Reload the in-memory catalog, for example after the songs have been re-imported
+    """
+    global _catalog, _catalog_checked
+
+    with _catalog_lock:
+        _catalog = _load_catalog()
+        _catalog_checked = monotonic()
+
+    return _catalog
+
+
+def _count_songs() -> int:
+    return db.session.execute(
+        select([func.count()]).select_from(Song.__table__)
+    ).scalar()
+
+
+def _load_catalog() -> Mapping[int, CatalogSong]:
+    rows = db.session.execute(select([Song.__table__]))
+    return MappingProxyType(
+        {
+            row.musicid: CatalogSong(row.musicid, row.bpm, row.title_ascii)
+            for row in rows
+        }
+    )
+
+
+def is_known_song(musicid: int) -> bool:
+    """
+    Check a musicid against the catalog. If no songs have been imported at all there is
+    nothing to check against, so every musicid is accepted.
+    """
+    catalog = get_catalog()
+    return not catalog or musicid in catalog
@@ -1,6 +1,8 @@
-from typing import List
+import sys
+from array import array
+from typing import Iterable, List, Optional, Union
 
-from sqlalchemy.types import String, TypeDecorator
+from sqlalchemy.types import LargeBinary, String, TypeDecorator
 
 
 class IntArray(TypeDecorator):
@@ -22,3 +24,66 @@ class IntArray(TypeDecorator):
         if value is None:
             return []
         return [int(x) for x in value.split()]
+
+
+class PackedInts(array):
+    """
+    An `array.array` of ints as loaded from a `PackedIntArray` column
+    """
+
+    def to_xml_text(self) -> str:
+        """
+        Return the values as the space separated text that kbin xml expects for an
+        array node (`__count="n"`)
+        """
+        return " ".join(map(str, self))
+
+
+class PackedIntArray(TypeDecorator):
+    """
+    Fixed length int array stored as a packed little endian BLOB.
+
+    Args:
+        typecode (str): `array` typecode of a single element, such as "H" for u16
+        length (int): The number of elements every value must have
+    """
+
+    impl = LargeBinary
+
+    def __init__(self, typecode: str, length: int, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.typecode = typecode
+        self.length = length
+
+    def pack(self, value: Iterable[int]) -> bytes:
+        values = PackedInts(self.typecode, value)
+        if len(values) != self.length:
+            raise ValueError(
+                f"Expected {self.length} values for a packed int array, "
+                f"got {len(values)}"
+            )
+
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values.tobytes()
+
+    def unpack(self, value: Union[bytes, str]) -> PackedInts:
+        # Rows that haven't been migrated yet still hold the old space separated text
+        if isinstance(value, str):
+            return PackedInts(self.typecode, [int(x) for x in value.split()])
+
+        values = PackedInts(self.typecode)
+        values.frombytes(value)
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values
+
+    def process_bind_param(self, value, dialect) -> Optional[bytes]:
+        if value is None:
+            return None
+        return self.pack(value)
+
+    def process_result_value(self, value, dialect) -> PackedInts:
+        if value is None:
+            return PackedInts(self.typecode)
+        return self.unpack(value)
@@ -0,0 +1,82 @@
+"""
+Dialect aware `INSERT ... ON CONFLICT DO UPDATE` helpers
+"""
+
+from typing import Any, Callable, Dict, List
+
+from sqlalchemy import Table, and_, literal
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.types import Integer
+
+from v8_server import db
+
+
+try:
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+except ImportError:  # SQLAlchemy < 1.4 can't emit ON CONFLICT for SQLite
+    sqlite_insert = None
+
+
+# Given the table columns and the values being inserted (`excluded`), both indexed by
+# column name, return the column values to set when the row already exists
+UpdateBuilder = Callable[[Any, Any], Dict[str, Any]]
+
+
+class greatest(FunctionElement):  # noqa: N801
+    """
+    The larger of two values. PostgreSQL calls this `greatest`, SQLite uses the multi
+    argument form of `max`.
+    """
+
+    type = Integer()
+    name = "greatest"
+
+
+@compiles(greatest)
+def _compile_greatest(element, compiler, **kwargs) -> str:
+    return f"greatest({compiler.process(element.clauses, **kwargs)})"
+
+
+@compiles(greatest, "sqlite")
+def _compile_greatest_sqlite(element, compiler, **kwargs) -> str:
+    return f"max({compiler.process(element.clauses, **kwargs)})"
+
+
+def upsert(table: Table, rows: List[Dict[str, Any]], update: UpdateBuilder) -> None:
+    """
+    Insert `rows` into `table`, updating the existing row instead whenever one with
+    the same primary key already exists.
+
+    Args:
+        table (Table): The table to write to
+        rows (List[Dict[str, Any]]): Full rows to insert, keyed by column name
+        update (UpdateBuilder): Builds the values to set on a conflicting row
+    """
+    if not rows:
+        return
+
+    dialect = db.session.get_bind().dialect.name
+    insert = {"postgresql": postgresql_insert, "sqlite": sqlite_insert}.get(dialect)
+    keys = [c.name for c in table.primary_key.columns]
+
+    if insert is not None:
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys, set_=update(table.c, stmt.excluded)
+        )
+        db.session.execute(stmt, rows)
+        return
+
+    # No ON CONFLICT support, so try to update each row and insert it if nothing was
+    # there to update
+    for row in rows:
+        excluded = {k: literal(v, type_=table.c[k].type) for k, v in row.items()}
+        result = db.session.execute(
+            table.update()
+            .where(and_(*[table.c[k] == row[k] for k in keys]))
+            .values(update(table.c, excluded))
+        )
+        if result.rowcount == 0:
+            db.session.execute(table.insert().values(row))
@@ -1,22 +1,96 @@
 from __future__ import annotations
 
+import logging
 import random
-from typing import Optional
+from datetime import datetime
+from typing import Callable, List, Optional, TypeVar
 
 from flask_sqlalchemy.model import DefaultMeta
-from sqlalchemy import JSON, Column, ForeignKey, UniqueConstraint
+from sqlalchemy import (
+    JSON,
+    Column,
+    ForeignKey,
+    PrimaryKeyConstraint,
+    UniqueConstraint,
+    cast,
+    func,
+    inspect,
+    text,
+)
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import relationship
-from sqlalchemy.types import Boolean, Integer, String
+from sqlalchemy.types import Boolean, DateTime, Integer, String
 
 from v8_server import db
-from v8_server.model.types import IntArray
+from v8_server.common.card import CardCipher, CardCipherException
+from v8_server.model.types import PackedIntArray
 
 
+logger = logging.getLogger(__name__)
+
 BaseModel: DefaultMeta = db.Model
 
 DEFAULT_GAME = "GFDM"
 DEFAULT_VERSION = "v8"
 
+# How many random candidates we try before giving up on allocating a unique id. With
+# 90 million ExtIDs and 2^64 RefIDs a collision is already rare, so hitting this limit
+# means something else is wrong.
+MAX_ID_ATTEMPTS = 8
+
+T = TypeVar("T")
+
+
+class IDAllocationException(Exception):
+    pass
+
+
+def begin_transaction() -> None:
+    """
+    Make sure the session's connection is inside a database transaction. The pysqlite
+    driver only starts one right before an INSERT/UPDATE/DELETE, so a SAVEPOINT issued
+    first would become the outermost transaction, and releasing it would commit.
+    """
+    connection = db.session.connection()
+    dbapi_connection = connection.connection.connection
+    if getattr(dbapi_connection, "in_transaction", True) is False:
+        connection.execute(text("BEGIN"))
+
+
+def insert_unique(make: Callable[[], T]) -> T:
+    """
+    Insert a row with a randomly generated primary key, relying on the table's unique
+    constraints to detect collisions rather than probing for them first.
+
+    Every attempt is flushed inside a SAVEPOINT so that a collision only rolls back the
+    failed insert and leaves the rest of the caller's transaction intact. Nothing is
+    committed here, that is left up to the caller. Only a collision on the new id is
+    retried, any other constraint violation is raised straight away.
+
+    Args:
+        make (Callable[[], T]): Builds a new model object with a fresh random id
+
+    Returns:
+        T: The model object that was successfully inserted
+    """
+    begin_transaction()
+    for _ in range(MAX_ID_ATTEMPTS):
+        obj = make()
+        try:
+            with db.session.begin_nested():
+                db.session.add(obj)
+        except IntegrityError:
+            # Generating another id can't fix anything but a clash on the id itself
+            mapper = inspect(type(obj))
+            if db.session.query(mapper).get(mapper.primary_key_from_instance(obj)):
+                continue
+            raise
+        return obj
+
+    raise IDAllocationException(
+        f"Unable to allocate a unique id after {MAX_ID_ATTEMPTS} attempts"
+    )
+
 
 class User(BaseModel):
     """
@@ -84,9 +158,9 @@ class UserData(BaseModel):
     userid = Column(Integer, ForeignKey("users.userid"), primary_key=True)
     style = Column(Integer, nullable=False)
     style_2 = Column(Integer, nullable=False)
-    secret_music = Column(IntArray, nullable=False)
+    secret_music = Column(PackedIntArray("H", 32), nullable=False)
     secret_chara = Column(Integer, nullable=False)
-    syogo = Column(IntArray, nullable=False)
+    syogo = Column(PackedIntArray("h", 2), nullable=False)
     perfect = Column(Integer, nullable=False)
     great = Column(Integer, nullable=False)
     good = Column(Integer, nullable=False)
@@ -126,9 +200,90 @@ class PlayData(BaseModel):
     difficulty = Column(Integer, nullable=False)
     combo_rate = Column(Integer, nullable=False)
     perfect_rate = Column(Integer, nullable=False)
+    playdate = Column(DateTime, nullable=False, default=datetime.now)
     user = relationship("User", back_populates="play_data")
 
 
+class PersonalBest(BaseModel):
+    """
+    Summary of the play data that has been moved to the archive. One row per user,
+    song and sequence mode.
+    """
+
+    __tablename__ = "personal_bests"
+    __table_args__ = (PrimaryKeyConstraint("userid", "musicid", "seqmode"),)
+    userid = Column(Integer, ForeignKey("users.userid"), nullable=False)
+    musicid = Column(Integer, nullable=False)
+    seqmode = Column(Integer, nullable=False)
+    score = Column(Integer, nullable=False)
+    skill_point = Column(Integer, nullable=False)
+    clear = Column(Boolean, nullable=False)
+    fullcombo = Column(Boolean, nullable=False)
+    excellent = Column(Boolean, nullable=False)
+    play_count = Column(Integer, nullable=False)
+
+    def __repr__(self) -> str:
+        return (
+            f"PersonalBest<userid: {self.userid}, musicid: {self.musicid}, "
+            f"seqmode: {self.seqmode}, score: {self.score}, "
+            f"skill_point: {self.skill_point}, play_count: {self.play_count}>"
+        )
+
+    @classmethod
+    def lookup(cls, userid: int, musicid: int, seqmode: int) -> Optional[PersonalBest]:
+        """
+        Return the user's best result for a song, combining the live play data with
+        the archived summary. The returned object is not attached to the session.
+        """
+        live = (
+            db.session.query(
+                func.max(PlayData.score),
+                func.max(PlayData.skill_point),
+                func.max(cast(PlayData.clear, Integer)),
+                func.max(cast(PlayData.fullcombo, Integer)),
+                func.max(cast(PlayData.excellent, Integer)),
+                func.count(PlayData.playid),
+            )
+            .filter(
+                PlayData.userid == userid,
+                PlayData.musicid == musicid,
+                PlayData.seqmode == seqmode,
+            )
+            .one()
+        )
+        archived = db.session.query(PersonalBest).get((userid, musicid, seqmode))
+
+        if live[5] == 0 and archived is None:
+            return None
+
+        best = PersonalBest(
+            userid=userid,
+            musicid=musicid,
+            seqmode=seqmode,
+            score=live[0] or 0,
+            skill_point=live[1] or 0,
+            clear=bool(live[2]),
+            fullcombo=bool(live[3]),
+            excellent=bool(live[4]),
+            play_count=live[5],
+        )
+        if archived is not None:
+            best.merge(archived)
+
+        return best
+
+    def merge(self, other: PersonalBest) -> None:
+        """
+        Fold another summary for the same user/song/seqmode into this one
+        """
+        self.score = max(self.score, other.score)
+        self.skill_point = max(self.skill_point, other.skill_point)
+        self.clear = self.clear or other.clear
+        self.fullcombo = self.fullcombo or other.fullcombo
+        self.excellent = self.excellent or other.excellent
+        self.play_count += other.play_count
+
+
 class Card(BaseModel):
     """
     Table representing a card associated with a user. Users may have zero or more cards
@@ -139,11 +294,67 @@ class Card(BaseModel):
     __tablename__ = "cards"
 
     cardid = Column(String(16), nullable=False, primary_key=True)
+    # The card number as printed on the back of the card, so support lookups don't need
+    # to decode anything. Filled in from `cardid` whenever a card is inserted.
+    display_id = Column(
+        String(16),
+        nullable=True,
+        index=True,
+        default=lambda context: Card.display_id_for(
+            context.get_current_parameters()["cardid"]
+        ),
+    )
     userid = Column(Integer, ForeignKey("users.userid"), nullable=False)
     user = relationship("User", back_populates="card")
 
     def __repr__(self) -> str:
-        return f'Card<cardid: "{self.cardid}", userid: {self.userid}>'
+        return (
+            f'Card<cardid: "{self.cardid}", display_id: "{self.display_id}", '
+            f"userid: {self.userid}>"
+        )
+
+    @staticmethod
+    def display_id_for(cardid: str) -> Optional[str]:
+        """
+        Return the printed card number for a card ID, or None if the card ID can't be
+        encoded
+        """
+        try:
+            return CardCipher.encode(cardid)
+        except (CardCipherException, ValueError):
+            logger.warning(f"Unable to encode card ID: {cardid}")
+            return None
+
+    @classmethod
+    def from_display_id(cls, display_id: str) -> Optional[Card]:
+        """
+        Find a card by the number printed on it. Dashes, spaces, lowercase and
+        confusable characters are accepted, same as `CardCipher.decode`.
+        """
+        q = db.session.query(Card).filter(
+            Card.display_id == CardCipher.clean(display_id)
+        )
+        return q.one_or_none()
+
+    @classmethod
+    def search_display_id(cls, prefix: str, limit: int = 50) -> List[Card]:
+        """
+        Find the cards whose printed number starts with `prefix`, ordered by number.
+
+        The prefix match is written as a range on `display_id` so that it is always an
+        index range scan, whatever the database does with `LIKE`.
+        """
+        prefix = CardCipher.clean(prefix)
+        if any(c not in CardCipher.VALID_CHARS for c in prefix):
+            return []
+
+        q = db.session.query(Card)
+        if prefix:
+            # All valid characters are ASCII, so bumping the last character of the
+            # prefix gives the first string that sorts after every match
+            end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            q = q.filter(Card.display_id >= prefix, Card.display_id < end)
+        return q.order_by(Card.display_id).limit(limit).all()
 
 
 class ExtID(BaseModel):
@@ -163,7 +374,11 @@ class ExtID(BaseModel):
         return f'ExtID<extid: {self.extid}, game: "{self.game}", userid: {self.userid}>'
 
     @classmethod
-    def create_with_userid(cls, userid: int) -> Optional[ExtID]:
+    def create_with_userid(cls, userid: int) -> ExtID:
+        """
+        Return the user's GFDM ExtID, creating a new unique one if they don't have one
+        yet. The caller is responsible for committing.
+        """
         # First check if this user has an ExtID for GFDM
         extid = (
             db.session.query(ExtID)
@@ -172,17 +387,13 @@ class ExtID(BaseModel):
         )
 
         if extid is None:
-            # Create a new ExtID that is unique
-            while True:
-                extid_val = random.randint(0, 89999999) + 10000000
-                count = db.session.query(ExtID).filter(ExtID.extid == extid_val).count()
-                if count == 0:
-                    break
-
-            # Use this ExtID
-            extid = ExtID(extid=extid_val, game=DEFAULT_GAME, userid=userid)
-            db.session.add(extid)
-            db.session.commit()
+            extid = insert_unique(
+                lambda: ExtID(
+                    extid=random.randint(0, 89999999) + 10000000,
+                    game=DEFAULT_GAME,
+                    userid=userid,
+                )
+            )
 
         return extid
 
@@ -204,14 +415,14 @@ class RefID(BaseModel):
     )
     refid = Column(String(16), nullable=False, primary_key=True)
     game = Column(String(32), nullable=False)
-    version = Column(Integer, nullable=False)
+    version = Column(String(8), nullable=False)
     userid = Column(Integer, ForeignKey("users.userid"), nullable=False)
     user = relationship("User", back_populates="refids")
 
     def __repr__(self) -> str:
         return (
-            f'RefID<refid: {self.refid}, game: "{self.game}", version: {self.version} '
-            f"userid: {self.userid}>"
+            f'RefID<refid: {self.refid}, game: "{self.game}", '
+            f'version: "{self.version}" userid: {self.userid}>'
         )
 
     @classmethod
@@ -230,26 +441,23 @@ class RefID(BaseModel):
 
     @classmethod
     def create_with_userid(cls, userid: int) -> RefID:
+        """
+        Create a new unique RefID (and ExtID if needed) for the user. The caller is
+        responsible for committing.
+        """
         # Create the ExtID
         # This method will return an already existing ExtID or create a new one and
         # return it. In this case we don't care what it returns
         _ = ExtID.create_with_userid(userid)
 
-        # Create a new RefID that is unique
-        while True:
-            refid_val = "".join(random.choice("0123456789ABCDEF") for _ in range(16))
-            count = db.session.query(RefID).filter(RefID.refid == refid_val).count()
-            if count == 0:
-                break
-
-        # Use our newly created RefID
-        refid = RefID(
-            refid=refid_val, game=DEFAULT_GAME, version=DEFAULT_VERSION, userid=userid
+        return insert_unique(
+            lambda: RefID(
+                refid=f"{random.getrandbits(64):016X}",
+                game=DEFAULT_GAME,
+                version=DEFAULT_VERSION,
+                userid=userid,
+            )
         )
-        db.session.add(refid)
-        db.session.commit()
-
-        return refid
 
 
 class Profile(BaseModel):
@@ -0,0 +1,73 @@
+"""
+Simple in-process metrics, exposed in the Prometheus text format on `/metrics`
+"""
+
+import threading
+from collections import defaultdict
+from typing import DefaultDict, Dict, List, Tuple
+
+
+class Metrics(object):
+    """
+    Thread safe counters, gauges and timers. Names should follow the Prometheus
+    conventions, counters end in `_total` and timers in `_seconds`.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: DefaultDict[str, float] = defaultdict(float)
+        self._gauges: DefaultDict[str, float] = defaultdict(float)
+        self._timers: Dict[str, Tuple[int, float]] = {}
+
+    def inc(self, name: str, value: float = 1) -> None:
+        """
+        Increase a counter
+        """
+        with self._lock:
+            self._counters[name] += value
+
+    def gauge(self, name: str, delta: float) -> None:
+        """
+        Move a gauge up or down by `delta`
+        """
+        with self._lock:
+            self._gauges[name] += delta
+
+    def observe(self, name: str, seconds: float) -> None:
+        """
+        Record how long something took
+        """
+        with self._lock:
+            count, total = self._timers.get(name, (0, 0.0))
+            self._timers[name] = (count + 1, total + seconds)
+
+    def get(self, name: str) -> float:
+        """
+        Return the current value of a counter or gauge, mostly useful for tests
+        """
+        with self._lock:
+            if name in self._gauges:
+                return self._gauges[name]
+            return self._counters.get(name, 0)
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text format
+        """
+        lines: List[str] = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                lines += [f"# TYPE {name} counter", f"{name} {value:g}"]
+            for name, value in sorted(self._gauges.items()):
+                lines += [f"# TYPE {name} gauge", f"{name} {value:g}"]
+            for name, (count, total) in sorted(self._timers.items()):
+                lines += [
+                    f"# TYPE {name} summary",
+                    f"{name}_count {count}",
+                    f"{name}_sum {total:.6f}",
+                ]
+        return "\n".join(lines) + "\n"
+
+
+# The metrics for this process
+metrics = Metrics()
@@ -0,0 +1,112 @@
+"""
+Count the SQL statements run on behalf of each service request, and the time spent
+running them.
+
+Every statement any engine runs is recorded to the `QueryStats` of the current context
+(see `contextvars`). `ServiceRequest` starts new stats for every request it reads, and
+`count_queries` collects everything run inside a `with` block, including any requests
+handled inside it, which is what the tests use to put a limit on the statements a call
+may run.
+"""
+
+import re
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Statements that only differ in their whitespace are counted as the same one
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+class QueryStats(object):
+    """
+    The statements run in a context. Statements are also recorded to the `parent`
+    stats, if there is one.
+    """
+
+    def __init__(self, parent: Optional["QueryStats"] = None, scope: bool = False):
+        self.parent = parent
+        self.scope = scope
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Counter = Counter()
+        self._started: Optional[float] = None
+
+    def record(self, statement: str, seconds: float) -> None:
+        statement = WHITESPACE_RE.sub(" ", statement).strip()
+        stats: Optional[QueryStats] = self
+        while stats is not None:
+            stats.count += 1
+            stats.seconds += seconds
+            stats.statements[statement] += 1
+            stats = stats.parent
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """
+        Return the statements that were run at least `threshold` times, which usually
+        means something is loading rows one at a time in a loop (N+1 queries)
+        """
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+    def __repr__(self) -> str:
+        return f"QueryStats<count: {self.count}, seconds: {self.seconds:.6f}>"
+
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def _scope() -> Optional[QueryStats]:
+    """
+    The innermost `count_queries` block of the current context
+    """
+    stats = _current.get()
+    while stats is not None and not stats.scope:
+        stats = stats.parent
+    return stats
+
+
+def track_queries() -> QueryStats:
+    """
+    Start new stats for the current context, replacing the previous request's
+    """
+    stats = QueryStats(_scope())
+    _current.set(stats)
+    return stats
+
+
+@contextmanager
+def count_queries() -> Iterator[QueryStats]:
+    """
+    Count the statements run inside the `with` block
+    """
+    stats = QueryStats(_scope(), scope=True)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is not None:
+        stats._started = perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is not None and stats._started is not None:
+        stats.record(statement, perf_counter() - stats._started)
+        stats._started = None
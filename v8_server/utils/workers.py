@@ -0,0 +1,54 @@
+"""
+Process pools for the codecs (Lz77 compression, ARC extraction).
+
+The server runs request threads, and forking a threaded process can copy locks some
+other thread was holding, so workers start from a fresh interpreter instead. A fresh
+interpreter has to import `v8_server` to find the function it was handed, which would
+set up the whole app: open the log files, create the database tables and print the
+DEV MODE banner, once per worker. The workers are named so that the package can tell
+it is being imported by one (see `in_worker`) and leave all of that out.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.context import SpawnContext, SpawnProcess
+from typing import Any, Callable, Optional, Tuple
+
+
+WORKER_PREFIX = "v8_server-worker-"
+
+
+class WorkerProcess(SpawnProcess):
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.name = WORKER_PREFIX + self.name
+
+
+class WorkerContext(SpawnContext):
+    # A spawned process takes on its name before it imports anything, even before it
+    # re-imports the main module of the process that started it
+    Process = WorkerProcess
+
+
+def in_worker() -> bool:
+    """
+    Whether this process was started by `worker_pool`
+    """
+    return multiprocessing.current_process().name.startswith(WORKER_PREFIX)
+
+
+def worker_pool(
+    workers: Optional[int] = None,
+    initializer: Optional[Callable[..., None]] = None,
+    initargs: Tuple[Any, ...] = (),
+) -> ProcessPoolExecutor:
+    """
+    A process pool of `workers` processes (one per CPU by default) that don't set up
+    the app when they import `v8_server`
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=WorkerContext(),
+        initializer=initializer,
+        initargs=initargs,
+    )
@@ -1 +1,2 @@
 import v8_server.view.index  # noqa: F401
+import v8_server.view.metrics  # noqa: F401
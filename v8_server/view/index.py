@@ -1,10 +1,9 @@
-import importlib
 from typing import Dict, Tuple
 
 from flask import request
 
 from v8_server import app
-from v8_server.eamuse.services import ServiceRequest, Services
+from v8_server.eamuse.services import ServiceRequest, Services, get_handler
 
 
 FlaskResponse = Tuple[bytes, Dict[str, str]]
@@ -37,34 +36,8 @@ def catch_all(u_path: str) -> str:
 
 @app.route(f"{Services.SERVICE_ROUTE}/<int:route>/", methods=["POST"])
 def service_service(route: int) -> FlaskResponse:
-    # TODO: Ideally we want to simplify this where we send the request to some method
-    # that handles checking the module/method/etc and dispaches it to the correct
-    # function rather than having this if chain in here. I'd like to keep the view as
-    # simple as possible
     req = ServiceRequest(request)
-
-    if req.method is not None:
-        method = req.method.title().replace("_", "")
-        try:
-            module = importlib.import_module(f"v8_server.eamuse.services.{req.module}")
-        except ModuleNotFoundError:
-            app.logger.error(f"No Module found for request: {req}")
-            raise
-
-        try:
-            cls = getattr(module, method)
-        except AttributeError:
-            app.logger.error(f"No Class found for request: {req}")
-            raise
-
-        inst = cls(req)
-        app.logger.debug(inst)
-        response = inst.response()
-    else:
-        print(route)
-        raise Exception(f"Not sure how to handle this Request: {req}")
-
-    return req.response(response)
+    return req.response(get_handler(req).response())
 
 
 @app.route(Services.SERVICES_ROUTE, methods=["POST"])
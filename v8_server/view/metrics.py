@@ -0,0 +1,9 @@
+from typing import Dict, Tuple
+
+from v8_server import app
+from v8_server.utils.metrics import metrics
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_view() -> Tuple[str, int, Dict[str, str]]:
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
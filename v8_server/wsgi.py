@@ -0,0 +1,96 @@
+"""
+A thin WSGI app for the routes cabinets post to, mounted ahead of Flask when
+`SERVICE_FAST_LANE` is set (`V8_SERVICE_FAST_LANE=1`).
+
+A cabinet only ever posts to `Services.SERVICES_ROUTE` and `Services.SERVICE_ROUTE`,
+always with the same kind of body. These requests are handled straight from the WSGI
+environ, without Flask's URL routing, request context, `request` proxy or response
+object. Every other request falls through to the Flask app.
+"""
+
+import logging
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from flask import Flask
+from werkzeug.datastructures import EnvironHeaders
+from werkzeug.wsgi import get_content_length, get_input_stream
+
+from v8_server.eamuse.services import ServiceRequest, Services, get_handler
+
+
+logger = logging.getLogger(__name__)
+
+Environ = Dict[str, Any]
+StartResponse = Callable[[str, List[Tuple[str, str]]], Any]
+WsgiApp = Callable[[Environ, StartResponse], Iterable[bytes]]
+
+# `Services.SERVICE_ROUTE`/<int:route>/, see `v8_server.view.index`
+SERVICE_RE = re.compile(re.escape(Services.SERVICE_ROUTE) + r"/\d+/")
+
+
+class EnvironRequest(object):
+    """
+    The parts of a `flask.Request` that `ServiceRequest` uses, read straight from the
+    WSGI environ
+    """
+
+    def __init__(self, environ: Environ) -> None:
+        self.environ = environ
+        self.headers = EnvironHeaders(environ)
+        self.content_length: Optional[int] = get_content_length(environ)
+        # ServiceRequest never reads past the content length, so the raw stream is
+        # safe to use here
+        self.stream = environ["wsgi.input"]
+
+    def get_data(self) -> bytes:
+        return get_input_stream(self.environ).read()
+
+
+def is_service_request(environ: Environ) -> bool:
+    """
+    Whether the request is a cabinet call to one of the service routes
+    """
+    if environ.get("REQUEST_METHOD") != "POST":
+        return False
+    path = environ.get("PATH_INFO", "")
+    return path == Services.SERVICES_ROUTE or SERVICE_RE.fullmatch(path) is not None
+
+
+class ServiceFastLane(object):
+    """
+    WSGI middleware that serves the service routes itself and passes every other
+    request on to `wsgi_app`
+    """
+
+    def __init__(self, flask_app: Flask, wsgi_app: WsgiApp) -> None:
+        self.flask_app = flask_app
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ: Environ, start_response: StartResponse):
+        if not is_service_request(environ):
+            return self.wsgi_app(environ, start_response)
+
+        try:
+            with self.flask_app.app_context():
+                data, headers = self.handle(environ)
+        except Exception:
+            if self.flask_app.propagate_exceptions:
+                raise
+            logger.exception(f"Exception on {environ.get('PATH_INFO')} [POST]")
+            data = b"Internal Server Error"
+            headers = {"Content-Type": "text/plain"}
+            status = "500 INTERNAL SERVER ERROR"
+        else:
+            status = "200 OK"
+
+        header_list = list(headers.items())
+        header_list.append(("Content-Length", str(len(data))))
+        start_response(status, header_list)
+        return [data]
+
+    def handle(self, environ: Environ) -> Tuple[bytes, Dict[str, str]]:
+        req = ServiceRequest(EnvironRequest(environ))
+        if environ["PATH_INFO"] == Services.SERVICES_ROUTE:
+            return req.response(Services().get_services())
+        return req.response(get_handler(req).response())